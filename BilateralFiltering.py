@@ -5,8 +5,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingOutputRasterLayer,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterNumber)
-import cv2
-import rasterio
 
 class BilateralFiltering(QgsProcessingAlgorithm):
     """
@@ -77,6 +75,18 @@ class BilateralFiltering(QgsProcessingAlgorithm):
         )
 
     def processAlgorithm(self, parameters, context, feedback):
+
+        # OpenCV and rasterio are only loaded when the filter runs, not with the plugin
+        try:
+            import cv2
+            import rasterio
+
+        except Exception as e:
+            feedback.reportError(QCoreApplication.translate('Error','%s'%(e)))
+            feedback.reportError(QCoreApplication.translate('Error',' '))
+            feedback.reportError(QCoreApplication.translate('Error','Error loading modules - please install the opencv-python and rasterio python modules'))
+            return {}
+
         input_raster = self.parameterAsRasterLayer(parameters, self.INPUT, context)
         output_layer_path = self.parameterAsOutputLayer(parameters, self.FILTERED_IMAGE, context)
         N = self.parameterAsInt(parameters, self.N, context)
@@ -100,6 +110,8 @@ class BilateralFiltering(QgsProcessingAlgorithm):
         return {self.FILTERED_IMAGE: output_layer_path}
 
     def array_to_raster(self, array, bounds, metadata, output_path):
+        import rasterio
+
         # Write array to raster using rasterio
         with rasterio.open(output_path, 'w', **metadata) as dst:
             dst.write(array, 1)
\ No newline at end of file
@@ -0,0 +1,134 @@
+"""
+Name : Tent Extraction With Classifier
+Group : model
+"""
+
+from qgis.core import QgsProcessing, QgsProcessingUtils
+from qgis.core import QgsProcessingAlgorithm
+from qgis.core import QgsProcessingMultiStepFeedback
+from qgis.core import QgsProcessingParameterRasterLayer
+from qgis.core import QgsProcessingParameterFile
+from qgis.core import QgsProcessingParameterFeatureSink
+from qgis import processing
+
+
+class TentExtractionWithClassifier(QgsProcessingAlgorithm):
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterRasterLayer('satellite_image', 'Satellite Image', defaultValue=None))
+        self.addParameter(QgsProcessingParameterFile('classifier_model', 'Pixel Classifier Model', extension='joblib', defaultValue=None))
+        self.addParameter(QgsProcessingParameterFeatureSink('Structures', 'Structures', type=QgsProcessing.TypeVectorAnyGeometry, createByDefault=True, defaultValue=None))
+
+    def processAlgorithm(self, parameters, context, model_feedback):
+        # Use a multi-step feedback, so that individual child algorithm progress reports are adjusted for the
+        # overall progress through the model
+        steps = 4
+        feedback = QgsProcessingMultiStepFeedback(steps, model_feedback)
+        results = {}
+        outputs = {}
+
+        # Classify Structures
+        # The trained classifier replaces the F1/F3 thresholding and the bare areas masking
+        alg_params = {
+            'INPUT': parameters['satellite_image'],
+            'MODEL': parameters['classifier_model'],
+            'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
+        }
+
+        feedback.pushInfo("Running algorithm: Classify Structure Pixels")
+
+        outputs['ClassifyStructures'] = processing.run('IDP_Sites_Mapping:pixelclassification', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+
+        feedback.setCurrentStep(1)
+        if feedback.isCanceled():
+            return {}
+
+        # IDP Camp Binary
+        alg_params = {
+            'in': outputs['ClassifyStructures']['OUTPUT'],
+            'out': QgsProcessingUtils.generateTempFilename('builtUpBinary.tif'),
+            'channel': 1,
+            'structype': 'box',
+            'xradius': 1,
+            'yradius': 1,
+            'filter': 'opening',
+            'filter.opening.foreval': 1,
+            'filter.opening.backval': 0,
+            'outputpixeltype': 5  # float
+        }
+
+        feedback.pushInfo("Running algorithm: Compute Binary Morphological Operation on the IDP Binary")
+
+        outputs['IdpCampBinary'] = processing.run('otb:BinaryMorphologicalOperation', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+
+        feedback.setCurrentStep(2)
+        if feedback.isCanceled():
+            return {}
+
+        # Polygonize Structures
+        alg_params = {
+            'BAND': 1,
+            'EIGHT_CONNECTEDNESS': False,
+            'EXTRA': '',
+            'FIELD': 'DN',
+            'INPUT': outputs['IdpCampBinary']['out'],
+            'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
+        }
+
+        feedback.pushInfo("Running algorithm: Polygonize Built Up Areas Layer")
+
+        outputs['PolygonizeStructures'] = processing.run('gdal:polygonize', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+
+        feedback.setCurrentStep(3)
+        if feedback.isCanceled():
+            return {}
+
+        # Extract by attribute
+        alg_params = {
+            'FIELD': 'DN',
+            'INPUT': outputs['PolygonizeStructures']['OUTPUT'],
+            'OPERATOR': 0,  # =
+            'VALUE': '1',
+            'OUTPUT': parameters['Structures']
+        }
+
+        feedback.pushInfo("Running algorithm: Extract the Built Up Areas by Attribute")
+
+        outputs['ExtractByAttribute'] = processing.run('native:extractbyattribute', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+
+        feedback.setCurrentStep(4)
+        if feedback.isCanceled():
+            return {}
+
+        feedback.pushInfo("Running algorithm: Writing Final Layer")
+
+        results['Structures'] = outputs['ExtractByAttribute']['OUTPUT']
+        return results
+
+    def name(self):
+        return 'TentExtractionWithClassifier'
+
+    def displayName(self):
+        return 'Tent Extraction With Classifier'
+
+    def group(self):
+        return 'Segmentation'
+
+    def groupId(self):
+        return 'segmentation'
+
+    def shortHelpString(self):
+        return """<html><body>
+<p>Supervised alternative to the Tent Extraction model. Instead of per scene thresholds on F1, F3 and the bare areas, a pixel classifier trained once with the Train Pixel Classifier tool labels the structure pixels tile by tile, after which the mask is cleaned and polygonized as in Tent Extraction.</p>
+<h2>Input parameters</h2>
+<h3>Satellite Image</h3>
+<p>An RGB True color channel Satellite Imagery to be used for classification. It should be acquired with a sensor and processing level similar to the imagery the classifier was trained on.</p>
+<h3>Pixel Classifier Model</h3>
+<p>A .joblib model saved by the Train Pixel Classifier tool. The same model can be applied to many scenes without retraining.</p>
+<h2>Outputs</h2>
+<h3>Structures</h3>
+<p>A polygon layer that represents the tented areas and the structures.</p>
+<br><p align="right">Algorithm author: Pascal Ogola</p><p align="right">Help author: Pascal Ogola</p><p align="right">Algorithm version: v1</p></body></html>"""
+
+    def createInstance(self):
+        return TentExtractionWithClassifier()
@@ -9,15 +9,21 @@ from qgis.core import QgsProcessingAlgorithm
 from qgis.core import QgsProcessingMultiStepFeedback
 from qgis.core import QgsProcessingParameterRasterLayer
 from qgis.core import QgsProcessingParameterVectorLayer
+from qgis.core import QgsProcessingParameterBoolean
+from qgis.core import QgsProcessingParameterNumber
 from qgis.core import QgsProcessingParameterFeatureSink
-from qgis import processing
+from qgis.core import QgsProcessingParameterFile
+from .checkpoints import StageRunner
 
 
 class TentExtraction(QgsProcessingAlgorithm):
 
     def initAlgorithm(self, config=None):
         self.addParameter(QgsProcessingParameterRasterLayer('satellite_image', 'Satellite Image', defaultValue=None))
-        self.addParameter(QgsProcessingParameterVectorLayer('sample_bare_areas', 'Sample Bare Areas', types=[QgsProcessing.TypeVectorPoint], defaultValue=None))
+        self.addParameter(QgsProcessingParameterVectorLayer('sample_bare_areas', 'Sample Bare Areas', types=[QgsProcessing.TypeVectorPoint], defaultValue=None, optional=True))
+        self.addParameter(QgsProcessingParameterBoolean('auto_bare_areas', 'Derive Bare Areas Automatically', defaultValue=False))
+        self.addParameter(QgsProcessingParameterNumber('sieve_min_pixels', 'Minimum Structure Size (pixels)', type=QgsProcessingParameterNumber.Integer, minValue=0, defaultValue=4))
+        self.addParameter(QgsProcessingParameterFile('checkpoint_dir', 'Checkpoint Folder', behavior=QgsProcessingParameterFile.Folder, optional=True, defaultValue=None))
         self.addParameter(QgsProcessingParameterFeatureSink('Structures', 'Structures', type=QgsProcessing.TypeVectorAnyGeometry, createByDefault=True, defaultValue=None))
 
     def processAlgorithm(self, parameters, context, model_feedback):
@@ -27,6 +33,8 @@ class TentExtraction(QgsProcessingAlgorithm):
         feedback = QgsProcessingMultiStepFeedback(steps, model_feedback)
         results = {}
         outputs = {}
+        # Child algorithms run as named stages, checkpointed when a folder is given
+        stages = StageRunner(self.parameterAsFile(parameters, 'checkpoint_dir', context), context, feedback)
 
         # split raster bands
         # Split the Raster Image into Single Bands
@@ -50,7 +58,7 @@ class TentExtraction(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Running algorithm: Split Raster Bands")
 
-        outputs['SplitRasterBands'] = processing.run('grass7:r.rgb', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['SplitRasterBands'] = stages.run('SplitRasterBands', 'grass7:r.rgb', alg_params)
 
         feedback.setCurrentStep(1)
         if feedback.isCanceled():
@@ -87,7 +95,7 @@ class TentExtraction(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Running algorithm: compute G edge")
 
-        outputs['ComputeG'] = processing.run('qgis:rastercalculator', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['ComputeG'] = stages.run('ComputeG', 'qgis:rastercalculator', alg_params)
         # feedback.pushInfo(f"Raster calculation result saved to: {outputs['ComputeG']['OUTPUT']}")
         
         feedback.setCurrentStep(2)
@@ -108,7 +116,7 @@ class TentExtraction(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Running algorithm: Compute r edge")
 
-        outputs['ComputeR'] = processing.run('qgis:rastercalculator', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['ComputeR'] = stages.run('ComputeR', 'qgis:rastercalculator', alg_params)
 
         feedback.setCurrentStep(3)
         if feedback.isCanceled():
@@ -128,7 +136,7 @@ class TentExtraction(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Running algorithm: Compute Absolute Difference Green")
 
-        outputs['ComputeAbsoluteDifferenceGreen'] = processing.run('qgis:rastercalculator', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['ComputeAbsoluteDifferenceGreen'] = stages.run('ComputeAbsoluteDifferenceGreen', 'qgis:rastercalculator', alg_params)
 
         feedback.setCurrentStep(4)
         if feedback.isCanceled():
@@ -148,7 +156,7 @@ class TentExtraction(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Running algorithm: Compute Absolute Difference Red")
 
-        outputs['ComputeAbsoluteDifferenceRed'] = processing.run('qgis:rastercalculator', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['ComputeAbsoluteDifferenceRed'] = stages.run('ComputeAbsoluteDifferenceRed', 'qgis:rastercalculator', alg_params)
 
         feedback.setCurrentStep(5)
         if feedback.isCanceled():
@@ -169,7 +177,7 @@ class TentExtraction(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Running algorithm: Compute F1 B")
 
-        outputs['ComputeF1B'] = processing.run('qgis:rastercalculator', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['ComputeF1B'] = stages.run('ComputeF1B', 'qgis:rastercalculator', alg_params)
 
         feedback.setCurrentStep(6)
         if feedback.isCanceled():
@@ -183,7 +191,7 @@ class TentExtraction(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Running algorithm: Compute F1 Layer Statistics")
 
-        outputs['F1LayerStatistics'] = processing.run('native:rasterlayerstatistics', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['F1LayerStatistics'] = stages.run('F1LayerStatistics', 'native:rasterlayerstatistics', alg_params)
 
         feedback.setCurrentStep(7)
         if feedback.isCanceled():
@@ -200,7 +208,7 @@ class TentExtraction(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Running algorithm: Normalize F1")
 
-        outputs['NormalizeF1'] = processing.run('native:fuzzifyrasterlinearmembership', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['NormalizeF1'] = stages.run('NormalizeF1', 'native:fuzzifyrasterlinearmembership', alg_params)
 
         feedback.setCurrentStep(8)
         if feedback.isCanceled():
@@ -224,7 +232,7 @@ class TentExtraction(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Running algorithm: compute f3 part a")
 
-        outputs['ComputeF3PartA'] = processing.run('qgis:rastercalculator', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['ComputeF3PartA'] = stages.run('ComputeF3PartA', 'qgis:rastercalculator', alg_params)
 
         feedback.setCurrentStep(9)
         if feedback.isCanceled():
@@ -244,7 +252,7 @@ class TentExtraction(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Running algorithm: Compute f3 part b")
 
-        outputs['ComputeF3PartB'] = processing.run('qgis:rastercalculator', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['ComputeF3PartB'] = stages.run('ComputeF3PartB', 'qgis:rastercalculator', alg_params)
 
         feedback.setCurrentStep(10)
         if feedback.isCanceled():
@@ -258,7 +266,7 @@ class TentExtraction(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Running algorithm: Compute F3 Layer Statistics")
 
-        outputs['F3LayerStatistics'] = processing.run('native:rasterlayerstatistics', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['F3LayerStatistics'] = stages.run('F3LayerStatistics', 'native:rasterlayerstatistics', alg_params)
 
         feedback.setCurrentStep(11)
         if feedback.isCanceled():
@@ -275,7 +283,7 @@ class TentExtraction(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Running algorithm: Normalize F3")
 
-        outputs['NormalizeF3'] = processing.run('native:fuzzifyrasterlinearmembership', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['NormalizeF3'] = stages.run('NormalizeF3', 'native:fuzzifyrasterlinearmembership', alg_params)
 
         feedback.setCurrentStep(12)
         if feedback.isCanceled():
@@ -301,37 +309,49 @@ class TentExtraction(QgsProcessingAlgorithm):
         # Log current step and run the algorithm
         feedback.pushInfo("Running algorithm: Compute Soil Brightness")
 
-        outputs['ComputeSoilBrightness'] = processing.run('otb:RadiometricIndices', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['ComputeSoilBrightness'] = stages.run('ComputeSoilBrightness', 'otb:RadiometricIndices', alg_params)
 
         feedback.setCurrentStep(13)
         if feedback.isCanceled():
             return {}
 
-        # Sample Soil BI
-        alg_params = {
-            'COLUMN_PREFIX': 'BI',
-            'INPUT': parameters['sample_bare_areas'],
-            'RASTERCOPY': outputs['ComputeSoilBrightness']['out'],
-            'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-        }
+        # Derive the bare areas range by clustering when no samples were digitized
+        if self.parameterAsBoolean(parameters, 'auto_bare_areas', context) or not parameters.get('sample_bare_areas'):
+            alg_params = {
+                'INPUT': parameters['satellite_image'],
+                'SOIL_BRIGHTNESS': outputs['ComputeSoilBrightness']['out']
+            }
 
-        feedback.pushInfo("Running algorithm: Sample Soil Brightness")
+            feedback.pushInfo("Running algorithm: Compute Bare Area Range with Clustering")
 
-        outputs['SampleSoilBi'] = processing.run('native:rastersampling', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+            outputs['BareAreasStatistics'] = stages.run('BareAreasStatistics', 'IDP_Sites_Mapping:computebarearangewithclustering', alg_params)
 
-        feedback.setCurrentStep(14)
-        if feedback.isCanceled():
-            return {}
+        else:
+            # Sample Soil BI
+            alg_params = {
+                'COLUMN_PREFIX': 'BI',
+                'INPUT': parameters['sample_bare_areas'],
+                'RASTERCOPY': outputs['ComputeSoilBrightness']['out'],
+                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
+            }
 
-        # Bare Areas Statistics
-        alg_params = {
-            'FIELD_NAME': 'BI1',
-            'INPUT_LAYER': outputs['SampleSoilBi']['OUTPUT']
-        }
+            feedback.pushInfo("Running algorithm: Sample Soil Brightness")
+
+            outputs['SampleSoilBi'] = stages.run('SampleSoilBi', 'native:rastersampling', alg_params)
 
-        feedback.pushInfo("Running algorithm: Compute Bare Area Statistics")
+            feedback.setCurrentStep(14)
+            if feedback.isCanceled():
+                return {}
 
-        outputs['BareAreasStatistics'] = processing.run('qgis:basicstatisticsforfields', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+            # Bare Areas Statistics
+            alg_params = {
+                'FIELD_NAME': 'BI1',
+                'INPUT_LAYER': outputs['SampleSoilBi']['OUTPUT']
+            }
+
+            feedback.pushInfo("Running algorithm: Compute Bare Area Statistics")
+
+            outputs['BareAreasStatistics'] = stages.run('BareAreasStatistics', 'qgis:basicstatisticsforfields', alg_params)
 
         feedback.setCurrentStep(15)
         if feedback.isCanceled():
@@ -347,7 +367,7 @@ class TentExtraction(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Running algorithm: Compute Bare Areas")
 
-        outputs['ComputeBareAreas'] = processing.run('IDP_Sites_Mapping:rasterclassificationusingcomputedranges', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['ComputeBareAreas'] = stages.run('ComputeBareAreas', 'IDP_Sites_Mapping:rasterclassificationusingcomputedranges', alg_params)
 
         feedback.setCurrentStep(16)
         if feedback.isCanceled():
@@ -378,7 +398,7 @@ class TentExtraction(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Running algorithm: Compute Bare Areas Inverse")
 
-        outputs['InvertBareareas'] = processing.run('gdal:rastercalculator', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['InvertBareareas'] = stages.run('InvertBareareas', 'gdal:rastercalculator', alg_params)
 
         feedback.setCurrentStep(17)
         if feedback.isCanceled():
@@ -395,7 +415,7 @@ class TentExtraction(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Running algorithm: Compute F1 Threshold")
 
-        outputs['ComputeF1Threshold'] = processing.run('IDP_Sites_Mapping:computethresholdwithotsu', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['ComputeF1Threshold'] = stages.run('ComputeF1Threshold', 'IDP_Sites_Mapping:computethresholdwithotsu', alg_params)
 
         feedback.setCurrentStep(18)
         if feedback.isCanceled():
@@ -416,7 +436,7 @@ class TentExtraction(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Running algorithm: Segment F1")
 
-        outputs['SegmentF1'] = processing.run('IDP_Sites_Mapping:segmentationusingthresholding', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['SegmentF1'] = stages.run('SegmentF1', 'IDP_Sites_Mapping:segmentationusingthresholding', alg_params)
 
         feedback.setCurrentStep(19)
         if feedback.isCanceled():
@@ -430,7 +450,7 @@ class TentExtraction(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Running algorithm: Compute F3 Threshold")
 
-        outputs['ComputeF3Threshold'] = processing.run('IDP_Sites_Mapping:computethresholdwithotsu', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['ComputeF3Threshold'] = stages.run('ComputeF3Threshold', 'IDP_Sites_Mapping:computethresholdwithotsu', alg_params)
 
         feedback.setCurrentStep(20)
         if feedback.isCanceled():
@@ -451,7 +471,7 @@ class TentExtraction(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Running algorithm: Segment F3")
 
-        outputs['SegmentF3'] = processing.run('IDP_Sites_Mapping:segmentationusingthresholding', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['SegmentF3'] = stages.run('SegmentF3', 'IDP_Sites_Mapping:segmentationusingthresholding', alg_params)
 
         feedback.setCurrentStep(21)
         if feedback.isCanceled():
@@ -482,7 +502,7 @@ class TentExtraction(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Running algorithm: Compute Built Up Areas")
 
-        outputs['ComputeBuiltAreas'] = processing.run('gdal:rastercalculator', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['ComputeBuiltAreas'] = stages.run('ComputeBuiltAreas', 'gdal:rastercalculator', alg_params)
 
         feedback.setCurrentStep(22)
         if feedback.isCanceled():
@@ -513,7 +533,7 @@ class TentExtraction(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Running algorithm: Compute Built Up Soils Difference")
 
-        outputs['BuiltUpSoilsDifference'] = processing.run('gdal:rastercalculator', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['BuiltUpSoilsDifference'] = stages.run('BuiltUpSoilsDifference', 'gdal:rastercalculator', alg_params)
 
         feedback.setCurrentStep(23)
         if feedback.isCanceled():
@@ -536,25 +556,47 @@ class TentExtraction(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Running algorithm: Compute Binary Morphological Operation on the IDP Binary")
 
-        outputs['IdpCampBinary'] = processing.run('otb:BinaryMorphologicalOperation', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['IdpCampBinary'] = stages.run('IdpCampBinary', 'otb:BinaryMorphologicalOperation', alg_params)
 
         feedback.setCurrentStep(24)
         if feedback.isCanceled():
             return {}
 
+        structureMask = outputs['IdpCampBinary']['out']
+        sieve_min_pixels = self.parameterAsInt(parameters, 'sieve_min_pixels', context)
+
+        # Sieve Structure Mask
+        # Drop the specks surviving the opening so they are never polygonized
+        if sieve_min_pixels > 0:
+            alg_params = {
+                'INPUT': structureMask,
+                'MIN_PIXELS': sieve_min_pixels,
+                'CONNECTIVITY': 0,  # 4, as used by Polygonize
+                'OUTPUT': QgsProcessingUtils.generateTempFilename('sievedBinary.tif')
+            }
+
+            feedback.pushInfo("Running algorithm: Sieve Structure Mask")
+
+            outputs['SieveStructureMask'] = stages.run('SieveStructureMask', 'IDP_Sites_Mapping:sievestructuremask', alg_params)
+
+            if feedback.isCanceled():
+                return {}
+
+            structureMask = outputs['SieveStructureMask']['OUTPUT']
+
         # Polygonize Structures
         alg_params = {
             'BAND': 1,
             'EIGHT_CONNECTEDNESS': False,
             'EXTRA': '',
             'FIELD': 'DN',
-            'INPUT': outputs['IdpCampBinary']['out'],
+            'INPUT': structureMask,
             'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
         }
 
         feedback.pushInfo("Running algorithm: Polygonize Built Up Areas Layer")
 
-        outputs['PolygonizeStructures'] = processing.run('gdal:polygonize', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['PolygonizeStructures'] = stages.run('PolygonizeStructures', 'gdal:polygonize', alg_params)
 
         feedback.setCurrentStep(25)
         if feedback.isCanceled():
@@ -571,7 +613,7 @@ class TentExtraction(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Running algorithm: Extract the Built Up Areas by Attribute")
 
-        outputs['ExtractByAttribute'] = processing.run('native:extractbyattribute', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        outputs['ExtractByAttribute'] = stages.run('ExtractByAttribute', 'native:extractbyattribute', alg_params, final=True)
 
         feedback.setCurrentStep(26)
         if feedback.isCanceled():
@@ -604,9 +646,15 @@ class TentExtraction(QgsProcessingAlgorithm):
 <p>An RGB True color channel Satellite Imagery to be used for classifiication. Due to the processing time,smaller tiles are preffered for efficient processing.</p>
 <h3>Sample Bare Areas</h3>
 <p>A point layer containing bare areas that have been sampled representatively across the image to be analayzed. Given the image variablity, bare areas with varying characterisitcs should be sampled. At least 80 points across an image. The image should not have any other attribute besides the id. Each image should have only the bare areas sampled on that specific image as there can be great variations between images and this will result to misleading information.</p>
+<h3>Derive Bare Areas Automatically</h3>
+<p>When checked, or when no Sample Bare Areas layer is given, a random subsample of the image pixels is clustered with mini-batch k-means on chromaticity and Soil Brightness and the bare soil cluster provides the Soil Brightness range. This removes the manual sampling step at the cost of some control over the bare areas definition.</p>
+<h3>Minimum Structure Size (pixels)</h3>
+<p>Structures of the binary mask covering fewer pixels than this are removed before polygonization, which drops the 1 to 3 pixel specks that survive the morphological opening and greatly reduces the number of polygons to clean. Set to 0 to disable the sieve.</p>
+<h3>Checkpoint Folder</h3>
+<p>Optional folder keeping the intermediate rasters and layers of every step together with a checkpoints.json manifest of the step parameters and input files. Running the model again with the same folder reuses the steps whose parameters and inputs did not change and restarts from the first step that is missing or out of date, so a failure late in the model does not lose the earlier work. The final Structures layer is always written again. Use one folder per image.</p>
 <h2>Outputs</h2>
 <h3>Structures</h3>
-<p>This is apolygon layer that represents that tented areas and the structure. Some post processing should be undertaken to eliminate other structures. Use the rectanglify tool to clean the polygons and make them representative of the tents. One post processing is to compute a difference with then known IDP Camp areas. However care should be taken to only use this approach if/when the IDP camps have already been updated. If not, then a manual cleaning would be prefereable.</p>
+<p>This is apolygon layer that represents that tented areas and the structure. Some post processing should be undertaken to eliminate other structures. Use the Rectanglify Structures tool (Processing Tools) to clean the polygons and make them representative of the tents. One post processing is to compute a difference with then known IDP Camp areas. However care should be taken to only use this approach if/when the IDP camps have already been updated. If not, then a manual cleaning would be prefereable.</p>
 <style type="text/css">
 </style></head><body style=" font-family:'MS Shell Dlg 2'; font-size:8.25pt; font-weight:400; font-style:normal;">
 <p style=" margin-top:0px; margin-bottom:0px; margin-left:0px; margin-right:0px; -qt-block-indent:0; text-indent:0px;">Todo</p></body></html></p><br><p align="right">Algorithm author: Pascal Ogola</p><p align="right">Help author: Pascal Ogola</p><p align="right">Algorithm version: v1</p></body></html>"""
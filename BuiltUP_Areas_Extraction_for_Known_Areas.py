@@ -5,10 +5,13 @@ Group : model
 
 import os
 from qgis.core import QgsProcessing, QgsRasterLayer, QgsProcessingUtils
+from qgis.core import QgsFeatureRequest, QgsRectangle, QgsProcessingException
 from qgis.core import QgsProcessingAlgorithm
 from qgis.core import QgsProcessingMultiStepFeedback
 from qgis.core import QgsProcessingParameterRasterLayer
 from qgis.core import QgsProcessingParameterVectorLayer
+from qgis.core import QgsProcessingParameterBoolean
+from qgis.core import QgsProcessingParameterNumber
 from qgis.core import QgsProcessingParameterFeatureSink
 from qgis import processing
 
@@ -17,9 +20,13 @@ class TentExtractionForKnownAreas(QgsProcessingAlgorithm):
 
     def initAlgorithm(self, config=None):
         self.addParameter(QgsProcessingParameterRasterLayer('satellite_image', 'Satellite Image', defaultValue=None))
-        self.addParameter(QgsProcessingParameterVectorLayer('sample_bare_areas', 'Sample Bare Areas', types=[QgsProcessing.TypeVectorPoint], defaultValue=None))
+        self.addParameter(QgsProcessingParameterVectorLayer('sample_bare_areas', 'Sample Bare Areas', types=[QgsProcessing.TypeVectorPoint], defaultValue=None, optional=True))
+        self.addParameter(QgsProcessingParameterBoolean('auto_bare_areas', 'Derive Bare Areas Automatically', defaultValue=False))
         self.addParameter(QgsProcessingParameterVectorLayer('known_idp_areas', 'Known IDP Sites', types=[QgsProcessing.TypeVectorPolygon], defaultValue=None, optional=True))
         self.addParameter(QgsProcessingParameterVectorLayer('buildings', 'Buildings Layer', types=[QgsProcessing.TypeVectorPolygon], defaultValue=None, optional=True))
+        self.addParameter(QgsProcessingParameterBoolean('raster_masking', 'Mask Sites and Buildings in the Raster Domain', defaultValue=False))
+        self.addParameter(QgsProcessingParameterBoolean('roi_processing', 'Process Known IDP Sites Windows Only', defaultValue=False))
+        self.addParameter(QgsProcessingParameterNumber('sieve_min_pixels', 'Minimum Structure Size (pixels)', type=QgsProcessingParameterNumber.Integer, minValue=0, defaultValue=4))
         self.addParameter(QgsProcessingParameterFeatureSink('builtup', 'Built Up Areas', type=QgsProcessing.TypeVectorAnyGeometry, createByDefault=True, defaultValue=None))
         self.addParameter(QgsProcessingParameterFeatureSink('Structures', 'Structures', type=QgsProcessing.TypeVectorAnyGeometry, createByDefault=True, defaultValue=None))
 
@@ -34,6 +41,39 @@ class TentExtractionForKnownAreas(QgsProcessingAlgorithm):
         # Access the input parameters
         known_idp_areasLayer = self.parameterAsLayer(parameters, 'known_idp_areas', context)
         buildingsLayer = self.parameterAsLayer(parameters, 'buildings', context)
+        raster_masking = self.parameterAsBoolean(parameters, 'raster_masking', context) and bool(known_idp_areasLayer or buildingsLayer)
+        roi_processing = self.parameterAsBoolean(parameters, 'roi_processing', context) and bool(known_idp_areasLayer)
+
+        if buildingsLayer:
+            # Only load the buildings on the scene, in the image CRS
+            satelliteImage = self.parameterAsRasterLayer(parameters, 'satellite_image', context)
+            extent = satelliteImage.extent()
+            alg_params = {
+                'INPUT': buildingsLayer,
+                'EXTENT': '{},{},{},{} [{}]'.format(extent.xMinimum(), extent.xMaximum(), extent.yMinimum(), extent.yMaximum(), satelliteImage.crs().authid()),
+                'TARGET_CRS': satelliteImage.crs(),
+                'OUTPUT': QgsProcessingUtils.generateTempFilename('sceneBuildings.gpkg')
+            }
+            feedback.pushInfo("Running algorithm: Extract Buildings in Scene Extent")
+
+            outputs['SceneBuildings'] = processing.run('IDP_Sites_Mapping:extractfeaturesinextent', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+
+            if feedback.isCanceled():
+                return {}
+
+            buildingsLayer = outputs['SceneBuildings']['OUTPUT']
+
+        if roi_processing:
+            # Run the raster pipeline on the windows around the buffered sites only
+            outputs['ExtractByAttribute'] = self.processSiteWindows(parameters, context, feedback, known_idp_areasLayer)
+            if outputs['ExtractByAttribute'] is None:
+                return {}
+
+            feedback.setCurrentStep(26)
+            feedback.pushInfo("Running algorithm: Writing Built Up Areas Layer")
+
+            results['builtup'] = outputs['ExtractByAttribute']['OUTPUT']
+            return self.cleanStructures(parameters, context, feedback, outputs, results, known_idp_areasLayer, buildingsLayer)
 
         # split raster bands
         # Split the Raster Image into Single Bands
@@ -314,31 +354,43 @@ class TentExtractionForKnownAreas(QgsProcessingAlgorithm):
         if feedback.isCanceled():
             return {}
 
-        # Sample Soil BI
-        alg_params = {
-            'COLUMN_PREFIX': 'BI',
-            'INPUT': parameters['sample_bare_areas'],
-            'RASTERCOPY': outputs['ComputeSoilBrightness']['out'],
-            'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-        }
+        # Derive the bare areas range by clustering when no samples were digitized
+        if self.parameterAsBoolean(parameters, 'auto_bare_areas', context) or not parameters.get('sample_bare_areas'):
+            alg_params = {
+                'INPUT': parameters['satellite_image'],
+                'SOIL_BRIGHTNESS': outputs['ComputeSoilBrightness']['out']
+            }
 
-        feedback.pushInfo("Running algorithm: Sample Soil Brightness")
+            feedback.pushInfo("Running algorithm: Compute Bare Area Range with Clustering")
 
-        outputs['SampleSoilBi'] = processing.run('native:rastersampling', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+            outputs['BareAreasStatistics'] = processing.run('IDP_Sites_Mapping:computebarearangewithclustering', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
 
-        feedback.setCurrentStep(14)
-        if feedback.isCanceled():
-            return {}
+        else:
+            # Sample Soil BI
+            alg_params = {
+                'COLUMN_PREFIX': 'BI',
+                'INPUT': parameters['sample_bare_areas'],
+                'RASTERCOPY': outputs['ComputeSoilBrightness']['out'],
+                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
+            }
 
-        # Bare Areas Statistics
-        alg_params = {
-            'FIELD_NAME': 'BI1',
-            'INPUT_LAYER': outputs['SampleSoilBi']['OUTPUT']
-        }
+            feedback.pushInfo("Running algorithm: Sample Soil Brightness")
 
-        feedback.pushInfo("Running algorithm: Compute Bare Area Statistics")
+            outputs['SampleSoilBi'] = processing.run('native:rastersampling', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
 
-        outputs['BareAreasStatistics'] = processing.run('qgis:basicstatisticsforfields', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+            feedback.setCurrentStep(14)
+            if feedback.isCanceled():
+                return {}
+
+            # Bare Areas Statistics
+            alg_params = {
+                'FIELD_NAME': 'BI1',
+                'INPUT_LAYER': outputs['SampleSoilBi']['OUTPUT']
+            }
+
+            feedback.pushInfo("Running algorithm: Compute Bare Area Statistics")
+
+            outputs['BareAreasStatistics'] = processing.run('qgis:basicstatisticsforfields', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
 
         feedback.setCurrentStep(15)
         if feedback.isCanceled():
@@ -548,13 +600,137 @@ class TentExtractionForKnownAreas(QgsProcessingAlgorithm):
         if feedback.isCanceled():
             return {}
 
+        structureMask = outputs['IdpCampBinary']['out']
+        sieve_min_pixels = self.parameterAsInt(parameters, 'sieve_min_pixels', context)
+
+        # Sieve Structure Mask
+        # Drop the specks surviving the opening so they are never polygonized
+        if sieve_min_pixels > 0:
+            alg_params = {
+                'INPUT': structureMask,
+                'MIN_PIXELS': sieve_min_pixels,
+                'CONNECTIVITY': 0,  # 4, as used by Polygonize
+                'OUTPUT': QgsProcessingUtils.generateTempFilename('sievedBinary.tif')
+            }
+
+            feedback.pushInfo("Running algorithm: Sieve Structure Mask")
+
+            outputs['SieveStructureMask'] = processing.run('IDP_Sites_Mapping:sievestructuremask', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+
+            if feedback.isCanceled():
+                return {}
+
+            structureMask = outputs['SieveStructureMask']['OUTPUT']
+
+        # ##################################################################################################
+        # # Mask Known IDP Sites and Buildings on the Image Grid
+        # ##################################################################################################
+        if raster_masking:
+            satelliteImage = self.parameterAsRasterLayer(parameters, 'satellite_image', context)
+            extent = satelliteImage.extent()
+            gridExtent = '{},{},{},{} [{}]'.format(extent.xMinimum(), extent.xMaximum(), extent.yMinimum(), extent.yMaximum(), satelliteImage.crs().authid())
+
+            # Rasterize onto exactly the image grid so the masks line up with the structure mask
+            rasterize_params = {
+                'FIELD': None,
+                'BURN': 1,
+                'USE_Z': False,
+                'UNITS': 0,  # Pixels
+                'WIDTH': satelliteImage.width(),
+                'HEIGHT': satelliteImage.height(),
+                'EXTENT': gridExtent,
+                'NODATA': None,
+                'OPTIONS': '',
+                'DATA_TYPE': 0,  # Byte
+                'INIT': 0,
+                'INVERT': False,
+                'EXTRA': ''
+            }
+            maskLayers = {'INPUT_A': structureMask}
+            formula = 'A'
+
+            if known_idp_areasLayer:
+                # BufferIDP Sites, reusing the dissolved buffers cached for the site registry
+                alg_params = {
+                    'INPUT': known_idp_areasLayer,
+                    'DISTANCE': 5,
+                    'EXTENT': gridExtent,
+                    'TARGET_CRS': satelliteImage.crs(),
+                    'OUTPUT': QgsProcessingUtils.generateTempFilename('sitesBuffered.gpkg')
+                }
+                feedback.pushInfo("Running algorithm: Buffer Known IDP Sites Areas")
+
+                outputs['BufferidpSites'] = processing.run('IDP_Sites_Mapping:bufferknownsites', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+
+                if feedback.isCanceled():
+                    return {}
+
+                # Rasterize IDP Sites as the include mask
+                alg_params = dict(rasterize_params, INPUT=outputs['BufferidpSites']['OUTPUT'], OUTPUT=QgsProcessingUtils.generateTempFilename('sitesMask.tif'))
+
+                feedback.pushInfo("Running algorithm: Rasterize Known IDP Sites")
+
+                outputs['RasterizeSites'] = processing.run('gdal:rasterize', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+
+                if feedback.isCanceled():
+                    return {}
+
+                maskLayers['INPUT_B'] = outputs['RasterizeSites']['OUTPUT']
+                formula += '*B'
+
+            if buildingsLayer:
+                # Rasterize Buildings as the exclude mask, any pixel touched by a building is removed
+                alg_params = dict(rasterize_params, INPUT=buildingsLayer, EXTRA='-at', OUTPUT=QgsProcessingUtils.generateTempFilename('buildingsMask.tif'))
+
+                feedback.pushInfo("Running algorithm: Rasterize Buildings")
+
+                outputs['RasterizeBuildings'] = processing.run('gdal:rasterize', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+
+                if feedback.isCanceled():
+                    return {}
+
+                maskLayers['INPUT_C'] = outputs['RasterizeBuildings']['OUTPUT']
+                formula += '*(1-C)'
+
+            # Mask Structures
+            alg_params = {
+                'BAND_A': 1,
+                'BAND_B': 1 if 'INPUT_B' in maskLayers else None,
+                'BAND_C': 1 if 'INPUT_C' in maskLayers else None,
+                'BAND_D': None,
+                'BAND_E': None,
+                'BAND_F': None,
+                'EXTRA': '',
+                'FORMULA': formula,
+                'INPUT_A': maskLayers['INPUT_A'],
+                'INPUT_B': maskLayers.get('INPUT_B'),
+                'INPUT_C': maskLayers.get('INPUT_C'),
+                'INPUT_D': None,
+                'INPUT_E': None,
+                'INPUT_F': None,
+                'NO_DATA': None,
+                'OPTIONS': '',
+                'PROJWIN': None,
+                'RTYPE': 0,  # Byte
+                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
+            }
+
+            feedback.pushInfo("Running algorithm: Mask Structures with Known IDP Sites and Buildings")
+
+            outputs['MaskStructures'] = processing.run('gdal:rastercalculator', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+
+            if feedback.isCanceled():
+                return {}
+
+            structureMask = outputs['MaskStructures']['OUTPUT']
+
         # Polygonize Structures
         alg_params = {
             'BAND': 1,
             'EIGHT_CONNECTEDNESS': False,
             'EXTRA': '',
             'FIELD': 'DN',
-            'INPUT': outputs['IdpCampBinary']['out'],
+            'INPUT': structureMask,
             'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
         }
 
@@ -582,137 +758,170 @@ class TentExtractionForKnownAreas(QgsProcessingAlgorithm):
         feedback.setCurrentStep(26)
         if feedback.isCanceled():
             return {}
-        
+
         feedback.pushInfo("Running algorithm: Writing Built Up Areas Layer")
 
         results['builtup'] = outputs['ExtractByAttribute']['OUTPUT']
-    
-        # ##################################################################################################
-        # # Clean Structure Layer
-        # ###########################################################################
-        # Check if the user provisioned the IDP sites and the Buildings Layer
-        if known_idp_areasLayer and buildingsLayer:
-            feedback.pushInfo("Processing Known IDP Sites layer")
 
-            # BufferIDP Sites
+        if raster_masking:
+            # The polygons already exclude everything outside the sites and inside buildings,
+            # only the small holes left by the mask need cleaning
             alg_params = {
-                'DISSOLVE': True,
-                'DISTANCE': 5,
-                'END_CAP_STYLE': 0,  # Round
-                'INPUT': known_idp_areasLayer,
-                'JOIN_STYLE': 0,  # Round
-                'MITER_LIMIT': 2,
-                'SEGMENTS': 5,
-                'OUTPUT': QgsProcessingUtils.generateTempFilename('sitesBuffered.gpkg')
-            }
-            feedback.pushInfo("Running algorithm: Buffer Known IDP Sites Areas")
-
-            outputs['BufferidpSites'] = processing.run('native:buffer', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-            feedback.setCurrentStep(27)
-            if feedback.isCanceled():
-                return {}
-            
-            # IDP Sites Multipart to singleparts
-            alg_params = {
-                'INPUT': outputs['BufferidpSites']['OUTPUT'],
-                'OUTPUT': QgsProcessingUtils.generateTempFilename('sitesSingleParts.gpkg')
+                'INPUT': outputs['ExtractByAttribute']['OUTPUT'],
+                'MIN_HOLE_AREA': 5,
+                'OUTPUT': parameters['Structures']
             }
 
-            feedback.pushInfo("Running algorithm: IDP Sites Multipart to Single Parts")
+            feedback.pushInfo("Running algorithm: Clean Structures Geometry")
 
-            outputs['IdpSitesMultipartToSingleparts'] = processing.run('native:multiparttosingleparts', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+            outputs['IDPStructures'] = processing.run('IDP_Sites_Mapping:cleanstructuregeometries', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
 
-            feedback.setCurrentStep(28)
+            feedback.setCurrentStep(steps)
             if feedback.isCanceled():
                 return {}
 
-            # IDP Sites, Structures Intersection
-            alg_params = {
-                'INPUT': outputs['ExtractByAttribute']['OUTPUT'],
-                'INPUT_FIELDS': [''],
-                'OVERLAY': outputs['IdpSitesMultipartToSingleparts']['OUTPUT'],
-                'OVERLAY_FIELDS': [''],
-                'OVERLAY_FIELDS_PREFIX': '',
-                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-            }
-
-            feedback.pushInfo("Running algorithm: DP Sites, Structures Intersection")
+            feedback.pushInfo("Writing Final Layer")
 
-            outputs['SitesStructuresIntersection'] = processing.run('native:intersection', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+            results['Structures'] = outputs['IDPStructures']['OUTPUT']
+            return results
 
-            feedback.setCurrentStep(29)
-            if feedback.isCanceled():
-                return {}
-            
-            # Built Up and Buildings Difference
+        return self.cleanStructures(parameters, context, feedback, outputs, results, known_idp_areasLayer, buildingsLayer)
+
+    def processSiteWindows(self, parameters, context, feedback, known_idp_areasLayer):
+        """
+        Runs the Tent Extraction model on windows around the buffered Known IDP Sites, merging
+        windows that are close to each other, and merges the structures found in every window.
+        Thresholds and bare areas are therefore computed on the site pixels only.
+        """
+        import shapely
+        from .layer_io import site_buffers
+        from .tiling import merge_windows
+
+        satelliteImage = self.parameterAsRasterLayer(parameters, 'satellite_image', context)
+        sampleLayer = self.parameterAsVectorLayer(parameters, 'sample_bare_areas', context)
+        auto_bare_areas = self.parameterAsBoolean(parameters, 'auto_bare_areas', context) or sampleLayer is None
+        crs = satelliteImage.crs()
+        imageExtent = satelliteImage.extent()
+        pixelSize = satelliteImage.rasterUnitsPerPixelX()
+
+        # Room for the morphological filter at the window edges
+        margin = 10 * pixelSize
+        # Windows closer than this are cheaper to process as one
+        gap = 64 * pixelSize
+
+        # The dissolved site buffers are cached across scenes, only the parts on the image are looked up
+        sites = site_buffers(known_idp_areasLayer, 5, crs, context, feedback).query(
+            (imageExtent.xMinimum(), imageExtent.yMinimum(), imageExtent.xMaximum(), imageExtent.yMaximum()))[1]
+        boxes = [(xmin - margin, ymin - margin, xmax + margin, ymax + margin) for xmin, ymin, xmax, ymax in shapely.bounds(sites)]
+
+        windows = []
+        for xmin, ymin, xmax, ymax in merge_windows(boxes, gap):
+            window = QgsRectangle(xmin, ymin, xmax, ymax).intersect(imageExtent)
+            if not window.isEmpty():
+                windows.append(window)
+
+        if not windows:
+            raise QgsProcessingException('None of the Known IDP Sites overlap the Satellite Image')
+
+        feedback.pushInfo("Processing {} site windows covering {:.1f}% of the scene".format(len(windows), 100.0 * sum(window.area() for window in windows) / imageExtent.area()))
+
+        structureLayers = []
+        for current, window in enumerate(windows):
+            # Clip Satellite Image to the Site Window
             alg_params = {
-                'INPUT': outputs['SitesStructuresIntersection']['OUTPUT'],
-                'OVERLAY': buildingsLayer,
-                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
+                'INPUT': parameters['satellite_image'],
+                'PROJWIN': '{},{},{},{} [{}]'.format(window.xMinimum(), window.xMaximum(), window.yMinimum(), window.yMaximum(), crs.authid()),
+                'OVERCRS': False,
+                'NODATA': None,
+                'OPTIONS': '',
+                'DATA_TYPE': 0,  # Use Input Layer Data Type
+                'EXTRA': '',
+                'OUTPUT': QgsProcessingUtils.generateTempFilename('siteWindow.tif')
             }
 
-            feedback.pushInfo("Running algorithm: DP Sites, Structures Intersection")
+            feedback.pushInfo("Running algorithm: Clip Satellite Image to Site Window {}".format(current + 1))
 
-            outputs['BuiltUpBuildingsDifference'] = processing.run('native:difference', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+            clipped = processing.run('gdal:cliprasterbyextent', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
 
-            feedback.setCurrentStep(30)
             if feedback.isCanceled():
-                return {}
+                return None
+
+            # Windows without sampled bare areas derive them by clustering
+            windowSamples = False
+            if not auto_bare_areas:
+                sampleRequest = QgsFeatureRequest().setNoAttributes().setLimit(1)
+                sampleRequest.setDestinationCrs(crs, context.transformContext())
+                sampleRequest.setFilterRect(window)
+                windowSamples = any(True for _ in sampleLayer.getFeatures(sampleRequest))
 
-            # IDP Structures Multipart to singleparts
             alg_params = {
-                'INPUT': outputs['BuiltUpBuildingsDifference']['OUTPUT'],
-                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
+                'satellite_image': clipped['OUTPUT'],
+                'sample_bare_areas': parameters['sample_bare_areas'] if windowSamples else None,
+                'auto_bare_areas': not windowSamples,
+                'sieve_min_pixels': parameters.get('sieve_min_pixels', 4),
+                'Structures': QgsProcessing.TEMPORARY_OUTPUT
             }
 
-            feedback.pushInfo("Running algorithm: DP Sites, Structures Intersection")
+            feedback.pushInfo("Running algorithm: Tent Extraction on Site Window {}".format(current + 1))
 
-            outputs['IdpStructuresMultipartToSingleparts'] = processing.run('native:multiparttosingleparts', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-            feedback.setCurrentStep(31)
+            extracted = processing.run('IDP_Sites_Mapping:Tent Extraction', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+            # A canceled Tent Extraction returns no outputs
             if feedback.isCanceled():
-                return {}
+                return None
+            structureLayers.append(extracted['Structures'])
 
-            # Fix geometries
-            alg_params = {
-                'INPUT': outputs['IdpStructuresMultipartToSingleparts']['OUTPUT'],
-                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-            }
+            feedback.setCurrentStep(int(25 * (current + 1) / len(windows)))
 
-            feedback.pushInfo("Running algorithm: Fix Structures Geometry")
+        # Merge Site Windows Structures
+        alg_params = {
+            'LAYERS': structureLayers,
+            'CRS': crs,
+            'OUTPUT': parameters['builtup']
+        }
 
-            outputs['FixStructuresGeometries'] = processing.run('native:fixgeometries', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+        feedback.pushInfo("Running algorithm: Merge Site Windows Structures")
 
-            feedback.setCurrentStep(32)
-            if feedback.isCanceled():
-                return {}
+        return processing.run('native:mergevectorlayers', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+
+    def cleanStructures(self, parameters, context, feedback, outputs, results, known_idp_areasLayer, buildingsLayer):
+        """
+        Restricts the built up areas to the Known IDP Sites and removes the Buildings.
+        """
+        # ##################################################################################################
+        # # Clean Structure Layer
+        # ###########################################################################
+        # Check if the user provisioned the IDP sites and the Buildings Layer
+        if known_idp_areasLayer and buildingsLayer:
+            feedback.pushInfo("Processing Known IDP Sites layer")
 
-            # Delete holes
+            # Overlay Structures with the IDP Sites and Buildings
             alg_params = {
-                'INPUT': outputs['FixStructuresGeometries']['OUTPUT'],
-                'MIN_AREA': 5,
+                'INPUT': outputs['ExtractByAttribute']['OUTPUT'],
+                'SITES': known_idp_areasLayer,
+                'BUFFER': 5,
+                'BUILDINGS': buildingsLayer,
                 'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
             }
 
-            feedback.pushInfo("Running algorithm: Delete Structures Holes")
+            feedback.pushInfo("Running algorithm: Overlay Structures with IDP Sites and Buildings")
 
-            outputs['DeleteStructureHoles'] = processing.run('native:deleteholes', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+            outputs['BuiltUpBuildingsDifference'] = processing.run('IDP_Sites_Mapping:overlaystructures', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
 
-            feedback.setCurrentStep(33)
+            feedback.setCurrentStep(30)
             if feedback.isCanceled():
                 return {}
 
-            # IDP Structures
+            # Clean Structures Geometry
             alg_params = {
-                'INPUT': outputs['DeleteStructureHoles']['OUTPUT'],
+                'INPUT': outputs['BuiltUpBuildingsDifference']['OUTPUT'],
+                'MIN_HOLE_AREA': 5,
                 'OUTPUT': parameters['Structures']
             }
 
-            feedback.pushInfo("Running algorithm: Fixing Structures Geometry")
+            feedback.pushInfo("Running algorithm: Clean Structures Geometry")
+
+            outputs['IDPStructures'] = processing.run('IDP_Sites_Mapping:cleanstructuregeometries', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
 
-            outputs['IDPStructures'] = processing.run('native:fixgeometries', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-            
             feedback.setCurrentStep(34)
             if feedback.isCanceled():
                 return {}
@@ -725,52 +934,18 @@ class TentExtractionForKnownAreas(QgsProcessingAlgorithm):
             # Scenario 1: Only known_idp_areas is defined
             feedback.pushInfo('Only known_idp_areas layer is defined.')
 
-            # BufferIDP Sites
-            alg_params = {
-                'DISSOLVE': True,
-                'DISTANCE': 5,
-                'END_CAP_STYLE': 0,  # Round
-                'INPUT': known_idp_areasLayer,
-                'JOIN_STYLE': 0,  # Round
-                'MITER_LIMIT': 2,
-                'SEGMENTS': 5,
-                'OUTPUT': QgsProcessingUtils.generateTempFilename('sitesBuffered.gpkg')
-            }
-            feedback.pushInfo("Running algorithm: Buffer Known IDP Sites Areas")
-
-            outputs['BufferidpSites'] = processing.run('native:buffer', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-            feedback.setCurrentStep(27)
-            if feedback.isCanceled():
-                return {}
-            
-            # IDP Sites Multipart to singleparts
-            alg_params = {
-                'INPUT': outputs['BufferidpSites']['OUTPUT'],
-                'OUTPUT': QgsProcessingUtils.generateTempFilename('sitesSingleParts.gpkg')
-            }
-
-            feedback.pushInfo("Running algorithm: IDP Sites Multipart to Single Parts")
-
-            outputs['IdpSitesMultipartToSingleparts'] = processing.run('native:multiparttosingleparts', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-            feedback.setCurrentStep(28)
-            if feedback.isCanceled():
-                return {}
-
-            # IDP Sites, Structures Intersection
+            # Overlay Structures with the IDP Sites and Buildings
             alg_params = {
                 'INPUT': outputs['ExtractByAttribute']['OUTPUT'],
-                'INPUT_FIELDS': [''],
-                'OVERLAY': outputs['IdpSitesMultipartToSingleparts']['OUTPUT'],
-                'OVERLAY_FIELDS': [''],
-                'OVERLAY_FIELDS_PREFIX': '',
+                'SITES': known_idp_areasLayer,
+                'BUFFER': 5,
+                'BUILDINGS': None,
                 'OUTPUT': parameters['Structures']
             }
 
-            feedback.pushInfo("Running algorithm: DP Sites, Structures Intersection")
+            feedback.pushInfo("Running algorithm: Overlay Structures with IDP Sites and Buildings")
 
-            outputs['SitesStructuresIntersection'] = processing.run('native:intersection', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+            outputs['SitesStructuresIntersection'] = processing.run('IDP_Sites_Mapping:overlaystructures', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
 
             feedback.setCurrentStep(29)
             if feedback.isCanceled():
@@ -784,74 +959,34 @@ class TentExtractionForKnownAreas(QgsProcessingAlgorithm):
             # Scenario 2: Only buildings is defined
             feedback.pushInfo('Only buildings layer is defined.')
 
-            # Built Up and Buildings Difference
+            # Overlay Structures with the IDP Sites and Buildings
             alg_params = {
                 'INPUT': outputs['ExtractByAttribute']['OUTPUT'],
-                'OVERLAY': buildingsLayer,
+                'SITES': None,
+                'BUFFER': 5,
+                'BUILDINGS': buildingsLayer,
                 'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
             }
 
-            feedback.pushInfo("Running algorithm: IDP Sites, Structures Intersection")
+            feedback.pushInfo("Running algorithm: Overlay Structures with IDP Sites and Buildings")
 
-            outputs['BuiltUpBuildingsDifference'] = processing.run('native:difference', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+            outputs['BuiltUpBuildingsDifference'] = processing.run('IDP_Sites_Mapping:overlaystructures', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
 
             feedback.setCurrentStep(27)
             if feedback.isCanceled():
                 return {}
 
-            # IDP Structures Multipart to singleparts
+            # Clean Structures Geometry
             alg_params = {
                 'INPUT': outputs['BuiltUpBuildingsDifference']['OUTPUT'],
-                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-            }
-
-            feedback.pushInfo("Running algorithm: DP Sites, Structures Intersection")
-
-            outputs['IdpStructuresMultipartToSingleparts'] = processing.run('native:multiparttosingleparts', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-            feedback.setCurrentStep(28)
-            if feedback.isCanceled():
-                return {}
-
-            # Fix geometries
-            alg_params = {
-                'INPUT': outputs['IdpStructuresMultipartToSingleparts']['OUTPUT'],
-                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-            }
-
-            feedback.pushInfo("Running algorithm: Fix Structures Geometry")
-
-            outputs['FixStructuresGeometries'] = processing.run('native:fixgeometries', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-            feedback.setCurrentStep(29)
-            if feedback.isCanceled():
-                return {}
-
-            # Delete holes
-            alg_params = {
-                'INPUT': outputs['FixStructuresGeometries']['OUTPUT'],
-                'MIN_AREA': 5,
-                'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-            }
-
-            feedback.pushInfo("Running algorithm: Delete Structures Holes")
-
-            outputs['DeleteStructureHoles'] = processing.run('native:deleteholes', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-            feedback.setCurrentStep(30)
-            if feedback.isCanceled():
-                return {}
-
-            # IDP Structures
-            alg_params = {
-                'INPUT': outputs['DeleteStructureHoles']['OUTPUT'],
+                'MIN_HOLE_AREA': 5,
                 'OUTPUT': parameters['Structures']
             }
 
-            feedback.pushInfo("Running algorithm: Fixing Structures Geometry")
+            feedback.pushInfo("Running algorithm: Clean Structures Geometry")
+
+            outputs['IDPStructures'] = processing.run('IDP_Sites_Mapping:cleanstructuregeometries', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
 
-            outputs['IDPStructures'] = processing.run('native:fixgeometries', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-            
             feedback.setCurrentStep(31)
             if feedback.isCanceled():
                 return {}
@@ -894,10 +1029,18 @@ class TentExtractionForKnownAreas(QgsProcessingAlgorithm):
 <h3>Known IDP Sites</h3>
 <p>A polygon layer with geomtries of the Known IDP areas.Due to variations such as Image Shifts, it is best that the geometries have been adjusted to conform to the specific Image for analysis due to distortions such as Image Shifts that may likely be present if the geometries were digitized from another imagery. However, the process, will add a 10 metre buffer around the Known IDP Sites geometry to account for possible distortions.Equallly, geometry should be reprojected to the same coordinate as the Input Image</p>
 <h3>Buildings Layer</h3>
-<p>A Polygon geometry layer of known buildings. Any built up surface that intersects with a building geometry will be considered a building and thus discared. Care however has to be taken to ensure that the building layer has been corrected to match the specific Image where the analysis is being undertaken</p>
+<p>A Polygon geometry layer of known buildings. Any built up surface that intersects with a building geometry will be considered a building and thus discared. Care however has to be taken to ensure that the building layer has been corrected to match the specific Image where the analysis is being undertaken. Only the buildings intersecting the Satellite Image extent are loaded, so country wide footprint layers can be used directly; a spatial index on the layer makes this lookup fastest</p>
+<h3>Derive Bare Areas Automatically</h3>
+<p>When checked, or when no Sample Bare Areas layer is given, a random subsample of the image pixels is clustered with mini-batch k-means on chromaticity and Soil Brightness and the bare soil cluster provides the Soil Brightness range. This removes the manual sampling step at the cost of some control over the bare areas definition.</p>
+<h3>Mask Sites and Buildings in the Raster Domain</h3>
+<p>When checked, the buffered Known IDP Sites and the Buildings Layer are rasterized once onto the image grid and combined with the structure mask before polygonization, so only in site, non building structures are polygonized and the vector intersection and difference steps are skipped. Pixels touched by a building are removed. In this mode the Built Up Areas output holds the masked polygons before their holes are cleaned.</p>
+<h3>Process Known IDP Sites Windows Only</h3>
+<p>When checked, the windows around the buffered Known IDP Sites are computed first, nearby windows are merged and the Tent Extraction model runs on each window only. F1, F3, Soil Brightness and the thresholds are then computed on the site pixels instead of the whole scene, which is much faster when the camps cover a small part of the image. Windows without Sample Bare Areas derive the bare areas automatically. This option takes precedence over raster domain masking.</p>
+<h3>Minimum Structure Size (pixels)</h3>
+<p>Structures of the binary mask covering fewer pixels than this are removed before polygonization, which drops the 1 to 3 pixel specks that survive the morphological opening and greatly reduces the number of polygons to clean. Set to 0 to disable the sieve.</p>
 <h2>Outputs</h2>
 <h3>Structures</h3>
-<p>This is apolygon layer that represents that tented areas and the structure. Some post processing should be undertaken to eliminate other structures. Use the rectanglify tool to clean the polygons and make them representative of the tents. One post processing is to compute a difference with then known IDP Camp areas. However care should be taken to only use this approach if/when the IDP camps have already been updated. If not, then a manual cleaning would be prefereable.</p>
+<p>This is apolygon layer that represents that tented areas and the structure. Some post processing should be undertaken to eliminate other structures. Use the Rectanglify Structures tool (Processing Tools) to clean the polygons and make them representative of the tents. One post processing is to compute a difference with then known IDP Camp areas. However care should be taken to only use this approach if/when the IDP camps have already been updated. If not, then a manual cleaning would be prefereable.</p>
 <style type="text/css">
 </style></head><body style=" font-family:'MS Shell Dlg 2'; font-size:8.25pt; font-weight:400; font-style:normal;">
 <p style=" margin-top:0px; margin-bottom:0px; margin-left:0px; margin-right:0px; -qt-block-indent:0; text-indent:0px;">Todo</p></body></html></p><br><p align="right">Algorithm author: Pascal Ogola</p><p align="right">Help author: Pascal Ogola</p><p align="right">Algorithm version: v1</p></body></html>"""
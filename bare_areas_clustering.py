@@ -0,0 +1,156 @@
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessingAlgorithm,
+                       QgsProcessingException,
+                       QgsProcessingParameterDefinition,
+                       QgsProcessingParameterRasterLayer,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingOutputNumber)
+
+
+class ComputeBareAreaRangeWithClustering(QgsProcessingAlgorithm):
+    """
+    This script derives the soil brightness range of bare areas by clustering a random
+    pixel subsample of the image with mini-batch k-means, replacing manually digitized samples.
+    """
+
+    INPUT = 'INPUT'
+    SOIL_BRIGHTNESS = 'SOIL_BRIGHTNESS'
+    CLUSTERS = 'CLUSTERS'
+    SAMPLE_SIZE = 'SAMPLE_SIZE'
+    SEED = 'SEED'
+    MIN = 'MIN'
+    THIRDQUARTILE = 'THIRDQUARTILE'
+    MAX = 'MAX'
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return ComputeBareAreaRangeWithClustering()
+
+    def name(self):
+        return 'computebarearangewithclustering'
+
+    def displayName(self):
+        return self.tr('Compute Bare Area Range with Clustering')
+
+    def group(self):
+        return self.tr('Processing Tools')
+
+    def groupId(self):
+        return 'processing'
+
+    def shortHelpString(self):
+        return self.tr('''Derives the Soil Brightness (BI) range of bare areas without sampled points. A random subsample of pixels is drawn from the RGB image and its Soil Brightness layer, the pixels are described by their red/green chromaticity and brightness and clustered with mini-batch k-means. The brightest, most red dominated cluster is taken as bare soil and its minimum and third quartile BI values are returned, the same statistics used when Sample Bare Areas are provided. \n
+        Only Sample Size pixels are held in memory, so the runtime is independent of the image size.''')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUT,
+                self.tr('Satellite Image')
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.SOIL_BRIGHTNESS,
+                self.tr('Soil Brightness Layer')
+            )
+        )
+
+        param1 = QgsProcessingParameterNumber(self.CLUSTERS,
+                                self.tr('Number of Clusters'), QgsProcessingParameterNumber.Integer, 4, minValue=2)
+        param2 = QgsProcessingParameterNumber(self.SAMPLE_SIZE,
+                                self.tr('Sample Size (pixels)'), QgsProcessingParameterNumber.Integer, 100000, minValue=1000)
+        param3 = QgsProcessingParameterNumber(self.SEED,
+                                self.tr('Random Seed'), QgsProcessingParameterNumber.Integer, 0, minValue=0)
+
+        param1.setFlags(param1.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        param2.setFlags(param2.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        param3.setFlags(param3.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        self.addParameter(param1)
+        self.addParameter(param2)
+        self.addParameter(param3)
+
+        self.addOutput(QgsProcessingOutputNumber(self.MIN, self.tr('Minimum Bare Area BI')))
+        self.addOutput(QgsProcessingOutputNumber(self.THIRDQUARTILE, self.tr('Third Quartile Bare Area BI')))
+        self.addOutput(QgsProcessingOutputNumber(self.MAX, self.tr('Maximum Bare Area BI')))
+
+    def processAlgorithm(self, parameters, context, feedback):
+
+        try:
+            import numpy as np
+            import rasterio
+            from rasterio.enums import Resampling
+            from sklearn.cluster import MiniBatchKMeans
+
+        except Exception as e:
+            feedback.reportError(QCoreApplication.translate('Error','%s'%(e)))
+            feedback.reportError(QCoreApplication.translate('Error',' '))
+            feedback.reportError(QCoreApplication.translate('Error','Error loading modules - please install the rasterio and scikit-learn python modules'))
+            return {}
+
+        image = self.parameterAsRasterLayer(parameters, self.INPUT, context)
+        soil_bi = self.parameterAsRasterLayer(parameters, self.SOIL_BRIGHTNESS, context)
+        n_clusters = self.parameterAsInt(parameters, self.CLUSTERS, context)
+        sample_size = self.parameterAsInt(parameters, self.SAMPLE_SIZE, context)
+        seed = self.parameterAsInt(parameters, self.SEED, context)
+
+        rng = np.random.default_rng(seed)
+
+        with rasterio.open(image.source()) as img_src, rasterio.open(soil_bi.source()) as bi_src:
+            if img_src.count < 3:
+                raise QgsProcessingException(self.tr('The Satellite Image must have red, green and blue bands'))
+
+            # Read a decimated grid holding a few times the requested sample so memory stays
+            # bounded regardless of the scene size; both layers share the image grid
+            factor = max(1, int(np.ceil(np.sqrt(img_src.width * img_src.height / (4.0 * sample_size)))))
+            rows = max(1, img_src.height // factor)
+            cols = max(1, img_src.width // factor)
+            feedback.pushInfo('Reading a {} x {} pixel grid (decimation factor {})'.format(cols, rows, factor))
+
+            rgb = img_src.read([1, 2, 3], out_shape=(3, rows, cols), resampling=Resampling.nearest, masked=True)
+            bi = bi_src.read(1, out_shape=(rows, cols), resampling=Resampling.nearest, masked=True)
+
+        red, green, blue = (band.astype('float64').filled(np.nan).ravel() for band in rgb)
+        bi = bi.astype('float64').filled(np.nan).ravel()
+
+        total = red + green + blue
+        valid = np.isfinite(total) & np.isfinite(bi) & (total > 0)
+        index = np.flatnonzero(valid)
+        if index.size < n_clusters:
+            raise QgsProcessingException(self.tr('Not enough valid pixels to derive the bare areas'))
+        if index.size > sample_size:
+            index = rng.choice(index, sample_size, replace=False)
+
+        r = red[index] / total[index]
+        g = green[index] / total[index]
+        bi = bi[index]
+
+        if feedback.isCanceled():
+            return {}
+
+        # Scale brightness to the range of the chromaticity coordinates so that no
+        # single feature dominates the euclidean distance
+        bi_scale = np.percentile(bi, 99) or 1.0
+        features = np.column_stack((r, g, bi / bi_scale))
+
+        kmeans = MiniBatchKMeans(n_clusters=n_clusters, batch_size=4096, n_init=3, random_state=seed)
+        labels = kmeans.fit_predict(features)
+
+        # Bare soil is bright and red dominated, which separates it from vegetation
+        # (green dominated) as well as tents and roofs (bright but achromatic)
+        centres = kmeans.cluster_centers_
+        redness = centres[:, 0] - (1.0 - centres[:, 0] - centres[:, 1])
+        score = centres[:, 2] * redness
+        bare_cluster = int(np.argmax(score)) if score.max() > 0 else int(np.argmax(centres[:, 2]))
+
+        bare_bi = bi[labels == bare_cluster]
+        feedback.pushInfo('Bare soil cluster {} holds {} of {} sampled pixels'.format(bare_cluster, bare_bi.size, bi.size))
+
+        return {
+            self.MIN: float(bare_bi.min()),
+            self.THIRDQUARTILE: float(np.percentile(bare_bi, 75)),
+            self.MAX: float(bare_bi.max())
+        }
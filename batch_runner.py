@@ -0,0 +1,229 @@
+import os
+import glob
+import hashlib
+import traceback
+
+from qgis.PyQt.QtCore import Qt, QCoreApplication
+from qgis.core import (QgsProcessingContext,
+                       QgsProcessingFeedback,
+                       QgsProcessingException,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterMultipleLayers,
+                       QgsProcessingParameterFile,
+                       QgsProcessingParameterVectorLayer,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterFolderDestination,
+                       QgsProcessingOutputNumber,
+                       QgsProcessing)
+from qgis import processing
+
+# Image files picked up from the Scene Folder
+SCENE_EXTENSIONS = ('.tif', '.tiff', '.vrt', '.jp2', '.img')
+# Sample layer files matched to a scene by name
+SAMPLE_EXTENSIONS = ('.gpkg', '.shp', '.geojson')
+
+
+class BatchTentExtraction(QgsProcessingAlgorithm):
+    """
+    This script runs the Tent Extraction models over many scenes from a persistent job queue,
+    so an interrupted batch resumes with the scenes that are not finished.
+    """
+
+    SCENES = 'SCENES'
+    SCENE_FOLDER = 'SCENE_FOLDER'
+    SAMPLES_FOLDER = 'SAMPLES_FOLDER'
+    SITES = 'SITES'
+    BUILDINGS = 'BUILDINGS'
+    CONCURRENCY = 'CONCURRENCY'
+    OUTPUT_FOLDER = 'OUTPUT_FOLDER'
+    COMPLETED = 'COMPLETED'
+    FAILED = 'FAILED'
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return BatchTentExtraction()
+
+    def name(self):
+        return 'batchtentextraction'
+
+    def displayName(self):
+        return self.tr('Batch Tent Extraction')
+
+    def group(self):
+        return self.tr('Segmentation')
+
+    def groupId(self):
+        return 'segmentation'
+
+    def shortHelpString(self):
+        return self.tr('''Runs Tent Extraction on every scene of the Scenes list and of the Scene Folder, or Tent Extraction for Known Areas when Known IDP Sites or a Buildings Layer are given. \n
+        For every scene a sample layer of the same name (e.g. scene_12.gpkg for scene_12.tif) is looked up in the Sample Bare Areas Folder; scenes without one derive the bare areas automatically. The structures are written to <scene>_structures.gpkg in the Output Folder; scenes of the same name from different folders get a hash of their folder appended to that name. \n
+        The scenes are queued in jobs.sqlite inside the Output Folder and Concurrent Jobs scenes run at the same time, each with its own processing context. Jobs are keyed on the scene path. Running the batch again on the same Output Folder skips the finished scenes and retries the scenes that failed or were interrupted with the current settings, so a crashed batch resumes where it stopped. Canceling the batch also cancels the running scenes, which are retried on the next run. Keep Concurrent Jobs at 1 when the GRASS or OTB providers do not support parallel runs on the machine.''')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterMultipleLayers(
+                self.SCENES,
+                self.tr('Scenes'),
+                QgsProcessing.TypeRaster,
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.SCENE_FOLDER,
+                self.tr('Scene Folder'),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.SAMPLES_FOLDER,
+                self.tr('Sample Bare Areas Folder'),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterVectorLayer(
+                self.SITES,
+                self.tr('Known IDP Sites'),
+                [QgsProcessing.TypeVectorPolygon],
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterVectorLayer(
+                self.BUILDINGS,
+                self.tr('Buildings Layer'),
+                [QgsProcessing.TypeVectorPolygon],
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.CONCURRENCY,
+                self.tr('Concurrent Jobs'),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=1,
+                minValue=1
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.OUTPUT_FOLDER,
+                self.tr('Output Folder')
+            )
+        )
+        self.addOutput(QgsProcessingOutputNumber(self.COMPLETED, self.tr('Completed Scenes')))
+        self.addOutput(QgsProcessingOutputNumber(self.FAILED, self.tr('Failed Scenes')))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+        from . import job_queue
+
+        scenes = [layer.source() for layer in self.parameterAsLayerList(parameters, self.SCENES, context)]
+        scene_folder = self.parameterAsFile(parameters, self.SCENE_FOLDER, context)
+        if scene_folder:
+            scenes += sorted(path for path in glob.glob(os.path.join(scene_folder, '*'))
+                             if path.lower().endswith(SCENE_EXTENSIONS))
+        if not scenes:
+            raise QgsProcessingException(self.tr('No scenes were given'))
+
+        samples_folder = self.parameterAsFile(parameters, self.SAMPLES_FOLDER, context)
+        sites = self.parameterAsVectorLayer(parameters, self.SITES, context)
+        buildings = self.parameterAsVectorLayer(parameters, self.BUILDINGS, context)
+        concurrency = self.parameterAsInt(parameters, self.CONCURRENCY, context)
+        output_folder = self.parameterAsString(parameters, self.OUTPUT_FOLDER, context)
+        os.makedirs(output_folder, exist_ok=True)
+
+        known_areas = sites is not None or buildings is not None
+        algorithm = 'IDP_Sites_Mapping:TentExtractionForKnownAreas' if known_areas else 'IDP_Sites_Mapping:Tent Extraction'
+
+        # Scenes of the same name in different folders get the folder hash in their output names
+        stems = [os.path.splitext(os.path.basename(scene))[0] for scene in scenes]
+        duplicates = {stem for stem in stems if stems.count(stem) > 1}
+
+        queue = job_queue.JobQueue(os.path.join(output_folder, 'jobs.sqlite'))
+        queue.resume()
+        for scene, stem in zip(scenes, stems):
+            scene = os.path.normcase(os.path.abspath(scene.split('|')[0]))
+            output_stem = stem
+            if stem in duplicates:
+                output_stem = '{}_{}'.format(stem, hashlib.sha1(os.path.dirname(scene).encode('utf-8')).hexdigest()[:8])
+            samples = None
+            if samples_folder:
+                matches = [os.path.join(samples_folder, stem + extension) for extension in SAMPLE_EXTENSIONS]
+                samples = next((path for path in matches if os.path.exists(path)), None)
+
+            alg_params = {
+                'satellite_image': scene,
+                'sample_bare_areas': samples,
+                'auto_bare_areas': samples is None,
+                'Structures': os.path.join(output_folder, output_stem + '_structures.gpkg')
+            }
+            if known_areas:
+                alg_params.update({
+                    'known_idp_areas': sites.source() if sites is not None else None,
+                    'buildings': buildings.source() if buildings is not None else None,
+                    'builtup': os.path.join(output_folder, output_stem + '_builtup.gpkg')
+                })
+            # Keyed on the scene path, a scene queued again with new settings runs with them
+            queue.add(scene, alg_params)
+
+        counts = queue.counts()
+        total = sum(counts.values())
+        feedback.pushInfo('{} scenes queued, {} already done'.format(total, counts.get(job_queue.DONE, 0)))
+
+        def run_job(job):
+            job_id, job_name, alg_params = job
+            # Every job gets its own context and feedback, contexts are not thread safe
+            job_context = QgsProcessingContext()
+            job_context.setProject(context.project())
+            job_context.setTransformContext(context.transformContext())
+            job_feedback = QgsProcessingFeedback()
+            # Canceling the batch cancels the running scenes; direct, the job thread has no event loop
+            feedback.canceled.connect(job_feedback.cancel, Qt.DirectConnection)
+            if feedback.isCanceled():
+                job_feedback.cancel()
+            try:
+                processing.run(algorithm, alg_params, context=job_context, feedback=job_feedback)
+                if job_feedback.isCanceled():
+                    raise QgsProcessingException('Canceled')
+            except Exception:
+                queue.finish(job_id, traceback.format_exc())
+                return job_name, False
+            finally:
+                feedback.canceled.disconnect(job_feedback.cancel)
+            queue.finish(job_id)
+            return job_name, True
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            running = set()
+            while True:
+                while len(running) < concurrency and not feedback.isCanceled():
+                    job = queue.claim()
+                    if job is None:
+                        break
+                    feedback.pushInfo('Starting scene {}'.format(job[1]))
+                    running.add(executor.submit(run_job, job))
+                if not running:
+                    break
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_name, succeeded = future.result()
+                    if succeeded:
+                        feedback.pushInfo('Finished scene {}'.format(job_name))
+                    else:
+                        feedback.reportError('Scene {} failed, see the error column of jobs.sqlite'.format(job_name))
+                counts = queue.counts()
+                feedback.setProgress(int(100.0 * (counts.get(job_queue.DONE, 0) + counts.get(job_queue.FAILED, 0)) / total))
+
+        counts = queue.counts()
+        if feedback.isCanceled():
+            feedback.pushInfo('Batch canceled, run it again on the same Output Folder to resume')
+
+        return {self.OUTPUT_FOLDER: output_folder, self.COMPLETED: counts.get(job_queue.DONE, 0), self.FAILED: counts.get(job_queue.FAILED, 0)}
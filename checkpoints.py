@@ -0,0 +1,174 @@
+"""
+/***************************************************************************
+ Stage checkpoints of the IDP Sites Mapping models.
+
+ Every child algorithm of a model runs as a named stage whose outputs are
+ written to a checkpoint folder instead of anonymous temporary files. A
+ manifest records, per stage, a signature of the algorithm, its parameters
+ and the size and modification time of its input files, together with the
+ stage results. A rerun on the same folder reuses the stages whose
+ signature still matches and whose outputs still exist, and runs again
+ from the first stage that is missing or invalidated.
+ ***************************************************************************/
+"""
+
+import os
+import re
+import json
+import hashlib
+import numbers
+
+from qgis.core import (QgsApplication, QgsMapLayer, QgsProcessingException,
+                       QgsProcessingOutputLayerDefinition, QgsProcessingUtils)
+from qgis import processing
+
+# Manifest file inside the checkpoint folder
+MANIFEST = 'checkpoints.json'
+
+
+class StageRunner(object):
+    """Runs the child algorithms of a model, with checkpoints when a folder is given.
+
+    Without a folder run() is a plain processing.run() of a child algorithm.
+    """
+
+    def __init__(self, directory, context, feedback):
+        self.directory = os.path.abspath(directory) if directory else None
+        self.context = context
+        self.feedback = feedback
+        self.manifest = {}
+        # Cleared by the first stage that runs, every later stage then runs too
+        self.reuse = True
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, MANIFEST)
+            if os.path.exists(path):
+                try:
+                    with open(path) as manifest:
+                        self.manifest = json.load(manifest)
+                except (OSError, ValueError) as e:
+                    feedback.reportError('Ignoring unreadable checkpoint manifest {}: {}'.format(path, e))
+
+    def run(self, stage, algorithm, parameters, final=False):
+        """Run algorithm as stage, or return the results of its valid checkpoint.
+
+        The outputs of a final stage are the model outputs: they are neither
+        redirected to the checkpoint folder nor reused.
+        """
+        if not self.directory:
+            return self._run(algorithm, parameters)
+
+        parameters = dict(parameters)
+        destinations = [] if final else self._redirect(stage, algorithm, parameters)
+        signature = self._signature(algorithm, parameters, destinations)
+
+        entry = self.manifest.get(stage)
+        if (not final and self.reuse and entry is not None and entry.get('signature') == signature
+                and self._outputs_exist(entry.get('results', {}))):
+            self.feedback.pushInfo('Reusing checkpoint of stage {}'.format(stage))
+            return entry['results']
+
+        self.reuse = False
+        for path in destinations:
+            if os.path.isfile(path):
+                os.remove(path)
+        # Forget the stage until it completes, a failure leaves it incomplete
+        if self.manifest.pop(stage, None) is not None:
+            self._save()
+
+        results = self._run(algorithm, parameters)
+        if not final:
+            # Canceled children return {} or leave partial files, never record them
+            if self.feedback.isCanceled():
+                raise QgsProcessingException('Stage {} was canceled, it is not checkpointed'.format(stage))
+            produced = {_normalized(value) for value in results.values() if isinstance(value, str)}
+            missing = [path for path in destinations if _normalized(path) not in produced or not os.path.exists(path)]
+            if missing:
+                raise QgsProcessingException('Stage {} did not produce {}'.format(stage, ', '.join(missing)))
+            self.manifest[stage] = {'algorithm': algorithm, 'signature': signature, 'results': _serializable(results)}
+            self._save()
+        return results
+
+    def _run(self, algorithm, parameters):
+        return processing.run(algorithm, parameters, context=self.context, feedback=self.feedback, is_child_algorithm=True)
+
+    def _redirect(self, stage, algorithm, parameters):
+        """Point the file outputs of the stage into the checkpoint folder."""
+        definitions = QgsApplication.processingRegistry().algorithmById(algorithm)
+        if definitions is None:
+            return []
+        destinations = []
+        for definition in definitions.destinationParameterDefinitions():
+            name = definition.name()
+            # Outputs left out or set to None are not created
+            if parameters.get(name) is None:
+                continue
+            filename = '{}_{}.{}'.format(stage, re.sub(r'\W+', '_', name), definition.defaultFileExtension())
+            parameters[name] = os.path.join(self.directory, filename)
+            destinations.append(parameters[name])
+        return destinations
+
+    def _signature(self, algorithm, parameters, destinations):
+        files = {}
+
+        def normalize(value):
+            if isinstance(value, dict):
+                return {str(key): normalize(item) for key, item in value.items()}
+            if isinstance(value, (list, tuple)):
+                return [normalize(item) for item in value]
+            if isinstance(value, QgsMapLayer):
+                value = value.source()
+            elif isinstance(value, QgsProcessingOutputLayerDefinition):
+                value = value.sink.staticValue()
+            elif value is not None and not isinstance(value, (str, bool, numbers.Number)):
+                return str(value)
+            if isinstance(value, str) and value not in destinations:
+                path = value.split('|')[0]
+                if not os.path.isfile(path):
+                    # Layer ids and names of the project
+                    layer = QgsProcessingUtils.mapLayerFromString(value, self.context, False)
+                    if layer is not None:
+                        value = layer.source()
+                        path = value.split('|')[0]
+                if os.path.isfile(path):
+                    status = os.stat(path)
+                    files[path] = [status.st_size, status.st_mtime_ns]
+            elif isinstance(value, numbers.Number) and not isinstance(value, bool):
+                value = float(value)
+            return value
+
+        content = {'algorithm': algorithm, 'parameters': normalize(parameters)}
+        content['files'] = files
+        return hashlib.sha1(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _outputs_exist(self, results):
+        for value in results.values():
+            if isinstance(value, str) and os.path.dirname(os.path.abspath(value.split('|')[0])) == self.directory:
+                if not os.path.exists(value.split('|')[0]):
+                    return False
+        return True
+
+    def _save(self):
+        path = os.path.join(self.directory, MANIFEST)
+        # Write then rename so an interrupted run never leaves a partial manifest
+        with open(path + '.tmp', 'w') as manifest:
+            json.dump(self.manifest, manifest, indent=1, sort_keys=True)
+        os.replace(path + '.tmp', path)
+
+
+def _normalized(value):
+    """Comparable form of a file path, layer options after | dropped."""
+    return os.path.normcase(os.path.abspath(value.split('|')[0]))
+
+
+def _serializable(results):
+    """Keep the results a manifest can store: paths, numbers and strings."""
+    kept = {}
+    for key, value in results.items():
+        if isinstance(value, (str, bool)) or value is None:
+            kept[key] = value
+        elif isinstance(value, numbers.Integral):
+            kept[key] = int(value)
+        elif isinstance(value, numbers.Number):
+            kept[key] = float(value)
+    return kept
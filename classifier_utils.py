@@ -0,0 +1,82 @@
+"""
+/***************************************************************************
+ Pixel classifier helpers for the IDP Sites Mapping toolbox.
+
+ Feature stacks follow the rule based Tent Extraction model: F1 (mean
+ absolute chromaticity difference of red and green), F3 (green excess over
+ red and blue) and the OTB Soil Brightness index. No qgis imports, the
+ prediction functions run inside worker processes.
+ ***************************************************************************/
+"""
+
+import numpy as np
+
+FEATURES = ['F1', 'F3', 'BI']
+
+_worker = {}
+
+
+def feature_stack(red, green, blue):
+    """Return an (n, 3) float32 array of F1, F3 and BI for the given bands."""
+    red = np.asarray(red, dtype='float32').ravel()
+    green = np.asarray(green, dtype='float32').ravel()
+    blue = np.asarray(blue, dtype='float32').ravel()
+
+    total = red + green + blue
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = red / total
+        g = green / total
+    f1 = (np.abs(r - red) + np.abs(g - green)) / 2
+    f3 = np.maximum(green - np.minimum(red, blue), 0)
+    bi = np.sqrt((red * red + green * green) / 2)
+
+    return np.column_stack((f1, f3, bi))
+
+
+def valid_rows(features):
+    """Mask of the feature rows that can be classified."""
+    return np.isfinite(features).all(axis=1)
+
+
+def init_predict_worker(image_path, model_path):
+    """Process pool initializer, opens the image and loads the model once."""
+    import joblib
+    import rasterio
+
+    bundle = joblib.load(model_path)
+    model = bundle['model']
+    # The pool already provides the parallelism
+    if hasattr(model, 'n_jobs'):
+        model.n_jobs = 1
+
+    _worker['model'] = model
+    _worker['dataset'] = rasterio.open(image_path)
+
+
+def close_predict_worker():
+    """Close the image and drop the model init_predict_worker loaded, for single worker runs."""
+    if 'dataset' in _worker:
+        _worker['dataset'].close()
+    _worker.clear()
+
+
+def predict_window(window):
+    """Classify one (col_off, row_off, width, height) window of the image.
+
+    Returns the window together with a uint8 mask where 1 marks structures.
+    """
+    from rasterio.windows import Window
+
+    col_off, row_off, width, height = window
+    dataset = _worker['dataset']
+    bands = dataset.read([1, 2, 3], window=Window(col_off, row_off, width, height), masked=True)
+
+    nodata = np.ma.getmaskarray(bands).any(axis=0).ravel()
+    features = feature_stack(*(band.filled(0) for band in bands))
+    valid = valid_rows(features) & ~nodata
+
+    mask = np.zeros(width * height, dtype='uint8')
+    if valid.any():
+        mask[valid] = _worker['model'].predict(features[valid]) == 1
+
+    return window, mask.reshape(height, width)
@@ -0,0 +1,146 @@
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessing,
+                       QgsWkbTypes,
+                       QgsProcessingException,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterDefinition,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterFeatureSink)
+
+
+class CleanStructureGeometries(QgsProcessingAlgorithm):
+    """
+    This script explodes, repairs and removes holes from structure polygons in a single
+    streaming pass, replacing the multipart/fix/delete holes/fix chain of temporary layers.
+    """
+
+    INPUT = 'INPUT'
+    MIN_HOLE_AREA = 'MIN_HOLE_AREA'
+    BATCH_SIZE = 'BATCH_SIZE'
+    WORKERS = 'WORKERS'
+    OUTPUT = 'OUTPUT'
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return CleanStructureGeometries()
+
+    def name(self):
+        return 'cleanstructuregeometries'
+
+    def displayName(self):
+        return self.tr('Clean Structure Geometries')
+
+    def group(self):
+        return self.tr('Processing Tools')
+
+    def groupId(self):
+        return 'processing'
+
+    def shortHelpString(self):
+        return self.tr('''Cleans a polygon layer in one pass: multipart features are exploded, invalid geometries are repaired, holes smaller than Minimum Hole Area are removed and empty or degenerate pieces are dropped. The result matches running Multipart to Singleparts, Fix Geometries, Delete Holes and Fix Geometries, without materializing the intermediate layers. \n
+        Features are streamed in batches of Batch Size, cleaned on Workers processes (0 uses one per spare CPU) and written straight to the output.''')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT,
+                self.tr('Structures'),
+                [QgsProcessing.TypeVectorPolygon]
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MIN_HOLE_AREA,
+                self.tr('Minimum Hole Area'),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=5,
+                minValue=0
+            )
+        )
+
+        param1 = QgsProcessingParameterNumber(self.BATCH_SIZE,
+                                self.tr('Batch Size'), QgsProcessingParameterNumber.Integer, 50000, minValue=100)
+        param2 = QgsProcessingParameterNumber(self.WORKERS,
+                                self.tr('Worker Processes'), QgsProcessingParameterNumber.Integer, 0, minValue=0)
+
+        param1.setFlags(param1.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        param2.setFlags(param2.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        self.addParameter(param1)
+        self.addParameter(param2)
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT,
+                self.tr('Structures'),
+                QgsProcessing.TypeVectorPolygon
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+
+        try:
+            from .layer_io import write_features
+            from .tiling import map_tiles, worker_count
+            from .vector_ops import clean_chunk
+
+        except Exception as e:
+            feedback.reportError(QCoreApplication.translate('Error','%s'%(e)))
+            feedback.reportError(QCoreApplication.translate('Error',' '))
+            feedback.reportError(QCoreApplication.translate('Error','Error loading modules - please install the shapely python module'))
+            return {}
+
+        source = self.parameterAsSource(parameters, self.INPUT, context)
+        if source is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.INPUT))
+        min_hole_area = self.parameterAsDouble(parameters, self.MIN_HOLE_AREA, context)
+        batch_size = self.parameterAsInt(parameters, self.BATCH_SIZE, context)
+        workers = worker_count(self.parameterAsInt(parameters, self.WORKERS, context))
+
+        fields = source.fields()
+        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context, fields, QgsWkbTypes.Polygon, source.sourceCrs())
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+
+        # Attributes stay in this process, only the geometries travel to the workers
+        pending = {}
+
+        def batches():
+            rows, wkbs = [], []
+            for feature in source.getFeatures():
+                if feedback.isCanceled():
+                    return
+                rows.append(feature.attributes())
+                wkbs.append(bytes(feature.geometry().asWkb()) if feature.hasGeometry() else None)
+                if len(wkbs) == batch_size:
+                    pending[len(pending)] = rows
+                    yield (len(pending) - 1, wkbs, min_hole_area)
+                    rows, wkbs = [], []
+            if wkbs:
+                pending[len(pending)] = rows
+                yield (len(pending) - 1, wkbs, min_hole_area)
+
+        total = 100.0 / source.featureCount() if source.featureCount() else 0
+        processed = 0
+        written = 0
+
+        results = map_tiles(clean_chunk, batches(), workers)
+        try:
+            for batch_id, index, parts in results:
+                if feedback.isCanceled():
+                    break
+                rows = pending[batch_id]
+                pending[batch_id] = None
+                write_features(sink, fields, [rows[i] for i in index], parts)
+                processed += len(rows)
+                written += len(index)
+                feedback.setProgress(int(processed * total))
+        finally:
+            results.close()
+
+        feedback.pushInfo('{} features cleaned into {} polygons'.format(processed, written))
+
+        return {self.OUTPUT: dest_id}
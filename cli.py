@@ -0,0 +1,192 @@
+"""
+/***************************************************************************
+ Headless command line runner of the IDP Sites Mapping algorithms.
+
+ Starts QGIS without a GUI, loads only the processing providers the
+ pipelines call and the IDP Sites Mapping provider, then runs algorithms
+ from JSON parameter files. With --watch it keeps running and processes the
+ parameter files dropped in a folder, so the start-up cost is paid once.
+
+ Run it from the folder containing the plugin, e.g. for cron:
+
+     python -m idp_sites_mapping.cli --algorithm "Tent Extraction" scene_12.json
+     python -m idp_sites_mapping.cli --watch /data/jobs
+
+ A parameter file holds the algorithm parameters, or an object with an
+ "algorithm" and a "parameters" entry.
+ ***************************************************************************/
+"""
+
+import os
+import sys
+import json
+import glob
+import time
+import shutil
+import argparse
+import traceback
+
+PROVIDER_PREFIX = 'IDP_Sites_Mapping:'
+
+# Processing providers called by the pipelines, as (module, class) candidates
+# of the QGIS releases that moved them
+PROVIDERS = {
+    'qgis': [('processing.algs.qgis.QgisAlgorithmProvider', 'QgisAlgorithmProvider')],
+    'gdal': [('processing.algs.gdal.GdalAlgorithmProvider', 'GdalAlgorithmProvider')],
+    'grass': [('grassprovider.grass_provider', 'GrassProvider'),
+              ('grassprovider.Grass7AlgorithmProvider', 'Grass7AlgorithmProvider'),
+              ('processing.algs.grass7.Grass7AlgorithmProvider', 'Grass7AlgorithmProvider')],
+    'otb': [('otbprovider.OtbAlgorithmProvider', 'OtbAlgorithmProvider'),
+            ('processing.algs.otb.OtbAlgorithmProvider', 'OtbAlgorithmProvider')],
+}
+
+
+def start_qgis(providers):
+    """Start a QgsApplication without GUI and register the requested providers."""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    from qgis.core import QgsApplication
+    from qgis.analysis import QgsNativeAlgorithms
+
+    application = QgsApplication([], False)
+    application.initQgis()
+
+    # The processing plugin ships with QGIS but is not on the path outside the GUI
+    plugins = os.path.join(QgsApplication.pkgDataPath(), 'python', 'plugins')
+    if plugins not in sys.path:
+        sys.path.append(plugins)
+
+    from processing.core.ProcessingConfig import ProcessingConfig
+    ProcessingConfig.initialize()
+
+    registry = QgsApplication.processingRegistry()
+    registry.addProvider(QgsNativeAlgorithms())
+    for name in providers:
+        provider = None
+        for module_name, class_name in PROVIDERS[name]:
+            try:
+                module = __import__(module_name, fromlist=[class_name])
+            except ImportError:
+                continue
+            provider = getattr(module, class_name)()
+            break
+        if provider is None:
+            print('Processing provider {} is not available'.format(name), file=sys.stderr)
+        else:
+            registry.addProvider(provider)
+
+    from .idp_sites_mapping_provider import IDPSiteMappingProvider
+    registry.addProvider(IDPSiteMappingProvider())
+    return application
+
+
+def load_job(path, algorithm):
+    """Return (algorithm id, parameters) of a parameter file."""
+    with open(path) as job:
+        content = json.load(job)
+    if 'parameters' in content and isinstance(content['parameters'], dict):
+        algorithm = content.get('algorithm', algorithm)
+        content = content['parameters']
+    if not algorithm:
+        raise ValueError('{} does not name an algorithm and no --algorithm was given'.format(path))
+    if ':' not in algorithm:
+        algorithm = PROVIDER_PREFIX + algorithm
+    return algorithm, content
+
+
+def run_job(path, algorithm, project):
+    """Run one parameter file, returns the algorithm results."""
+    from qgis.core import QgsProcessingContext, QgsProcessingFeedback
+    from qgis import processing
+
+    class ConsoleFeedback(QgsProcessingFeedback):
+
+        def pushInfo(self, info):
+            print(info, file=sys.stderr)
+
+        def reportError(self, error, fatalError=False):
+            print('ERROR: ' + error, file=sys.stderr)
+
+    algorithm, parameters = load_job(path, algorithm)
+    context = QgsProcessingContext()
+    context.setProject(project)
+    print('Running {} with {}'.format(algorithm, path), file=sys.stderr)
+    return processing.run(algorithm, parameters, context=context, feedback=ConsoleFeedback())
+
+
+def run_files(paths, algorithm, project):
+    """Run every parameter file, returns the number of failures."""
+    failures = 0
+    for path in paths:
+        try:
+            results = run_job(path, algorithm, project)
+        except Exception:
+            traceback.print_exc()
+            failures += 1
+            continue
+        print(json.dumps({'file': path, 'results': results}, default=str))
+    return failures
+
+
+def watch(folder, algorithm, project, interval):
+    """Process the parameter files dropped in folder until interrupted.
+
+    Every file is moved to the done or failed subfolder once it ran, with
+    its results or error next to it.
+    """
+    for name in ('done', 'failed'):
+        os.makedirs(os.path.join(folder, name), exist_ok=True)
+    print('Watching {}'.format(folder), file=sys.stderr)
+    while True:
+        for path in sorted(glob.glob(os.path.join(folder, '*.json'))):
+            stem = os.path.splitext(os.path.basename(path))[0]
+            try:
+                results = run_job(path, algorithm, project)
+                target, report = 'done', json.dumps(results, default=str, indent=1)
+            except Exception:
+                target, report = 'failed', traceback.format_exc()
+                print(report, file=sys.stderr)
+            shutil.move(path, os.path.join(folder, target, os.path.basename(path)))
+            with open(os.path.join(folder, target, stem + ('.results.json' if target == 'done' else '.error.txt')), 'w') as output:
+                output.write(report)
+        time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run IDP Sites Mapping algorithms without the QGIS GUI.')
+    parser.add_argument('files', nargs='*', help='JSON parameter files, run in order')
+    parser.add_argument('--algorithm', help='algorithm name or id, e.g. "Tent Extraction", for parameter files that do not name one')
+    parser.add_argument('--providers', default='qgis,gdal,grass,otb',
+                        help='comma separated processing providers to load besides native, from {} (default: %(default)s)'.format(', '.join(sorted(PROVIDERS))))
+    parser.add_argument('--project', help='QGIS project to load, for parameters referring to project layers')
+    parser.add_argument('--watch', metavar='FOLDER', help='keep running and process the parameter files dropped in FOLDER')
+    parser.add_argument('--interval', type=float, default=10, help='seconds between two scans of the watched folder (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    providers = [name.strip() for name in args.providers.split(',') if name.strip()]
+    unknown = set(providers) - set(PROVIDERS)
+    if unknown:
+        parser.error('unknown providers: {}'.format(', '.join(sorted(unknown))))
+    if not args.files and not args.watch:
+        parser.error('give parameter files or --watch')
+
+    application = start_qgis(providers)
+    from qgis.core import QgsProject
+    project = QgsProject.instance()
+    if args.project and not project.read(args.project):
+        parser.error('could not read the project {}'.format(args.project))
+
+    failures = 0
+    try:
+        failures = run_files(args.files, args.algorithm, project)
+        if args.watch:
+            watch(args.watch, args.algorithm, project, args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        application.exitQgis()
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
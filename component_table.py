@@ -0,0 +1,178 @@
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+from qgis.core import (QgsProcessing,
+                       QgsField,
+                       QgsFields,
+                       QgsWkbTypes,
+                       QgsProcessingException,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterDefinition,
+                       QgsProcessingParameterRasterLayer,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterFeatureSink)
+
+
+class StructureComponentTable(QgsProcessingAlgorithm):
+    """
+    This script writes one point per connected structure of a binary structure mask with its
+    region properties, without polygonizing the mask.
+    """
+
+    INPUT = 'INPUT'
+    MIN_PIXELS = 'MIN_PIXELS'
+    CONNECTIVITY = 'CONNECTIVITY'
+    TILE_SIZE = 'TILE_SIZE'
+    WORKERS = 'WORKERS'
+    OUTPUT = 'OUTPUT'
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return StructureComponentTable()
+
+    def name(self):
+        return 'structurecomponenttable'
+
+    def displayName(self):
+        return self.tr('Structure Component Table')
+
+    def group(self):
+        return self.tr('Processing Tools')
+
+    def groupId(self):
+        return 'processing'
+
+    def shortHelpString(self):
+        return self.tr('''Labels the connected structures of a binary structure mask (non zero = structure) and writes one point per structure at its centroid, skipping Polygonize and the vector cleanup. Structures smaller than Minimum Pixels are left out. \n
+        The attributes hold the pixel count, the area in map units, the bounding box and the orientation of the major axis in degrees counterclockwise from east, computed from the second order moments of the pixels. \n
+        The mask is labelled in tiles of Tile Size pixels on Workers processes (0 uses one per spare CPU) and the structures crossing tile borders are joined, so every structure is reported once.''')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUT,
+                self.tr('Structure Mask')
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MIN_PIXELS,
+                self.tr('Minimum Pixels'),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=1,
+                minValue=1
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.CONNECTIVITY,
+                self.tr('Connectivity'),
+                options=['4', '8'],
+                defaultValue=0
+            )
+        )
+
+        param1 = QgsProcessingParameterNumber(self.TILE_SIZE,
+                                self.tr('Tile Size (pixels)'), QgsProcessingParameterNumber.Integer, 1024, minValue=64)
+        param2 = QgsProcessingParameterNumber(self.WORKERS,
+                                self.tr('Worker Processes'), QgsProcessingParameterNumber.Integer, 0, minValue=0)
+
+        param1.setFlags(param1.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        param2.setFlags(param2.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        self.addParameter(param1)
+        self.addParameter(param2)
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT,
+                self.tr('Structure Components'),
+                QgsProcessing.TypeVectorPoint
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+
+        try:
+            import numpy as np
+            import rasterio
+            import shapely
+            from .layer_io import write_features
+            from .tiling import iter_windows, map_tiles, worker_count
+            from .raster_ops import init_mask_worker, close_worker, component_window, component_roots, component_properties
+
+        except Exception as e:
+            feedback.reportError(QCoreApplication.translate('Error','%s'%(e)))
+            feedback.reportError(QCoreApplication.translate('Error',' '))
+            feedback.reportError(QCoreApplication.translate('Error','Error loading modules - please install the rasterio, scipy and shapely python modules'))
+            return {}
+
+        mask = self.parameterAsRasterLayer(parameters, self.INPUT, context)
+        if mask is None:
+            raise QgsProcessingException(self.invalidRasterError(parameters, self.INPUT))
+        min_pixels = self.parameterAsInt(parameters, self.MIN_PIXELS, context)
+        connectivity = [4, 8][self.parameterAsEnum(parameters, self.CONNECTIVITY, context)]
+        tile_size = self.parameterAsInt(parameters, self.TILE_SIZE, context)
+        workers = worker_count(self.parameterAsInt(parameters, self.WORKERS, context))
+
+        mask_path = mask.source()
+        with rasterio.open(mask_path) as src:
+            transform = src.transform
+            windows = list(iter_windows(src.width, src.height, tile_size))
+            grid = (-(-src.height // tile_size), -(-src.width // tile_size))
+
+        fields = QgsFields()
+        fields.append(QgsField('id', QVariant.Int))
+        fields.append(QgsField('pixels', QVariant.Int))
+        fields.append(QgsField('area', QVariant.Double))
+        fields.append(QgsField('xmin', QVariant.Double))
+        fields.append(QgsField('ymin', QVariant.Double))
+        fields.append(QgsField('xmax', QVariant.Double))
+        fields.append(QgsField('ymax', QVariant.Double))
+        fields.append(QgsField('orientation', QVariant.Double))
+
+        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context, fields, QgsWkbTypes.Point, mask.crs())
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+
+        feedback.pushInfo('Labelling {} tiles on {} worker(s)'.format(len(windows), workers))
+        total = 80.0 / len(windows)
+        counts = [0] * len(windows)
+        sizes = [None] * len(windows)
+        edges = [None] * len(windows)
+        stats = [None] * len(windows)
+
+        results = map_tiles(component_window, ((tile, window, connectivity) for tile, window in enumerate(windows)),
+                            workers, init_mask_worker, (mask_path,), close_worker)
+        try:
+            for current, (tile, count, tile_sizes, tile_edges, tile_stats) in enumerate(results):
+                if feedback.isCanceled():
+                    return {}
+                counts[tile], sizes[tile], edges[tile], stats[tile] = count, tile_sizes, tile_edges, tile_stats
+                feedback.setProgress(int((current + 1) * total))
+        finally:
+            results.close()
+
+        roots, root_sizes = component_roots(counts, sizes, edges, grid, connectivity)[1:]
+        pixels, centroids, boxes, orientation = component_properties(roots, root_sizes, np.concatenate([np.zeros((1, 9))] + stats))
+
+        keep = pixels >= min_pixels
+        pixels, centroids, boxes, orientation = pixels[keep], centroids[keep], boxes[keep], orientation[keep]
+        feedback.pushInfo('{} structures with at least {} pixels'.format(len(pixels), min_pixels))
+
+        def to_map(cols, rows):
+            return (transform.a * cols + transform.b * rows + transform.c,
+                    transform.d * cols + transform.e * rows + transform.f)
+
+        # Pixel coordinates to map coordinates, the boxes cover whole pixels
+        x, y = to_map(centroids[:, 0], centroids[:, 1])
+        x0, y0 = to_map(boxes[:, 0], boxes[:, 1])
+        x1, y1 = to_map(boxes[:, 2] + 1, boxes[:, 3] + 1)
+        pixel_area = abs(transform.a * transform.e - transform.b * transform.d)
+
+        rows = [[i + 1, int(n), float(n * pixel_area), float(min(a, c)), float(min(b, d)), float(max(a, c)), float(max(b, d)), float(angle)]
+                for i, (n, a, b, c, d, angle) in enumerate(zip(pixels, x0, y0, x1, y1, orientation))]
+        write_features(sink, fields, rows, shapely.points(x, y))
+
+        return {self.OUTPUT: dest_id}
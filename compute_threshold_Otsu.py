@@ -7,8 +7,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingOutputString,
                        QgsProcessingParameterFileDestination)
 
-import rasterio
-from skimage.filters import threshold_otsu
 import tempfile
 import os
 
@@ -71,6 +69,18 @@ class ThresholdUsingOtsuAlgorithm(QgsProcessingAlgorithm):
         )
 
     def processAlgorithm(self, parameters, context, feedback):
+
+        # scikit-image and rasterio are only loaded when the threshold is computed, not with the plugin
+        try:
+            import rasterio
+            from skimage.filters import threshold_otsu
+
+        except Exception as e:
+            feedback.reportError(QCoreApplication.translate('Error','%s'%(e)))
+            feedback.reportError(QCoreApplication.translate('Error',' '))
+            feedback.reportError(QCoreApplication.translate('Error','Error loading modules - please install the scikit-image and rasterio python modules'))
+            return {}
+
         input_raster = self.parameterAsRasterLayer(parameters, self.INPUT, context)
         input_raster_path = input_raster.source()
 
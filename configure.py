@@ -56,6 +56,17 @@ class configureTOOLS(QgsProcessingAlgorithm):
         pass
 
     def processAlgorithm(self, parameters, context, feedback):
+        from .dependencies import dependency_status, missing_requirements
+        from .layer_io import cache_directory
+
+        requirements = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'requirements.txt')
+        cache = os.path.join(cache_directory(), 'dependencies.json')
+        for status in dependency_status(requirements, cache):
+            feedback.pushInfo('%s (%s): %s %s' % (status['distribution'], status['module'], status['status'], status['version'] or ''))
+        missing = missing_requirements(requirements, cache)
+        if not missing:
+            feedback.pushInfo(self.tr('All dependencies are installed'))
+            return {}
 
         if os.name == 'nt': ##GUI for python installer via subprocess module
             reply = QMessageBox.question(iface.mainWindow(), 'Install Dependencies',
@@ -68,9 +79,7 @@ class configureTOOLS(QgsProcessingAlgorithm):
                     import ctypes
                     is_admin = ctypes.windll.shell32.IsUserAnAdmin() != 0
 
-                # modules = ['segment-geospatial==0.5.0']
-                modules = ['segment-geospatial==0.5.0','numpy==1.24.1', 'rasterio', 'opencv-python==4.5.5.64', 'networkx==3.2.1', 'scikit-image==0.22.0',
-                            'scikit-learn==1.4.2', ]
+                modules = missing
 
                 for module in modules:
                     try:
@@ -88,7 +97,7 @@ class configureTOOLS(QgsProcessingAlgorithm):
                     #     feedback.reportError(QCoreApplication.translate('Warning','Failed to install %s - consider installing manually'%(module)))
                     #     return {}
         else:
-            feedback.reportError(QCoreApplication.translate('Warning','macOS and Linux users - manually install the segment-geospatial python package.'))
+            feedback.reportError(QCoreApplication.translate('Warning','macOS and Linux users - manually install the missing python packages: %s' % (' '.join(missing))))
             return {}
 
         return {}
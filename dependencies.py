@@ -0,0 +1,160 @@
+"""
+/***************************************************************************
+ Dependency status of the IDP Sites Mapping plugin.
+
+ The requirements are resolved from the installed distributions metadata,
+ never by importing them, so checking segment-geospatial does not load
+ torch. The result is cached in a JSON file keyed on the interpreter, the
+ requirements file and the modification times of the site-packages
+ folders, which change whenever a package is installed or removed. No qgis
+ imports.
+ ***************************************************************************/
+"""
+
+import os
+import re
+import sys
+import json
+import hashlib
+import importlib.util
+
+try:
+    from importlib import metadata
+except ImportError:  # Python < 3.8
+    import importlib_metadata as metadata
+
+# Import name of the distributions whose name differs from their module
+MODULES = {
+    'segment-geospatial': 'samgeo',
+    'opencv-python': 'cv2',
+    'opencv-python-headless': 'cv2',
+    'scikit-image': 'skimage',
+    'scikit-learn': 'sklearn',
+}
+
+INSTALLED = 'installed'
+MISMATCH = 'version mismatch'
+MISSING = 'missing'
+
+# Bumped whenever the cached statuses change format
+CACHE_VERSION = 2
+
+
+def parse_requirement(line):
+    """Return (distribution, operator, version) of a requirements line, None for blanks and comments.
+
+    operator and version are None for unpinned requirements, only == and >=
+    are understood.
+    """
+    line = line.split('#')[0].strip()
+    if not line:
+        return None
+    match = re.match(r'([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:\[[^\]]*\])?\s*(?:(==|>=)\s*([^\s;,]+))?', line)
+    if match is None:
+        return None
+    return match.group(1), match.group(2), match.group(3)
+
+
+def module_name(distribution):
+    """Import name of a distribution."""
+    name = distribution.lower().replace('_', '-')
+    return MODULES.get(name, name.replace('-', '_'))
+
+
+def version_key(version):
+    """Comparable tuple of the leading numeric release parts of a version, '2.0.1rc1' gives (2, 0, 1)."""
+    parts = []
+    for part in version.split('.'):
+        match = re.match(r'\d+', part)
+        if match is None:
+            break
+        parts.append(int(match.group()))
+        if match.end() < len(part):
+            break
+    while parts and parts[-1] == 0:
+        parts.pop()
+    return tuple(parts)
+
+
+def satisfies(version, operator, required):
+    """Whether an installed version meets an == or >= requirement."""
+    if operator is None or version is None:
+        return True
+    if operator == '>=':
+        return version_key(version) >= version_key(required)
+    return version == required
+
+
+def requirement_status(distribution, operator=None, required=None):
+    """Status of one requirement as a dict of distribution, module, version, requirement and status."""
+    module = module_name(distribution)
+    pinned = operator + required if operator else None
+    try:
+        version = metadata.version(distribution)
+    except metadata.PackageNotFoundError:
+        version = None
+        # Packages installed without metadata (system or OSGeo4W packages) are
+        # still found on the path, without importing them
+        try:
+            found = importlib.util.find_spec(module) is not None
+        except (ImportError, ValueError):
+            found = False
+        if not found:
+            return {'distribution': distribution, 'module': module, 'version': None, 'pinned': pinned, 'status': MISSING}
+    status = INSTALLED if satisfies(version, operator, required) else MISMATCH
+    return {'distribution': distribution, 'module': module, 'version': version, 'pinned': pinned, 'status': status}
+
+
+def environment_key(requirements_path):
+    """Key changing with the interpreter, the requirements and the installed packages."""
+    parts = [str(CACHE_VERSION), sys.executable, sys.version, requirements_path]
+    paths = [requirements_path] + [path for path in sys.path if os.path.basename(path) in ('site-packages', 'dist-packages')]
+    for path in paths:
+        try:
+            status = os.stat(path)
+        except OSError:
+            continue
+        parts.append('{}:{}:{}'.format(path, status.st_size, status.st_mtime_ns))
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def dependency_status(requirements_path, cache_path=None):
+    """Status of every requirement of requirements_path, cached in cache_path."""
+    key = environment_key(requirements_path)
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path) as cached:
+                content = json.load(cached)
+            if content.get('key') == key:
+                return content['requirements']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    with open(requirements_path) as requirements:
+        parsed = [parse_requirement(line) for line in requirements]
+    statuses = [requirement_status(*requirement) for requirement in parsed if requirement is not None]
+
+    if cache_path:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(cache_path + '.tmp', 'w') as cached:
+                json.dump({'key': key, 'requirements': statuses}, cached, indent=1)
+            os.replace(cache_path + '.tmp', cache_path)
+        except OSError:
+            pass
+    return statuses
+
+
+def missing_requirements(requirements_path, cache_path=None):
+    """Requirement strings of the distributions to install, pins included.
+
+    Besides the missing distributions, this holds those older than a >=
+    minimum, which the tools cannot run with. An == mismatch is only
+    reported, a newer release may be installed on purpose.
+    """
+    missing = []
+    for status in dependency_status(requirements_path, cache_path):
+        pinned = status['pinned'] or ''
+        if status['status'] == MISSING or (status['status'] == MISMATCH and pinned.startswith('>=')):
+            missing.append(status['distribution'] + pinned)
+    return missing
@@ -0,0 +1,119 @@
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessing,
+                       QgsFeatureSource,
+                       QgsFeatureRequest,
+                       QgsSpatialIndex,
+                       QgsProcessingException,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterDefinition,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterExtent,
+                       QgsProcessingParameterCrs,
+                       QgsProcessingParameterFeatureSink)
+from .layer_io import BatchWriter, ThrottledProgress
+
+
+class ExtractFeaturesInExtent(QgsProcessingAlgorithm):
+    """
+    This script copies only the features intersecting an extent, pushing the extent down to the
+    data provider so large layers such as country wide building footprints are not read in full.
+    """
+
+    INPUT = 'INPUT'
+    EXTENT = 'EXTENT'
+    TARGET_CRS = 'TARGET_CRS'
+    OUTPUT = 'OUTPUT'
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return ExtractFeaturesInExtent()
+
+    def name(self):
+        return 'extractfeaturesinextent'
+
+    def displayName(self):
+        return self.tr('Extract Features in Extent')
+
+    def group(self):
+        return self.tr('Processing Tools')
+
+    def groupId(self):
+        return 'processing'
+
+    def shortHelpString(self):
+        return self.tr('''Extracts the features of the Input Layer that intersect the Extent, reprojected to the Target CRS (the layer CRS when not set). \n
+        The extent is passed to the data provider as a spatial filter, so layers with a spatial index (GeoPackage, Shapefile with .qix, PostGIS) only read the features around the scene. When the provider has no spatial index a temporary one is built over the feature bounding boxes first.''')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT,
+                self.tr('Input Layer'),
+                [QgsProcessing.TypeVectorAnyGeometry]
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterExtent(
+                self.EXTENT,
+                self.tr('Extent')
+            )
+        )
+
+        param = QgsProcessingParameterCrs(self.TARGET_CRS, self.tr('Target CRS'), optional=True)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT,
+                self.tr('Extracted Features'),
+                QgsProcessing.TypeVectorAnyGeometry
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        source = self.parameterAsSource(parameters, self.INPUT, context)
+        if source is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.INPUT))
+
+        crs = self.parameterAsCrs(parameters, self.TARGET_CRS, context)
+        if not crs.isValid():
+            crs = source.sourceCrs()
+
+        # With a destination CRS the request rectangle is given in that CRS
+        extent = self.parameterAsExtent(parameters, self.EXTENT, context, crs)
+
+        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context, source.fields(), source.wkbType(), crs)
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+
+        request = QgsFeatureRequest().setDestinationCrs(crs, context.transformContext())
+
+        indexed = source.hasSpatialIndex() == QgsFeatureSource.SpatialIndexPresent
+        if indexed:
+            request.setFilterRect(extent)
+            request.setFlags(QgsFeatureRequest.ExactIntersect)
+        else:
+            feedback.pushInfo('The Input Layer has no spatial index, building a temporary one')
+            index = QgsSpatialIndex(source.getFeatures(QgsFeatureRequest().setNoAttributes()), feedback)
+            if feedback.isCanceled():
+                return {}
+            # The temporary index holds the layer CRS bounding boxes
+            request.setFilterFids(index.intersects(self.parameterAsExtent(parameters, self.EXTENT, context, source.sourceCrs())))
+
+        writer = BatchWriter(sink)
+        progress = ThrottledProgress(feedback, source.featureCount())
+        for current, feature in enumerate(source.getFeatures(request)):
+            if feedback.isCanceled():
+                break
+            if not indexed and not feature.geometry().intersects(extent):
+                continue
+            writer.add(feature)
+            progress.update(current)
+        writer.flush()
+
+        feedback.pushInfo('{} of {} features intersect the extent'.format(writer.written, source.featureCount()))
+
+        return {self.OUTPUT: dest_id}
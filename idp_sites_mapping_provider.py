@@ -35,10 +35,25 @@ from .configure import configureTOOLS
 from .BilateralFiltering import BilateralFiltering
 from .computed_ranges import RasterClassificationUsingComputedRanges
 from .compute_threshold_Otsu import ThresholdUsingOtsuAlgorithm
+from .bare_areas_clustering import ComputeBareAreaRangeWithClustering
+from .pixel_classifier import TrainPixelClassifier, PixelClassification
+from .known_sites import BufferKnownSites
+from .extract_in_extent import ExtractFeaturesInExtent
+from .spatial_overlay import OverlayStructuresWithSites
+from .clean_geometries import CleanStructureGeometries
+from .sieve_filter import SieveStructureMask
+from .component_table import StructureComponentTable
+from .rectanglify import RectanglifyStructures
+from .shape_filter import FilterStructuresByShape
 from .Segment_with_Thresholding import SegmentationUsingThresholding
 from .BuiltUP_Areas_Extraction import TentExtraction
 from .BuiltUP_Areas_Extraction_for_Known_Areas import TentExtractionForKnownAreas
+from .BuiltUP_Areas_Classification import TentExtractionWithClassifier
+from .batch_runner import BatchTentExtraction
+from .incremental_extraction import IncrementalTentExtraction
+from .pyramid_extraction import PyramidTentExtraction
 from .population_estimate import PopulationEstimation
+from .structure_changes import StructureChangeDetection
 
 
 class IDPSiteMappingProvider(QgsProcessingProvider):
@@ -65,11 +80,27 @@ class IDPSiteMappingProvider(QgsProcessingProvider):
         self.addAlgorithm(BilateralFiltering())
         self.addAlgorithm(RasterClassificationUsingComputedRanges())
         self.addAlgorithm(ThresholdUsingOtsuAlgorithm())
+        self.addAlgorithm(ComputeBareAreaRangeWithClustering())
+        self.addAlgorithm(TrainPixelClassifier())
+        self.addAlgorithm(PixelClassification())
+        self.addAlgorithm(BufferKnownSites())
+        self.addAlgorithm(ExtractFeaturesInExtent())
+        self.addAlgorithm(OverlayStructuresWithSites())
+        self.addAlgorithm(CleanStructureGeometries())
+        self.addAlgorithm(SieveStructureMask())
+        self.addAlgorithm(StructureComponentTable())
+        self.addAlgorithm(RectanglifyStructures())
+        self.addAlgorithm(FilterStructuresByShape())
         self.addAlgorithm(SegmentationUsingThresholding())
         # Segmentation Tools
         self.addAlgorithm(TentExtraction())
         self.addAlgorithm(TentExtractionForKnownAreas())
+        self.addAlgorithm(TentExtractionWithClassifier())
+        self.addAlgorithm(BatchTentExtraction())
+        self.addAlgorithm(IncrementalTentExtraction())
+        self.addAlgorithm(PyramidTentExtraction())
         self.addAlgorithm(PopulationEstimation())
+        self.addAlgorithm(StructureChangeDetection())
         # add additional algorithms here
         # self.addAlgorithm(MyOtherAlgorithm())
 
@@ -0,0 +1,346 @@
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+from qgis.core import (QgsProcessing,
+                       QgsField,
+                       QgsFields,
+                       QgsWkbTypes,
+                       QgsRectangle,
+                       QgsFeatureRequest,
+                       QgsProcessingUtils,
+                       QgsProcessingException,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterDefinition,
+                       QgsProcessingParameterRasterLayer,
+                       QgsProcessingParameterVectorLayer,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterFeatureSink,
+                       QgsProcessingOutputNumber)
+from qgis import processing
+
+
+class IncrementalTentExtraction(QgsProcessingAlgorithm):
+    """
+    This script updates the structures of a previous acquisition by running Tent Extraction
+    only on the tiles of the new image that changed, and splicing the results in.
+    """
+
+    INPUT = 'INPUT'
+    PREVIOUS_IMAGE = 'PREVIOUS_IMAGE'
+    PREVIOUS_STRUCTURES = 'PREVIOUS_STRUCTURES'
+    SAMPLES = 'SAMPLES'
+    AUTO_BARE_AREAS = 'AUTO_BARE_AREAS'
+    TILE_SIZE = 'TILE_SIZE'
+    CHANGE_THRESHOLD = 'CHANGE_THRESHOLD'
+    MARGIN = 'MARGIN'
+    DECIMATION = 'DECIMATION'
+    WORKERS = 'WORKERS'
+    OUTPUT = 'OUTPUT'
+    CHANGED_TILES = 'CHANGED_TILES'
+    CHANGED_COUNT = 'CHANGED_COUNT'
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return IncrementalTentExtraction()
+
+    def name(self):
+        return 'incrementaltentextraction'
+
+    def displayName(self):
+        return self.tr('Incremental Tent Extraction')
+
+    def group(self):
+        return self.tr('Segmentation')
+
+    def groupId(self):
+        return 'segmentation'
+
+    def shortHelpString(self):
+        return self.tr('''Updates the Previous Structures, extracted from the Previous Satellite Image, for a new acquisition of the same area without processing the whole new scene. \n
+        The new image is cut in tiles of Tile Size pixels and every tile gets a change score: half the mean absolute difference of the band chromaticity (band over band sum) between the two images, read at 1/Decimation resolution. Chromaticity ignores overall brightness differences between the acquisitions; 0 means identical colours and 1 completely different ones. The images must share their CRS and be co-registered. \n
+        Tiles scoring at least Change Threshold are grouped in windows which are grown by Margin pixels and processed with Tent Extraction. Structures whose point on surface falls in a changed tile are taken from the new run, all others are kept from the Previous Structures; the updated field tells them apart. Bare areas and thresholds are computed on the changed windows only. \n
+        The optional Change Tiles output holds every tile with its score, to tune the threshold.''')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUT,
+                self.tr('Satellite Image')
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.PREVIOUS_IMAGE,
+                self.tr('Previous Satellite Image')
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.PREVIOUS_STRUCTURES,
+                self.tr('Previous Structures'),
+                [QgsProcessing.TypeVectorPolygon]
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterVectorLayer(
+                self.SAMPLES,
+                self.tr('Sample Bare Areas'),
+                [QgsProcessing.TypeVectorPoint],
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.AUTO_BARE_AREAS,
+                self.tr('Derive Bare Areas Automatically'),
+                defaultValue=False
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.TILE_SIZE,
+                self.tr('Tile Size (pixels)'),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=512,
+                minValue=64
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.CHANGE_THRESHOLD,
+                self.tr('Change Threshold'),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=0.02,
+                minValue=0,
+                maxValue=1
+            )
+        )
+
+        param1 = QgsProcessingParameterNumber(self.MARGIN,
+                                self.tr('Window Margin (pixels)'), QgsProcessingParameterNumber.Integer, 32, minValue=0)
+        param2 = QgsProcessingParameterNumber(self.DECIMATION,
+                                self.tr('Change Score Decimation'), QgsProcessingParameterNumber.Integer, 4, minValue=1)
+        param3 = QgsProcessingParameterNumber(self.WORKERS,
+                                self.tr('Worker Processes'), QgsProcessingParameterNumber.Integer, 0, minValue=0)
+
+        param1.setFlags(param1.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        param2.setFlags(param2.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        param3.setFlags(param3.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        self.addParameter(param1)
+        self.addParameter(param2)
+        self.addParameter(param3)
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT,
+                self.tr('Structures'),
+                QgsProcessing.TypeVectorPolygon
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.CHANGED_TILES,
+                self.tr('Change Tiles'),
+                QgsProcessing.TypeVectorPolygon,
+                optional=True,
+                createByDefault=False
+            )
+        )
+        self.addOutput(QgsProcessingOutputNumber(self.CHANGED_COUNT, self.tr('Changed Tiles')))
+
+    def processAlgorithm(self, parameters, context, feedback):
+
+        try:
+            import numpy as np
+            import shapely
+            import rasterio
+            from .layer_io import read_geometries, write_features
+            from .raster_ops import change_window, close_worker, init_change_worker
+            from .tiling import iter_windows, map_tiles, merge_windows, tile_index, worker_count
+
+        except Exception as e:
+            feedback.reportError(QCoreApplication.translate('Error','%s'%(e)))
+            feedback.reportError(QCoreApplication.translate('Error',' '))
+            feedback.reportError(QCoreApplication.translate('Error','Error loading modules - please install the rasterio and shapely python modules'))
+            return {}
+
+        image = self.parameterAsRasterLayer(parameters, self.INPUT, context)
+        if image is None:
+            raise QgsProcessingException(self.invalidRasterError(parameters, self.INPUT))
+        previous_image = self.parameterAsRasterLayer(parameters, self.PREVIOUS_IMAGE, context)
+        if previous_image is None:
+            raise QgsProcessingException(self.invalidRasterError(parameters, self.PREVIOUS_IMAGE))
+        previous = self.parameterAsSource(parameters, self.PREVIOUS_STRUCTURES, context)
+        if previous is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.PREVIOUS_STRUCTURES))
+        samples = self.parameterAsVectorLayer(parameters, self.SAMPLES, context)
+        auto_bare_areas = self.parameterAsBoolean(parameters, self.AUTO_BARE_AREAS, context) or samples is None
+        tile_size = self.parameterAsInt(parameters, self.TILE_SIZE, context)
+        threshold = self.parameterAsDouble(parameters, self.CHANGE_THRESHOLD, context)
+        margin = self.parameterAsInt(parameters, self.MARGIN, context)
+        decimation = self.parameterAsInt(parameters, self.DECIMATION, context)
+        workers = worker_count(self.parameterAsInt(parameters, self.WORKERS, context))
+
+        crs = image.crs()
+        if previous_image.crs() != crs:
+            raise QgsProcessingException(self.tr('The Previous Satellite Image must be in the CRS of the Satellite Image'))
+        if image.bandCount() < 3 or previous_image.bandCount() < 3:
+            raise QgsProcessingException(self.tr('Both images need red, green and blue bands'))
+
+        with rasterio.open(image.source()) as src:
+            width, height = src.width, src.height
+            transform = src.transform
+        windows = list(iter_windows(width, height, tile_size))
+        grid = (-(-height // tile_size), -(-width // tile_size))
+        origin, pixel_size = (transform.c, transform.f), (transform.a, transform.e)
+
+        def to_map(col, row):
+            return origin[0] + col * pixel_size[0], origin[1] + row * pixel_size[1]
+
+        # Change score of every tile
+        feedback.pushInfo('Scoring {} tiles on {} worker(s)'.format(len(windows), workers))
+        scores = np.zeros(len(windows))
+        results = map_tiles(change_window, ((tile, window, decimation) for tile, window in enumerate(windows)),
+                            workers, init_change_worker, (image.source(), previous_image.source()), close_worker)
+        try:
+            for current, (tile, score) in enumerate(results):
+                if feedback.isCanceled():
+                    return {}
+                scores[tile] = score
+                feedback.setProgress(int(20.0 * (current + 1) / len(windows)))
+        finally:
+            results.close()
+
+        changed = scores >= threshold
+        feedback.pushInfo('{} of {} tiles changed'.format(np.count_nonzero(changed), len(windows)))
+
+        results = {self.CHANGED_COUNT: int(np.count_nonzero(changed))}
+        tile_fields = QgsFields()
+        tile_fields.append(QgsField('tile', QVariant.Int))
+        tile_fields.append(QgsField('score', QVariant.Double))
+        tile_fields.append(QgsField('changed', QVariant.Int))
+        (tiles_sink, tiles_id) = self.parameterAsSink(parameters, self.CHANGED_TILES, context, tile_fields, QgsWkbTypes.Polygon, crs)
+        if tiles_sink is not None:
+            boxes = [to_map(col_off, row_off + rows) + to_map(col_off + cols, row_off) for col_off, row_off, cols, rows in windows]
+            write_features(tiles_sink, tile_fields, [[tile, float(scores[tile]), int(changed[tile])] for tile in range(len(windows))],
+                           shapely.box(*np.array(boxes).T))
+            results[self.CHANGED_TILES] = tiles_id
+
+        # Adjacent changed tiles are processed as one window, which owns them
+        owner = np.full(len(windows), -1)
+        extraction_windows = []
+        tile_boxes = [(window[0], window[1], window[0] + window[2], window[1] + window[3]) for window in np.array(windows)[changed]]
+        for xmin, ymin, xmax, ymax in merge_windows(tile_boxes):
+            cols = np.arange(xmin // tile_size, -(-xmax // tile_size))
+            rows = np.arange(ymin // tile_size, -(-ymax // tile_size))
+            tiles = (rows[:, None] * grid[1] + cols[None, :]).ravel()
+            owner[tiles[changed[tiles]]] = len(extraction_windows)
+            west, north = to_map(max(0, xmin - margin), max(0, ymin - margin))
+            east, south = to_map(min(width, xmax + margin), min(height, ymax + margin))
+            extraction_windows.append(QgsRectangle(west, south, east, north))
+
+        # Structures found in the changed windows
+        updates = []
+        for current, window in enumerate(extraction_windows):
+            # Clip Satellite Image to the Changed Window
+            alg_params = {
+                'INPUT': parameters[self.INPUT],
+                'PROJWIN': '{},{},{},{} [{}]'.format(window.xMinimum(), window.xMaximum(), window.yMinimum(), window.yMaximum(), crs.authid()),
+                'OVERCRS': False,
+                'NODATA': None,
+                'OPTIONS': '',
+                'DATA_TYPE': 0,  # Use Input Layer Data Type
+                'EXTRA': '',
+                'OUTPUT': QgsProcessingUtils.generateTempFilename('changedWindow.tif')
+            }
+
+            feedback.pushInfo("Running algorithm: Clip Satellite Image to Changed Window {}".format(current + 1))
+
+            clipped = processing.run('gdal:cliprasterbyextent', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+
+            if feedback.isCanceled():
+                return {}
+
+            # Windows without sampled bare areas derive them by clustering
+            window_samples = False
+            if not auto_bare_areas:
+                sample_request = QgsFeatureRequest().setNoAttributes().setLimit(1)
+                sample_request.setDestinationCrs(crs, context.transformContext())
+                sample_request.setFilterRect(window)
+                window_samples = any(True for _ in samples.getFeatures(sample_request))
+
+            alg_params = {
+                'satellite_image': clipped['OUTPUT'],
+                'sample_bare_areas': parameters[self.SAMPLES] if window_samples else None,
+                'auto_bare_areas': not window_samples,
+                'Structures': QgsProcessingUtils.generateTempFilename('changedStructures.gpkg')
+            }
+
+            feedback.pushInfo("Running algorithm: Tent Extraction on Changed Window {}".format(current + 1))
+
+            extracted = processing.run('IDP_Sites_Mapping:Tent Extraction', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+            # A canceled Tent Extraction returns no outputs
+            if feedback.isCanceled():
+                return {}
+            updates.append(extracted['Structures'])
+
+            feedback.setProgress(20 + int(70.0 * (current + 1) / len(extraction_windows)))
+
+        # Splice the new structures into the previous ones
+        fields = QgsFields(previous.fields())
+        if fields.indexOf('updated') < 0:
+            fields.append(QgsField('updated', QVariant.Int))
+        updated_index = fields.indexOf('updated')
+        # Feature ids of the previous layer would collide with the new features
+        fid_index = fields.lookupField('fid')
+
+        def tiles_of(geoms):
+            points = shapely.point_on_surface(geoms)
+            return tile_index(shapely.get_x(points), shapely.get_y(points), origin, pixel_size, tile_size, grid)
+
+        request = QgsFeatureRequest().setDestinationCrs(crs, context.transformContext())
+        rows, geoms = read_geometries(previous, request, feedback)
+        # A canceled read is partial, never write it as the spliced layer
+        if feedback.isCanceled():
+            return {}
+        tiles = tiles_of(geoms)
+        kept = np.flatnonzero((tiles < 0) | ~changed[np.maximum(tiles, 0)])
+        out_rows = []
+        for i in kept:
+            row = rows[i] + [None] * (fields.count() - len(rows[i]))
+            row[updated_index] = 0
+            out_rows.append(row)
+        out_geoms = [geoms[kept]]
+        feedback.pushInfo('{} of {} previous structures kept'.format(len(kept), len(rows)))
+
+        for current, path in enumerate(updates):
+            layer = QgsProcessingUtils.mapLayerFromString(path, context)
+            new_rows, new_geoms = read_geometries(layer, request, feedback)
+            if feedback.isCanceled():
+                return {}
+            tiles = tiles_of(new_geoms)
+            # Structures in the window margins belong to the neighbouring tiles
+            taken = np.flatnonzero((tiles >= 0) & (owner[np.maximum(tiles, 0)] == current))
+            names = layer.fields().names()
+            for i in taken:
+                row = [new_rows[i][names.index(field.name())] if field.name() in names else None for field in fields]
+                row[updated_index] = 1
+                out_rows.append(row)
+            out_geoms.append(new_geoms[taken])
+
+        if fid_index >= 0:
+            for row in out_rows:
+                row[fid_index] = None
+
+        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context, fields, previous.wkbType(), crs)
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+        write_features(sink, fields, out_rows, np.concatenate(out_geoms), feedback, QgsWkbTypes.isMultiType(previous.wkbType()))
+        if feedback.isCanceled():
+            return {}
+
+        results[self.OUTPUT] = dest_id
+        return results
@@ -29,6 +29,18 @@ import platform
 def install_dependencies():
     plugin_dir = os.path.dirname(os.path.realpath(__file__))
     operating_system = platform.system()
+    sys.path.append(plugin_dir)
+
+    # Missing requirements are resolved from the installed packages metadata and
+    # cached until the site-packages change, nothing is imported here
+    from .dependencies import missing_requirements
+    from .layer_io import cache_directory
+
+    missing = missing_requirements(os.path.join(plugin_dir, "requirements.txt"),
+                                   os.path.join(cache_directory(), "dependencies.json"))
+    if not missing:
+        return
+
     try:
         import pip
     except ImportError:
@@ -45,19 +57,12 @@ def install_dependencies():
             subprocess.check_call(
                 ["python3", "-m", "pip", "install", "--upgrade", "pip"]
             )
-    sys.path.append(plugin_dir)
 
-    with open(os.path.join(plugin_dir, "requirements.txt"), "r") as requirements:
-        for dep in requirements.readlines():
-            dep = dep.replace("\n", "")
-            dep_noversion = dep.strip().split("==")[0]
-            try:
-                __import__(dep_noversion)
-            except ImportError:
-                print("{} not available, installing".format(dep))
-                if operating_system == "Darwin":
-                    pip.main(["install", dep])
-                elif operating_system == "Linux":
-                    subprocess.check_call([sys.executable, "-m", "pip", "install", dep])
-                elif operating_system == "Windows":
-                    subprocess.check_call(["python3", "-m", "pip", "install", dep])
\ No newline at end of file
+    for dep in missing:
+        print("{} not available, installing".format(dep))
+        if operating_system == "Darwin":
+            pip.main(["install", dep])
+        elif operating_system == "Linux":
+            subprocess.check_call([sys.executable, "-m", "pip", "install", dep])
+        elif operating_system == "Windows":
+            subprocess.check_call(["python3", "-m", "pip", "install", dep])
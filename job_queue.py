@@ -0,0 +1,93 @@
+"""
+/***************************************************************************
+ Persistent job queue of the IDP Sites Mapping batch runner.
+
+ Jobs live in a SQLite database inside the output folder so that a batch
+ interrupted by a crash resumes where it stopped: finished jobs are kept,
+ jobs left running or failed are queued again. No qgis imports.
+ ***************************************************************************/
+"""
+
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    parameters TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    started REAL,
+    finished REAL
+)
+"""
+
+
+class JobQueue(object):
+    """Jobs keyed by a unique name, with their parameters stored as JSON.
+
+    Every call opens its own connection, so the queue can be shared by the
+    threads of a pool.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as connection:
+            connection.execute(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def add(self, name, parameters):
+        """Queue a job, returns True when it was added or its parameters updated.
+
+        A job of that name which is still pending takes the new parameters,
+        running and finished jobs are left untouched.
+        """
+        with self._connect() as connection:
+            cursor = connection.execute('INSERT INTO jobs (name, parameters, status) VALUES (?, ?, ?) '
+                                        'ON CONFLICT (name) DO UPDATE SET parameters = excluded.parameters WHERE status = ?',
+                                        (name, json.dumps(parameters), PENDING, PENDING))
+            return cursor.rowcount == 1
+
+    def resume(self):
+        """Queue again the jobs a previous run left running or failed."""
+        with self._connect() as connection:
+            connection.execute('UPDATE jobs SET status = ?, error = NULL WHERE status IN (?, ?)', (PENDING, RUNNING, FAILED))
+
+    def claim(self):
+        """Mark the next pending job as running and return (id, name, parameters), None when empty."""
+        with self._connect() as connection:
+            # An immediate transaction keeps two threads from claiming the same job
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute('SELECT id, name, parameters FROM jobs WHERE status = ? ORDER BY id LIMIT 1', (PENDING,)).fetchone()
+            if row is not None:
+                connection.execute('UPDATE jobs SET status = ?, started = ? WHERE id = ?', (RUNNING, time.time(), row[0]))
+            connection.execute('COMMIT')
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def finish(self, job_id, error=None):
+        """Record the outcome of a claimed job."""
+        with self._connect() as connection:
+            connection.execute('UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ?',
+                               (FAILED if error else DONE, error, time.time(), job_id))
+
+    def counts(self):
+        """Number of jobs per status."""
+        with self._connect() as connection:
+            return dict(connection.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
@@ -0,0 +1,124 @@
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+from qgis.core import (QgsProcessing,
+                       QgsField,
+                       QgsFields,
+                       QgsWkbTypes,
+                       QgsProcessingException,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterDefinition,
+                       QgsProcessingParameterVectorLayer,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterExtent,
+                       QgsProcessingParameterCrs,
+                       QgsProcessingParameterFeatureSink)
+
+
+class BufferKnownSites(QgsProcessingAlgorithm):
+    """
+    This script buffers, dissolves and explodes the Known IDP Sites, reusing the result
+    cached for the same version of the site registry across scenes.
+    """
+
+    INPUT = 'INPUT'
+    DISTANCE = 'DISTANCE'
+    EXTENT = 'EXTENT'
+    TARGET_CRS = 'TARGET_CRS'
+    OUTPUT = 'OUTPUT'
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return BufferKnownSites()
+
+    def name(self):
+        return 'bufferknownsites'
+
+    def displayName(self):
+        return self.tr('Buffer Known IDP Sites')
+
+    def group(self):
+        return self.tr('Processing Tools')
+
+    def groupId(self):
+        return 'processing'
+
+    def shortHelpString(self):
+        return self.tr('''Buffers the Known IDP Sites by Buffer Distance, dissolves the buffers and splits them into single parts, like Buffer with Dissolve followed by Multipart to Singleparts. \n
+        The dissolved parts are cached in memory and in the QGIS profile folder, keyed on the layer source, feature count, last modification time, CRS and distance, so further scenes mapped against the same site registry only look up the parts intersecting the Extent. Layers with unsaved edits and memory layers are not cached. \n
+        The output holds a site_id field identifying the buffered site part.''')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterVectorLayer(
+                self.INPUT,
+                self.tr('Known IDP Sites'),
+                [QgsProcessing.TypeVectorPolygon]
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.DISTANCE,
+                self.tr('Buffer Distance'),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=5,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterExtent(
+                self.EXTENT,
+                self.tr('Extent'),
+                optional=True
+            )
+        )
+
+        param = QgsProcessingParameterCrs(self.TARGET_CRS, self.tr('Target CRS'), optional=True)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT,
+                self.tr('Buffered Known IDP Sites'),
+                QgsProcessing.TypeVectorPolygon
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+
+        try:
+            from .layer_io import site_buffers, write_features
+
+        except Exception as e:
+            feedback.reportError(QCoreApplication.translate('Error','%s'%(e)))
+            feedback.reportError(QCoreApplication.translate('Error',' '))
+            feedback.reportError(QCoreApplication.translate('Error','Error loading modules - please install the shapely python module'))
+            return {}
+
+        layer = self.parameterAsVectorLayer(parameters, self.INPUT, context)
+        if layer is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.INPUT))
+        distance = self.parameterAsDouble(parameters, self.DISTANCE, context)
+        crs = self.parameterAsCrs(parameters, self.TARGET_CRS, context)
+        if not crs.isValid():
+            crs = layer.crs()
+
+        bounds = None
+        if parameters.get(self.EXTENT):
+            extent = self.parameterAsExtent(parameters, self.EXTENT, context, crs)
+            bounds = (extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum())
+
+        fields = QgsFields()
+        fields.append(QgsField('site_id', QVariant.Int))
+
+        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context, fields, QgsWkbTypes.Polygon, crs)
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+
+        site_ids, sites = site_buffers(layer, distance, crs, context, feedback).query(bounds)
+        feedback.pushInfo('{} buffered site parts'.format(len(sites)))
+
+        write_features(sink, fields, [[int(site_id)] for site_id in site_ids], sites, feedback)
+
+        return {self.OUTPUT: dest_id}
@@ -0,0 +1,161 @@
+"""
+/***************************************************************************
+ Helpers moving features between QGIS layers and shapely geometry arrays,
+ used by the vectorized tools of the IDP Sites Mapping toolbox.
+ ***************************************************************************/
+"""
+
+import os
+import time
+
+from qgis.core import (QgsApplication, QgsFeature, QgsFeatureSink, QgsFeatureRequest, QgsField, QgsGeometry,
+                       QgsProcessingException)
+
+# Features handed to the sink per addFeatures call
+WRITE_BATCH = 10000
+# Seconds between two progress updates
+PROGRESS_INTERVAL = 0.2
+
+
+def read_geometries(source, request=None, feedback=None):
+    """Read a feature source into a list of attribute rows and a shapely array.
+
+    Features without geometry are kept as None entries so that the row index
+    matches between the attributes and the geometries.
+    """
+    import shapely
+
+    attributes = []
+    wkbs = []
+    for feature in source.getFeatures(request or QgsFeatureRequest()):
+        if feedback is not None and feedback.isCanceled():
+            break
+        attributes.append(feature.attributes())
+        wkbs.append(bytes(feature.geometry().asWkb()) if feature.hasGeometry() else None)
+
+    return attributes, shapely.from_wkb(wkbs)
+
+
+def to_qgs_geometries(geoms, multi=False):
+    """Convert a shapely array into a list of QgsGeometry."""
+    import shapely
+
+    geometries = []
+    for wkb in shapely.to_wkb(geoms):
+        geometry = QgsGeometry()
+        if wkb is not None:
+            geometry.fromWkb(wkb)
+            if multi:
+                geometry.convertToMultiType()
+        geometries.append(geometry)
+    return geometries
+
+
+class ThrottledProgress(object):
+    """Reports progress over total steps at most once per PROGRESS_INTERVAL."""
+
+    def __init__(self, feedback, total, interval=PROGRESS_INTERVAL):
+        self.feedback = feedback
+        self.scale = 100.0 / total if total else 0
+        self.interval = interval
+        self.last = 0
+
+    def update(self, current):
+        now = time.monotonic()
+        if self.feedback is not None and now - self.last >= self.interval:
+            self.feedback.setProgress(int(current * self.scale))
+            self.last = now
+
+
+class BatchWriter(object):
+    """Buffers features and hands them to a sink with one addFeatures call per batch.
+
+    File outputs go through QgsVectorFileWriter, which already wraps the
+    writes in a transaction for the drivers supporting it (GeoPackage,
+    SpatiaLite), so batching removes the remaining per call overhead.
+    """
+
+    def __init__(self, sink, batch_size=WRITE_BATCH):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.buffer = []
+        self.written = 0
+
+    def add(self, feature):
+        self.buffer.append(feature)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        if not self.sink.addFeatures(self.buffer, QgsFeatureSink.FastInsert):
+            raise QgsProcessingException('Could not write features to the output')
+        self.written += len(self.buffer)
+        self.buffer = []
+
+
+def append_field(fields, field):
+    """Append field to fields, renamed with a _2, _3... suffix when the name is taken.
+
+    Output fields are added after the fields of an input layer, which may
+    already hold a field of the same name. Returns the name used.
+    """
+    name = field.name()
+    suffix = 2
+    # lookupField ignores case, like most file formats do
+    while fields.lookupField(name) >= 0:
+        name = '{}_{}'.format(field.name(), suffix)
+        suffix += 1
+    field = QgsField(field)
+    field.setName(name)
+    fields.append(field)
+    return name
+
+
+def write_features(sink, fields, rows, geoms, feedback=None, multi=False, batch_size=WRITE_BATCH):
+    """Write attribute rows and shapely geometries to a feature sink in batches."""
+    writer = BatchWriter(sink, batch_size)
+    progress = ThrottledProgress(feedback, len(rows))
+    for current, (row, geometry) in enumerate(zip(rows, to_qgs_geometries(geoms, multi))):
+        if feedback is not None and feedback.isCanceled():
+            break
+        feature = QgsFeature(fields)
+        feature.setAttributes(row)
+        feature.setGeometry(geometry)
+        writer.add(feature)
+        progress.update(current)
+    writer.flush()
+
+
+def cache_directory():
+    """Folder of the on-disk caches, inside the active QGIS profile."""
+    return os.path.join(QgsApplication.qgisSettingsDirPath(), 'cache', 'idp_sites_mapping')
+
+
+def site_buffers(layer, distance, crs, context, feedback=None):
+    """Return the cached dissolved buffers of a Known IDP Sites layer in crs.
+
+    The cache is keyed on the layer source, feature count, provider data
+    timestamp, subset, CRS and distance. Layers with unsaved edits and memory
+    layers are buffered without caching.
+    """
+    from .site_cache import cache_key, load_or_build
+    from .vector_ops import buffer_sites
+
+    def build():
+        request = QgsFeatureRequest().setNoAttributes()
+        request.setDestinationCrs(crs, context.transformContext())
+        geoms = read_geometries(layer, request, feedback)[1]
+        # A canceled read is partial, it must never be cached under the registry key
+        if feedback is not None and feedback.isCanceled():
+            raise QgsProcessingException('Canceled while reading the Known IDP Sites')
+        return buffer_sites(geoms, distance)
+
+    provider = layer.dataProvider()
+    if layer.isModified() or provider.name() == 'memory':
+        return load_or_build(None, None, build)
+
+    key = cache_key(layer.source(), layer.subsetString(), layer.featureCount(),
+                    provider.dataTimestamp().toMSecsSinceEpoch(), crs.toWkt(), float(distance))
+    return load_or_build(key, cache_directory(), build)
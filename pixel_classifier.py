@@ -0,0 +1,273 @@
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessing,
+                       QgsFeatureRequest,
+                       QgsProcessingException,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterDefinition,
+                       QgsProcessingParameterRasterLayer,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterField,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterFile,
+                       QgsProcessingParameterFileDestination,
+                       QgsProcessingParameterRasterDestination)
+
+
+class TrainPixelClassifier(QgsProcessingAlgorithm):
+    """
+    This script trains a scikit-learn pixel classifier on the F1, F3 and Soil Brightness
+    features of labelled points and saves it so it can be applied to many scenes.
+    """
+
+    INPUT = 'INPUT'
+    TRAINING_POINTS = 'TRAINING_POINTS'
+    CLASS_FIELD = 'CLASS_FIELD'
+    CLASSIFIER = 'CLASSIFIER'
+    N_ESTIMATORS = 'N_ESTIMATORS'
+    OUTPUT_MODEL = 'OUTPUT_MODEL'
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return TrainPixelClassifier()
+
+    def name(self):
+        return 'trainpixelclassifier'
+
+    def displayName(self):
+        return self.tr('Train Pixel Classifier')
+
+    def group(self):
+        return self.tr('Processing Tools')
+
+    def groupId(self):
+        return 'processing'
+
+    def shortHelpString(self):
+        return self.tr('''Trains a pixel classifier from labelled points on an RGB Satellite Image. The F1, F3 and Soil Brightness features used by the Tent Extraction model are computed for every point and a Random Forest or Gradient Boosting classifier is fitted. \n
+        The Class Field must hold 1 for structure pixels and 0 for any other cover. The trained model is saved to a .joblib file and can be applied to other scenes with the Pixel Classification tool without retraining.''')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUT,
+                self.tr('Satellite Image')
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.TRAINING_POINTS,
+                self.tr('Labelled Points'),
+                [QgsProcessing.TypeVectorPoint]
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.CLASS_FIELD,
+                self.tr('Class Field'),
+                parentLayerParameterName=self.TRAINING_POINTS,
+                type=QgsProcessingParameterField.Numeric
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.CLASSIFIER,
+                self.tr('Classifier'),
+                options=[self.tr('Random Forest'), self.tr('Gradient Boosting')],
+                defaultValue=0
+            )
+        )
+
+        param = QgsProcessingParameterNumber(self.N_ESTIMATORS,
+                                self.tr('Number of Trees / Boosting Iterations'), QgsProcessingParameterNumber.Integer, 200, minValue=10)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                self.OUTPUT_MODEL,
+                self.tr('Classifier Model'),
+                fileFilter='Model files (*.joblib)'
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+
+        try:
+            import numpy as np
+            import joblib
+            import rasterio
+            from sklearn.ensemble import RandomForestClassifier, HistGradientBoostingClassifier
+            from .classifier_utils import FEATURES, feature_stack, valid_rows
+
+        except Exception as e:
+            feedback.reportError(QCoreApplication.translate('Error','%s'%(e)))
+            feedback.reportError(QCoreApplication.translate('Error',' '))
+            feedback.reportError(QCoreApplication.translate('Error','Error loading modules - please install the rasterio and scikit-learn python modules'))
+            return {}
+
+        image = self.parameterAsRasterLayer(parameters, self.INPUT, context)
+        source = self.parameterAsSource(parameters, self.TRAINING_POINTS, context)
+        if source is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.TRAINING_POINTS))
+        class_field = self.parameterAsString(parameters, self.CLASS_FIELD, context)
+        classifier = self.parameterAsEnum(parameters, self.CLASSIFIER, context)
+        n_estimators = self.parameterAsInt(parameters, self.N_ESTIMATORS, context)
+        output_model = self.parameterAsFileOutput(parameters, self.OUTPUT_MODEL, context)
+
+        # Fetch the labelled points in the image CRS
+        request = QgsFeatureRequest().setSubsetOfAttributes([class_field], source.fields())
+        request.setDestinationCrs(image.crs(), context.transformContext())
+
+        coords = []
+        labels = []
+        for feature in source.getFeatures(request):
+            if not feature.hasGeometry() or feature[class_field] is None:
+                continue
+            point = feature.geometry().centroid().asPoint()
+            coords.append((point.x(), point.y()))
+            labels.append(int(feature[class_field]))
+
+        if not coords:
+            raise QgsProcessingException(self.tr('The Labelled Points layer has no usable points'))
+
+        with rasterio.open(image.source()) as src:
+            values = np.array(list(src.sample(coords, indexes=[1, 2, 3])), dtype='float32')
+
+        features = feature_stack(values[:, 0], values[:, 1], values[:, 2])
+        labels = np.array(labels)
+        valid = valid_rows(features) & (values.sum(axis=1) > 0)
+        features, labels = features[valid], labels[valid]
+
+        classes, counts = np.unique(labels, return_counts=True)
+        feedback.pushInfo('Training on {} pixels: {}'.format(labels.size, ', '.join('class {} = {}'.format(c, n) for c, n in zip(classes, counts))))
+        if classes.size < 2:
+            raise QgsProcessingException(self.tr('The Labelled Points must contain structure (1) and background (0) samples'))
+
+        if classifier == 0:
+            model = RandomForestClassifier(n_estimators=n_estimators, oob_score=True, n_jobs=-1, random_state=0)
+        else:
+            model = HistGradientBoostingClassifier(max_iter=n_estimators, random_state=0)
+        model.fit(features, labels)
+
+        if classifier == 0:
+            feedback.pushInfo('Out of bag accuracy: {:.3f}'.format(model.oob_score_))
+
+        joblib.dump({'model': model, 'features': FEATURES}, output_model)
+
+        return {self.OUTPUT_MODEL: output_model}
+
+
+class PixelClassification(QgsProcessingAlgorithm):
+    """
+    This script applies a trained pixel classifier to a satellite image tile by tile in a
+    process pool and writes the structure mask.
+    """
+
+    INPUT = 'INPUT'
+    MODEL = 'MODEL'
+    TILE_SIZE = 'TILE_SIZE'
+    WORKERS = 'WORKERS'
+    OUTPUT = 'OUTPUT'
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return PixelClassification()
+
+    def name(self):
+        return 'pixelclassification'
+
+    def displayName(self):
+        return self.tr('Pixel Classification')
+
+    def group(self):
+        return self.tr('Processing Tools')
+
+    def groupId(self):
+        return 'processing'
+
+    def shortHelpString(self):
+        return self.tr('''Applies a model created with the Train Pixel Classifier tool to an RGB Satellite Image and writes a binary structure mask (1 = structure). \n
+        The image is processed in tiles of Tile Size pixels on Workers processes (0 uses one per spare CPU), so memory use is bounded by the tile size whatever the scene size.''')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUT,
+                self.tr('Satellite Image')
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.MODEL,
+                self.tr('Classifier Model'),
+                extension='joblib'
+            )
+        )
+
+        param1 = QgsProcessingParameterNumber(self.TILE_SIZE,
+                                self.tr('Tile Size (pixels)'), QgsProcessingParameterNumber.Integer, 1024, minValue=64)
+        param2 = QgsProcessingParameterNumber(self.WORKERS,
+                                self.tr('Worker Processes'), QgsProcessingParameterNumber.Integer, 0, minValue=0)
+
+        param1.setFlags(param1.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        param2.setFlags(param2.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        self.addParameter(param1)
+        self.addParameter(param2)
+
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                self.OUTPUT, self.tr("Structure Mask"), None, False)
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+
+        try:
+            import rasterio
+            from rasterio.windows import Window
+            from .tiling import iter_windows, map_tiles, worker_count
+            from .classifier_utils import init_predict_worker, close_predict_worker, predict_window
+
+        except Exception as e:
+            feedback.reportError(QCoreApplication.translate('Error','%s'%(e)))
+            feedback.reportError(QCoreApplication.translate('Error',' '))
+            feedback.reportError(QCoreApplication.translate('Error','Error loading modules - please install the rasterio and scikit-learn python modules'))
+            return {}
+
+        image = self.parameterAsRasterLayer(parameters, self.INPUT, context)
+        model_path = self.parameterAsFile(parameters, self.MODEL, context)
+        tile_size = self.parameterAsInt(parameters, self.TILE_SIZE, context)
+        workers = worker_count(self.parameterAsInt(parameters, self.WORKERS, context))
+        output_path = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
+
+        image_path = image.source()
+        with rasterio.open(image_path) as src:
+            if src.count < 3:
+                raise QgsProcessingException(self.tr('The Satellite Image must have red, green and blue bands'))
+            profile = src.profile.copy()
+            windows = list(iter_windows(src.width, src.height, tile_size))
+
+        profile.update(driver='GTiff', count=1, dtype='uint8', nodata=None,
+                       compress='deflate', tiled=True, blockxsize=256, blockysize=256)
+
+        feedback.pushInfo('Classifying {} tiles on {} worker(s)'.format(len(windows), workers))
+        total = 100.0 / len(windows)
+
+        with rasterio.open(output_path, 'w', **profile) as dst:
+            results = map_tiles(predict_window, windows, workers, init_predict_worker, (image_path, model_path),
+                                close_predict_worker)
+            try:
+                for current, (window, mask) in enumerate(results):
+                    if feedback.isCanceled():
+                        break
+                    dst.write(mask, 1, window=Window(*window))
+                    feedback.setProgress(int((current + 1) * total))
+            finally:
+                results.close()
+
+        return {self.OUTPUT: output_path}
@@ -0,0 +1,147 @@
+"""
+/***************************************************************************
+ Population estimation helpers of the IDP Sites Mapping toolbox.
+
+ Structure areas, occupancy and the per site totals are computed on whole
+ arrays; sites are joined through an STRtree. No qgis imports.
+ ***************************************************************************/
+"""
+
+import numpy as np
+import shapely
+
+# Occupancy models of PopulationEstimation
+PER_STRUCTURE = 0
+PER_SQUARE_METRE = 1
+
+
+def utm_epsg(lon, lat):
+    """EPSG code of the WGS 84 UTM zone containing a longitude/latitude."""
+    zone = min(int((lon + 180) // 6) + 1, 60)
+    return (32600 if lat >= 0 else 32700) + zone
+
+
+def structure_population(area, model, rate):
+    """Persons per structure for a rate in persons per structure or per square metre."""
+    if model == PER_SQUARE_METRE:
+        return np.nan_to_num(area) * rate
+    return np.full(len(area), float(rate))
+
+
+def join_sites(structures, sites):
+    """Index of the site containing every structure, -1 outside all sites.
+
+    Structures are located by a point on their surface, so a structure
+    straddling two sites is counted once.
+    """
+    site_index = np.full(len(structures), -1)
+    if sites is None or not len(sites) or not len(structures):
+        return site_index
+
+    present = np.flatnonzero(~shapely.is_missing(structures) & ~shapely.is_empty(structures))
+    points = shapely.point_on_surface(structures[present])
+    point_idx, site_idx = shapely.STRtree(sites).query(points, predicate='within')
+    # Keep the first site of points on shared borders
+    first = np.unique(point_idx, return_index=True)[1]
+    site_index[present[point_idx[first]]] = site_idx[first]
+    return site_index
+
+
+def site_totals(site_index, site_count, *values):
+    """Sum every values array per site, ignoring structures outside the sites."""
+    inside = site_index >= 0
+    return [np.bincount(site_index[inside], weights=np.asarray(value, dtype=float)[inside], minlength=site_count)
+            for value in values]
+
+
+def grid_shape(bounds, cell_size, margin=0):
+    """Origin (west, north) and (rows, columns) of a grid of cell_size covering bounds.
+
+    The grid is aligned on multiples of the cell size and grown by margin
+    cells on every side.
+    """
+    xmin, ymin, xmax, ymax = bounds
+    west = (np.floor(xmin / cell_size) - margin) * cell_size
+    north = (np.ceil(ymax / cell_size) + margin) * cell_size
+    columns = int(np.ceil((xmax - west) / cell_size)) + margin + 1
+    rows = int(np.ceil((north - ymin) / cell_size)) + margin + 1
+    return (west, north), (rows, columns)
+
+
+def density_grid(x, y, weights, origin, shape, cell_size):
+    """Sum weights on a north up grid with a single bincount over the cell indices."""
+    west, north = origin
+    rows, columns = shape
+    col = ((np.asarray(x) - west) // cell_size).astype('int64')
+    row = ((north - np.asarray(y)) // cell_size).astype('int64')
+    inside = (col >= 0) & (col < columns) & (row >= 0) & (row < rows)
+    cells = row[inside] * columns + col[inside]
+    return np.bincount(cells, weights=np.asarray(weights, dtype=float)[inside], minlength=rows * columns).reshape(rows, columns)
+
+
+def smooth_grid(grid, radius):
+    """Quartic kernel density smoothing of a grid by FFT convolution.
+
+    radius is the kernel radius in cells; the kernel sums to one so the grid
+    total is preserved apart from what spreads past the grid edges.
+    """
+    from scipy.signal import fftconvolve
+
+    size = int(np.ceil(radius))
+    offsets = np.arange(-size, size + 1)
+    distance = np.hypot(*np.meshgrid(offsets, offsets)) / radius
+    kernel = np.where(distance < 1, (1 - distance ** 2) ** 2, 0)
+    kernel /= kernel.sum()
+    # FFT round off leaves tiny negative values in empty cells
+    return np.maximum(fftconvolve(grid, kernel, mode='same'), 0)
+
+
+def bootstrap_factors(seed, replicates, occupancy_sd, detection_rate, detection_sd):
+    """Per replicate population multipliers for the occupancy and detection uncertainty.
+
+    Occupancy is a log-normal multiplier of mean 1 and relative standard
+    deviation occupancy_sd; the detection rate is normal, clipped to
+    [0.05, 1], and the population is divided by it to add missed structures.
+    """
+    rng = np.random.default_rng([seed, 0])
+    sigma = np.sqrt(np.log1p(occupancy_sd ** 2))
+    occupancy = rng.lognormal(-sigma ** 2 / 2, sigma, replicates)
+    detection = np.clip(rng.normal(detection_rate, detection_sd, replicates), 0.05, 1)
+    return occupancy / detection
+
+
+def bootstrap_tasks(site_index, persons, replicates, seed, max_cells=4000000):
+    """Split the structures inside sites into bootstrap_chunk tasks.
+
+    Structures are sorted by site and cut into chunks of at most max_cells
+    replicate × structure cells, so memory stays bounded whatever the layer
+    size. Every chunk gets its own random stream derived from seed.
+    """
+    inside = np.flatnonzero(site_index >= 0)
+    order = inside[np.argsort(site_index[inside], kind='stable')]
+    chunk_size = max(1, max_cells // replicates)
+    for chunk, start in enumerate(range(0, len(order), chunk_size)):
+        block = order[start:start + chunk_size]
+        yield (seed, chunk + 1, replicates, site_index[block], persons[block])
+
+
+def bootstrap_chunk(task):
+    """Poisson bootstrap of one chunk of site sorted structures.
+
+    task is (seed, chunk, replicates, sites, persons). Every replicate
+    reweights the structures with Poisson(1) counts, the (replicates ×
+    structures) matrix is then summed per site with reduceat. Returns (site
+    ids, replicates × sites totals).
+    """
+    seed, chunk, replicates, sites, persons = task
+    rng = np.random.default_rng([seed, chunk])
+    weighted = rng.poisson(1.0, (replicates, len(persons))) * persons
+    starts = np.flatnonzero(np.r_[True, sites[1:] != sites[:-1]])
+    return sites[starts], np.add.reduceat(weighted, starts, axis=1)
+
+
+def interval_summary(totals, confidence):
+    """Mean and central confidence interval bounds of replicate × site totals."""
+    tail = (100 - confidence) / 2
+    low, high = np.percentile(totals, [tail, 100 - tail], axis=0)
+    return totals.mean(axis=0), low, high
@@ -11,14 +11,23 @@
 ***************************************************************************
 """
 
-from qgis.PyQt.QtCore import QCoreApplication
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
 from qgis.core import (QgsProcessing,
-                       QgsFeatureSink,
+                       QgsField,
+                       QgsFields,
+                       QgsWkbTypes,
+                       QgsFeatureRequest,
+                       QgsCoordinateReferenceSystem,
+                       QgsCoordinateTransform,
                        QgsProcessingException,
                        QgsProcessingAlgorithm,
+                       QgsProcessingParameterDefinition,
                        QgsProcessingParameterFeatureSource,
-                       QgsProcessingParameterFeatureSink)
-from qgis import processing
+                       QgsProcessingParameterField,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterFeatureSink,
+                       QgsProcessingParameterRasterDestination)
 
 
 class PopulationEstimation(QgsProcessingAlgorithm):
@@ -31,7 +40,24 @@ class PopulationEstimation(QgsProcessingAlgorithm):
     # calling from the QGIS console.
 
     INPUT = 'INPUT'
+    SITES = 'SITES'
+    SITE_ID = 'SITE_ID'
+    MODEL = 'MODEL'
+    PERSONS_PER_STRUCTURE = 'PERSONS_PER_STRUCTURE'
+    PERSONS_PER_M2 = 'PERSONS_PER_M2'
+    CELL_SIZE = 'CELL_SIZE'
+    KERNEL_RADIUS = 'KERNEL_RADIUS'
+    REPLICATES = 'REPLICATES'
+    CONFIDENCE = 'CONFIDENCE'
+    OCCUPANCY_SD = 'OCCUPANCY_SD'
+    DETECTION_RATE = 'DETECTION_RATE'
+    DETECTION_SD = 'DETECTION_SD'
+    SEED = 'SEED'
+    WORKERS = 'WORKERS'
+    BATCH_SIZE = 'BATCH_SIZE'
     OUTPUT = 'OUTPUT'
+    SITE_SUMMARY = 'SITE_SUMMARY'
+    DENSITY = 'DENSITY'
 
     def tr(self, string):
         """
@@ -82,7 +108,11 @@ class PopulationEstimation(QgsProcessingAlgorithm):
         should provide a basic description about what the algorithm does and the
         parameters and outputs associated with it..
         """
-        return self.tr("This algorithm takes a vector polygon layer and creates a new field area_ha and area_km2 to store area of the features in hectares and Kilometres squared respectively.")
+        return self.tr("""Estimates the IDP population from the mapped structures. Every structure gets its footprint area in square metres (area_m2) and a number of persons (persons), either a fixed number of Persons per Structure or its area multiplied by Persons per Square Metre. \n
+        When the Known IDP Sites are given, every structure is assigned to the site containing it (site, the Site Identifier Field value or the site position) and the Site Summary output holds, for every site, the number of structures, their total area and the estimated population. Added fields whose name is already used by the input layer get a _2 suffix. \n
+        The optional Population Density output is a compressed GeoTIFF of the persons per cell on a grid of Cell Size metres, built with a single pass over the structures. With a Kernel Radius (metres) above 0 the grid is smoothed with a quartic kernel density by FFT convolution, keeping the total population. \n
+        With Bootstrap Replicates above 0 the Site Summary also holds the mean (pop_mean) and the Confidence Level bounds (pop_low, pop_high) of the site population. Every replicate resamples the structures with Poisson bootstrap weights, multiplies the occupancy by a log-normal factor of mean 1 and relative standard deviation Occupancy Uncertainty and divides by a Detection Rate drawn with Detection Rate Uncertainty to account for missed structures. The replicates are computed as matrices in chunks on Workers processes (0 uses one per spare CPU). \n
+        Areas are computed for the whole layer at once; layers in a geographic CRS are measured and written in the UTM zone of their centre.""")
 
     def initAlgorithm(self, config=None):
         """
@@ -90,23 +120,131 @@ class PopulationEstimation(QgsProcessingAlgorithm):
         with some other properties.
         """
 
-        # We add the input vector features source. It can have any kind of
-        # geometry.
         self.addParameter(
             QgsProcessingParameterFeatureSource(
                 self.INPUT,
-                self.tr('Input layer'),
-                [QgsProcessing.TypeVectorAnyGeometry]
+                self.tr('Structures'),
+                [QgsProcessing.TypeVectorPolygon]
             )
         )
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.SITES,
+                self.tr('Known IDP Sites'),
+                [QgsProcessing.TypeVectorPolygon],
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.SITE_ID,
+                self.tr('Site Identifier Field'),
+                parentLayerParameterName=self.SITES,
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.MODEL,
+                self.tr('Occupancy Model'),
+                options=[self.tr('Persons per Structure'), self.tr('Persons per Square Metre')],
+                defaultValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.PERSONS_PER_STRUCTURE,
+                self.tr('Persons per Structure'),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=5,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.PERSONS_PER_M2,
+                self.tr('Persons per Square Metre'),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=0.28,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.CELL_SIZE,
+                self.tr('Cell Size'),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=100,
+                minValue=1
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.KERNEL_RADIUS,
+                self.tr('Kernel Radius'),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=0,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.REPLICATES,
+                self.tr('Bootstrap Replicates'),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=0,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.CONFIDENCE,
+                self.tr('Confidence Level (%)'),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=90,
+                minValue=1,
+                maxValue=99.9
+            )
+        )
+
+        param1 = QgsProcessingParameterNumber(self.OCCUPANCY_SD,
+                                self.tr('Occupancy Uncertainty (relative standard deviation)'), QgsProcessingParameterNumber.Double, 0.2, minValue=0)
+        param2 = QgsProcessingParameterNumber(self.DETECTION_RATE,
+                                self.tr('Detection Rate'), QgsProcessingParameterNumber.Double, 0.9, minValue=0.05, maxValue=1)
+        param3 = QgsProcessingParameterNumber(self.DETECTION_SD,
+                                self.tr('Detection Rate Uncertainty (standard deviation)'), QgsProcessingParameterNumber.Double, 0.05, minValue=0)
+        param4 = QgsProcessingParameterNumber(self.SEED,
+                                self.tr('Random Seed'), QgsProcessingParameterNumber.Integer, 0, minValue=0)
+        param5 = QgsProcessingParameterNumber(self.WORKERS,
+                                self.tr('Worker Processes'), QgsProcessingParameterNumber.Integer, 0, minValue=0)
+        param6 = QgsProcessingParameterNumber(self.BATCH_SIZE,
+                                self.tr('Features per Write'), QgsProcessingParameterNumber.Integer, 10000, minValue=1)
+
+        for param in (param1, param2, param3, param4, param5, param6):
+            param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+            self.addParameter(param)
 
-        # We add a feature sink in which to store our processed features (this
-        # usually takes the form of a newly created vector layer when the
-        # algorithm is run in QGIS).
         self.addParameter(
             QgsProcessingParameterFeatureSink(
                 self.OUTPUT,
-                self.tr('Output layer')
+                self.tr('Structures Population'),
+                QgsProcessing.TypeVectorPolygon
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.SITE_SUMMARY,
+                self.tr('Site Summary'),
+                QgsProcessing.TypeVectorPolygon,
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                self.DENSITY,
+                self.tr('Population Density'),
+                optional=True,
+                createByDefault=False
             )
         )
 
@@ -115,78 +253,183 @@ class PopulationEstimation(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
-        # Retrieve the feature source and sink. The 'dest_id' variable is used
-        # to uniquely identify the feature sink, and must be included in the
-        # dictionary returned by the processAlgorithm function.
-        source = self.parameterAsSource(
-            parameters,
-            self.INPUT,
-            context
-        )
+        try:
+            import numpy as np
+            import shapely
+            from .layer_io import append_field, read_geometries, write_features
+            from .population import utm_epsg, structure_population, join_sites, site_totals
+
+        except Exception as e:
+            feedback.reportError(QCoreApplication.translate('Error','%s'%(e)))
+            feedback.reportError(QCoreApplication.translate('Error',' '))
+            feedback.reportError(QCoreApplication.translate('Error','Error loading modules - please install the shapely python module'))
+            return {}
 
-        # If source was not found, throw an exception to indicate that the algorithm
-        # encountered a fatal error. The exception text can be any string, but in this
-        # case we use the pre-built invalidSourceError method to return a standard
-        # helper text for when a source cannot be evaluated
+        source = self.parameterAsSource(parameters, self.INPUT, context)
         if source is None:
             raise QgsProcessingException(self.invalidSourceError(parameters, self.INPUT))
+        sites_source = self.parameterAsSource(parameters, self.SITES, context)
+        site_field = self.parameterAsString(parameters, self.SITE_ID, context)
+        model = self.parameterAsEnum(parameters, self.MODEL, context)
+        rate = self.parameterAsDouble(parameters, [self.PERSONS_PER_STRUCTURE, self.PERSONS_PER_M2][model], context)
+        batch_size = self.parameterAsInt(parameters, self.BATCH_SIZE, context)
 
-        (sink, dest_id) = self.parameterAsSink(
-            parameters,
-            self.OUTPUT,
-            context,
-            source.fields(),
-            source.wkbType(),
-            source.sourceCrs()
-        )
+        # Areas need a projected CRS, geographic layers are measured in the UTM zone of their centre
+        crs = source.sourceCrs()
+        if crs.isGeographic():
+            wgs84 = QgsCoordinateReferenceSystem('EPSG:4326')
+            centre = QgsCoordinateTransform(crs, wgs84, context.transformContext()).transformBoundingBox(source.sourceExtent()).center()
+            crs = QgsCoordinateReferenceSystem('EPSG:{}'.format(utm_epsg(centre.x(), centre.y())))
+            feedback.pushInfo('Measuring areas in {}'.format(crs.authid()))
+
+        def request():
+            return QgsFeatureRequest().setDestinationCrs(crs, context.transformContext())
 
-        # Send some information to the user
-        feedback.pushInfo('CRS is {}'.format(source.sourceCrs().authid()))
+        feedback.pushInfo('Loading structures')
+        rows, structures = read_geometries(source, request(), feedback)
+        if feedback.isCanceled():
+            return {}
 
-        # If sink was not created, throw an exception to indicate that the algorithm
-        # encountered a fatal error. The exception text can be any string, but in this
-        # case we use the pre-built invalidSinkError method to return a standard
-        # helper text for when a sink cannot be evaluated
+        area = np.nan_to_num(shapely.area(structures))
+        persons = structure_population(area, model, rate)
+        persons[shapely.is_missing(structures)] = 0
+
+        sites = None
+        site_index = np.full(len(structures), -1)
+        if sites_source is not None:
+            feedback.pushInfo('Joining structures to the Known IDP Sites')
+            site_rows, sites = read_geometries(sites_source, request(), feedback)
+            site_index = join_sites(structures, sites)
+
+        if sites is not None and site_field:
+            site_attribute = sites_source.fields().lookupField(site_field)
+            site_key = QgsField(sites_source.fields().at(site_attribute))
+            site_key.setName('site')
+            site_values = [row[site_attribute] for row in site_rows]
+        else:
+            site_key = QgsField('site', QVariant.Int)
+            site_values = list(range(1, len(sites) + 1)) if sites is not None else []
+
+        fields = QgsFields(source.fields())
+        for field in (QgsField('area_m2', QVariant.Double), QgsField('persons', QVariant.Double), site_key):
+            append_field(fields, field)
+
+        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context, fields, QgsWkbTypes.multiType(source.wkbType()), crs)
         if sink is None:
             raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
 
-        # Compute the number of steps to display within the progress bar and
-        # get features from source
-        total = 100.0 / source.featureCount() if source.featureCount() else 0
-        features = source.getFeatures()
+        write_features(sink, fields,
+                       [row + [float(a), float(p), site_values[s] if s >= 0 else None]
+                        for row, a, p, s in zip(rows, area, persons, site_index)],
+                       structures, feedback, multi=True, batch_size=batch_size)
+        feedback.pushInfo('{} structures, {:.0f} persons estimated'.format(len(structures), persons.sum()))
+        results = {self.OUTPUT: dest_id}
 
-        for current, feature in enumerate(features):
-            # Stop the algorithm if cancel button has been clicked
+        if sites is not None:
+            counts, areas, totals = site_totals(site_index, len(sites), np.ones(len(structures)), area, persons)
+            feedback.pushInfo('{:.0f} persons estimated inside the Known IDP Sites'.format(totals.sum()))
+
+            summary_fields = QgsFields(sites_source.fields())
+            for field in (QgsField('structures', QVariant.Int), QgsField('area_m2', QVariant.Double), QgsField('persons', QVariant.Double)):
+                append_field(summary_fields, field)
+
+            summary_values = [[int(c), float(a), float(t)] for c, a, t in zip(counts, areas, totals)]
+            intervals = self.bootstrapIntervals(parameters, context, feedback, site_index, persons, len(sites))
+            # None also stands for a canceled bootstrap, which must not pass for a disabled one
             if feedback.isCanceled():
-                break
-
-            # Add a feature in the sink
-            sink.addFeature(feature, QgsFeatureSink.FastInsert)
-
-            # Update the progress bar
-            feedback.setProgress(int(current * total))
-
-        # To run another Processing algorithm as part of this algorithm, you can use
-        # processing.run(...). Make sure you pass the current context and feedback
-        # to processing.run to ensure that all temporary layer outputs are available
-        # to the executed algorithm, and that the executed algorithm can send feedback
-        # reports to the user (and correctly handle cancellation and progress reports!)
-        if False:
-            buffered_layer = processing.run("native:buffer", {
-                'INPUT': dest_id,
-                'DISTANCE': 1.5,
-                'SEGMENTS': 5,
-                'END_CAP_STYLE': 0,
-                'JOIN_STYLE': 0,
-                'MITER_LIMIT': 2,
-                'DISSOLVE': False,
-                'OUTPUT': 'memory:'
-            }, context=context, feedback=feedback)['OUTPUT']
-
-        # Return the results of the algorithm. In this case our only result is
-        # the feature sink which contains the processed features, but some
-        # algorithms may return multiple feature sinks, calculated numeric
-        # statistics, etc. These should all be included in the returned
-        # dictionary, with keys matching the feature corresponding parameter
-        # or output names.
-        return {self.OUTPUT: dest_id}
+                return {}
+            if intervals is not None:
+                for name in ('pop_mean', 'pop_low', 'pop_high'):
+                    append_field(summary_fields, QgsField(name, QVariant.Double))
+                for values, mean, low, high in zip(summary_values, *intervals):
+                    values.extend([float(mean), float(low), float(high)])
+
+            (summary_sink, summary_id) = self.parameterAsSink(parameters, self.SITE_SUMMARY, context, summary_fields, QgsWkbTypes.multiType(sites_source.wkbType()), crs)
+            if summary_sink is not None:
+                write_features(summary_sink, summary_fields,
+                               [row + values for row, values in zip(site_rows, summary_values)],
+                               sites, multi=True, batch_size=batch_size)
+                results[self.SITE_SUMMARY] = summary_id
+
+        density_path = self.parameterAsOutputLayer(parameters, self.DENSITY, context)
+        if density_path and len(structures):
+            density = self.writeDensity(parameters, context, feedback, density_path, crs, structures, persons)
+            if density:
+                results[self.DENSITY] = density
+
+        return results
+
+    def bootstrapIntervals(self, parameters, context, feedback, site_index, persons, site_count):
+        """
+        Returns the bootstrap mean and confidence bounds of the site populations, None when disabled
+        or canceled.
+        """
+        import numpy as np
+        from .population import bootstrap_factors, bootstrap_tasks, bootstrap_chunk, interval_summary
+        from .tiling import map_tiles, worker_count
+
+        replicates = self.parameterAsInt(parameters, self.REPLICATES, context)
+        if replicates <= 0:
+            return None
+        confidence = self.parameterAsDouble(parameters, self.CONFIDENCE, context)
+        seed = self.parameterAsInt(parameters, self.SEED, context)
+        workers = worker_count(self.parameterAsInt(parameters, self.WORKERS, context))
+        factors = bootstrap_factors(seed, replicates,
+                                    self.parameterAsDouble(parameters, self.OCCUPANCY_SD, context),
+                                    self.parameterAsDouble(parameters, self.DETECTION_RATE, context),
+                                    self.parameterAsDouble(parameters, self.DETECTION_SD, context))
+
+        feedback.pushInfo('Computing {} bootstrap replicates on {} worker(s)'.format(replicates, workers))
+        totals = np.zeros((replicates, site_count))
+        results = map_tiles(bootstrap_chunk, bootstrap_tasks(site_index, persons, replicates, seed), workers)
+        try:
+            for sites, sums in results:
+                if feedback.isCanceled():
+                    return None
+                totals[:, sites] += sums
+        finally:
+            results.close()
+
+        return interval_summary(totals * factors[:, None], confidence)
+
+    def writeDensity(self, parameters, context, feedback, path, crs, structures, persons):
+        """
+        Grids the structure population and writes it as a compressed GeoTIFF.
+        """
+        try:
+            import numpy as np
+            import rasterio
+            import shapely
+            from rasterio.crs import CRS
+            from rasterio.transform import from_origin
+            from .population import grid_shape, density_grid, smooth_grid
+
+        except Exception as e:
+            feedback.reportError(QCoreApplication.translate('Error','%s'%(e)))
+            feedback.reportError(QCoreApplication.translate('Error',' '))
+            feedback.reportError(QCoreApplication.translate('Error','Error loading modules - please install the rasterio and scipy python modules'))
+            return None
+
+        cell_size = self.parameterAsDouble(parameters, self.CELL_SIZE, context)
+        radius = self.parameterAsDouble(parameters, self.KERNEL_RADIUS, context) / cell_size
+
+        present = ~shapely.is_missing(structures)
+        points = shapely.point_on_surface(structures[present])
+        x, y = shapely.get_x(points), shapely.get_y(points)
+
+        # Room for the kernel around the structures
+        origin, shape = grid_shape(shapely.total_bounds(points), cell_size, int(np.ceil(radius)))
+        feedback.pushInfo('Gridding the population on {} x {} cells of {} m'.format(shape[1], shape[0], cell_size))
+        grid = density_grid(x, y, persons[present], origin, shape, cell_size)
+        if radius > 0:
+            grid = smooth_grid(grid, radius)
+
+        profile = {
+            'driver': 'GTiff', 'width': shape[1], 'height': shape[0], 'count': 1, 'dtype': 'float32',
+            'crs': CRS.from_wkt(crs.toWkt()), 'transform': from_origin(origin[0], origin[1], cell_size, cell_size),
+            'nodata': None, 'compress': 'deflate', 'predictor': 3, 'tiled': True, 'blockxsize': 256, 'blockysize': 256
+        }
+        with rasterio.open(path, 'w', **profile) as dst:
+            dst.write(grid.astype('float32'), 1)
+
+        return path
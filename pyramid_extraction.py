@@ -0,0 +1,317 @@
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+from qgis.core import (QgsProcessing,
+                       QgsField,
+                       QgsFields,
+                       QgsWkbTypes,
+                       QgsRectangle,
+                       QgsFeatureRequest,
+                       QgsProcessingUtils,
+                       QgsProcessingException,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterDefinition,
+                       QgsProcessingParameterRasterLayer,
+                       QgsProcessingParameterVectorLayer,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterFeatureSink,
+                       QgsProcessingOutputNumber)
+from qgis import processing
+
+# Overview levels built on images that have none
+OVERVIEW_FACTORS = [2, 4, 8, 16, 32]
+
+
+class PyramidTentExtraction(QgsProcessingAlgorithm):
+    """
+    This script finds candidate structure regions on a decimated overview of the image and runs
+    the full resolution Tent Extraction only inside the dilated candidate windows.
+    """
+
+    INPUT = 'INPUT'
+    SAMPLES = 'SAMPLES'
+    AUTO_BARE_AREAS = 'AUTO_BARE_AREAS'
+    DECIMATION = 'DECIMATION'
+    DILATION = 'DILATION'
+    GAP = 'GAP'
+    BUILD_OVERVIEWS = 'BUILD_OVERVIEWS'
+    REFERENCE = 'REFERENCE'
+    MIN_IOU = 'MIN_IOU'
+    OUTPUT = 'OUTPUT'
+    AREA_FRACTION = 'AREA_FRACTION'
+    COVERAGE = 'COVERAGE'
+    RECALL = 'RECALL'
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return PyramidTentExtraction()
+
+    def name(self):
+        return 'pyramidtentextraction'
+
+    def displayName(self):
+        return self.tr('Pyramid Tent Extraction')
+
+    def group(self):
+        return self.tr('Segmentation')
+
+    def groupId(self):
+        return 'segmentation'
+
+    def shortHelpString(self):
+        return self.tr('''Runs Tent Extraction only where structures are likely, which saves most of the processing time on scenes that are largely empty. \n
+        The image is read at 1/Decimation resolution from its overviews, which are built (as an external .ovr file) when the image has none and Build Missing Overviews is checked. F1 and F3 are computed on this coarse image as in Tent Extraction and thresholded with Otsu's method into a candidate mask, leaving out the bare areas step so that it errs on the side of recall. The candidates are dilated by Dilation coarse pixels, grouped into windows merged when closer than Window Gap full resolution pixels, and every window is processed at full resolution by Tent Extraction. \n
+        Small or faint structures may be missed by the coarse pass. To measure it, give the structures of a full Tent Extraction run of the same image as Reference Structures: Coverage is the share of them inside the processed windows and Recall the share matched by an output structure with at least Minimum IoU. Area Fraction is the share of the scene that was processed.''')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUT,
+                self.tr('Satellite Image')
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterVectorLayer(
+                self.SAMPLES,
+                self.tr('Sample Bare Areas'),
+                [QgsProcessing.TypeVectorPoint],
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.AUTO_BARE_AREAS,
+                self.tr('Derive Bare Areas Automatically'),
+                defaultValue=False
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.DECIMATION,
+                self.tr('Decimation'),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=8,
+                minValue=2
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.DILATION,
+                self.tr('Dilation (coarse pixels)'),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=4,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.REFERENCE,
+                self.tr('Reference Structures'),
+                [QgsProcessing.TypeVectorPolygon],
+                optional=True
+            )
+        )
+
+        param1 = QgsProcessingParameterNumber(self.GAP,
+                                self.tr('Window Gap (pixels)'), QgsProcessingParameterNumber.Integer, 64, minValue=0)
+        param2 = QgsProcessingParameterBoolean(self.BUILD_OVERVIEWS,
+                                self.tr('Build Missing Overviews'), defaultValue=True)
+        param3 = QgsProcessingParameterNumber(self.MIN_IOU,
+                                self.tr('Minimum IoU'), QgsProcessingParameterNumber.Double, 0.3, minValue=0, maxValue=1)
+
+        param1.setFlags(param1.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        param2.setFlags(param2.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        param3.setFlags(param3.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        self.addParameter(param1)
+        self.addParameter(param2)
+        self.addParameter(param3)
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT,
+                self.tr('Structures'),
+                QgsProcessing.TypeVectorPolygon
+            )
+        )
+        self.addOutput(QgsProcessingOutputNumber(self.AREA_FRACTION, self.tr('Area Fraction')))
+        self.addOutput(QgsProcessingOutputNumber(self.COVERAGE, self.tr('Coverage')))
+        self.addOutput(QgsProcessingOutputNumber(self.RECALL, self.tr('Recall')))
+
+    def processAlgorithm(self, parameters, context, feedback):
+
+        try:
+            import numpy as np
+            import rasterio
+            from rasterio.enums import Resampling
+            from scipy import ndimage
+            from osgeo import gdal
+            from .raster_ops import candidate_mask
+            from .tiling import merge_windows
+
+        except Exception as e:
+            feedback.reportError(QCoreApplication.translate('Error','%s'%(e)))
+            feedback.reportError(QCoreApplication.translate('Error',' '))
+            feedback.reportError(QCoreApplication.translate('Error','Error loading modules - please install the rasterio and scipy python modules'))
+            return {}
+
+        image = self.parameterAsRasterLayer(parameters, self.INPUT, context)
+        if image is None:
+            raise QgsProcessingException(self.invalidRasterError(parameters, self.INPUT))
+        if image.bandCount() < 3:
+            raise QgsProcessingException(self.tr('The Satellite Image needs red, green and blue bands'))
+        samples = self.parameterAsVectorLayer(parameters, self.SAMPLES, context)
+        auto_bare_areas = self.parameterAsBoolean(parameters, self.AUTO_BARE_AREAS, context) or samples is None
+        decimation = self.parameterAsInt(parameters, self.DECIMATION, context)
+        dilation = self.parameterAsInt(parameters, self.DILATION, context)
+        gap = self.parameterAsInt(parameters, self.GAP, context)
+        crs = image.crs()
+        path = image.source()
+
+        # Overviews make the coarse read cheap, GDAL writes them next to the image
+        dataset = gdal.Open(path)
+        if dataset is not None and dataset.GetRasterBand(1).GetOverviewCount() == 0:
+            if self.parameterAsBoolean(parameters, self.BUILD_OVERVIEWS, context):
+                feedback.pushInfo('Building overviews of {}'.format(path))
+                dataset.BuildOverviews('AVERAGE', OVERVIEW_FACTORS)
+            else:
+                feedback.pushInfo('The image has no overviews, the coarse pass reads it at full resolution')
+        dataset = None
+
+        # Coarse Candidate Mask
+        with rasterio.open(path) as src:
+            width, height = src.width, src.height
+            transform = src.transform
+            shape = (3, max(1, height // decimation), max(1, width // decimation))
+            coarse = src.read((1, 2, 3), out_shape=shape, resampling=Resampling.average)
+        scale_x, scale_y = width / shape[2], height / shape[1]
+
+        candidates = candidate_mask(coarse)
+        if dilation > 0:
+            candidates = ndimage.binary_dilation(candidates, iterations=dilation)
+        feedback.pushInfo('{:.1f}% of the coarse pixels are candidates'.format(100.0 * candidates.mean()))
+        feedback.setProgress(5)
+
+        labels = ndimage.label(candidates)[0]
+        boxes = [(int(box[1].start * scale_x), int(box[0].start * scale_y),
+                  min(width, int(np.ceil(box[1].stop * scale_x))), min(height, int(np.ceil(box[0].stop * scale_y))))
+                 for box in ndimage.find_objects(labels)]
+        pixel_windows = merge_windows(boxes, gap)
+
+        area_fraction = sum((xmax - xmin) * (ymax - ymin) for xmin, ymin, xmax, ymax in pixel_windows) / float(width * height)
+        feedback.pushInfo('Processing {} candidate windows covering {:.1f}% of the scene'.format(len(pixel_windows), 100.0 * area_fraction))
+
+        windows = []
+        for xmin, ymin, xmax, ymax in pixel_windows:
+            west, north = transform.c + xmin * transform.a, transform.f + ymin * transform.e
+            east, south = transform.c + xmax * transform.a, transform.f + ymax * transform.e
+            windows.append(QgsRectangle(west, south, east, north))
+
+        structureLayers = []
+        for current, window in enumerate(windows):
+            # Clip Satellite Image to the Candidate Window
+            alg_params = {
+                'INPUT': parameters[self.INPUT],
+                'PROJWIN': '{},{},{},{} [{}]'.format(window.xMinimum(), window.xMaximum(), window.yMinimum(), window.yMaximum(), crs.authid()),
+                'OVERCRS': False,
+                'NODATA': None,
+                'OPTIONS': '',
+                'DATA_TYPE': 0,  # Use Input Layer Data Type
+                'EXTRA': '',
+                'OUTPUT': QgsProcessingUtils.generateTempFilename('candidateWindow.tif')
+            }
+
+            feedback.pushInfo("Running algorithm: Clip Satellite Image to Candidate Window {}".format(current + 1))
+
+            clipped = processing.run('gdal:cliprasterbyextent', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+
+            if feedback.isCanceled():
+                return {}
+
+            # Windows without sampled bare areas derive them by clustering
+            window_samples = False
+            if not auto_bare_areas:
+                sample_request = QgsFeatureRequest().setNoAttributes().setLimit(1)
+                sample_request.setDestinationCrs(crs, context.transformContext())
+                sample_request.setFilterRect(window)
+                window_samples = any(True for _ in samples.getFeatures(sample_request))
+
+            alg_params = {
+                'satellite_image': clipped['OUTPUT'],
+                'sample_bare_areas': parameters[self.SAMPLES] if window_samples else None,
+                'auto_bare_areas': not window_samples,
+                'Structures': QgsProcessingUtils.generateTempFilename('candidateStructures.gpkg')
+            }
+
+            feedback.pushInfo("Running algorithm: Tent Extraction on Candidate Window {}".format(current + 1))
+
+            extracted = processing.run('IDP_Sites_Mapping:Tent Extraction', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+            # A canceled Tent Extraction returns no outputs
+            if feedback.isCanceled():
+                return {}
+            structureLayers.append(extracted['Structures'])
+
+            feedback.setProgress(5 + int(85.0 * (current + 1) / len(windows)))
+
+        if structureLayers:
+            # Merge Candidate Windows Structures
+            alg_params = {
+                'LAYERS': structureLayers,
+                'CRS': crs,
+                'OUTPUT': parameters[self.OUTPUT]
+            }
+
+            feedback.pushInfo("Running algorithm: Merge Candidate Windows Structures")
+
+            dest_id = processing.run('native:mergevectorlayers', alg_params, context=context, feedback=feedback, is_child_algorithm=True)['OUTPUT']
+        else:
+            fields = QgsFields()
+            fields.append(QgsField('DN', QVariant.Int))
+            (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context, fields, QgsWkbTypes.MultiPolygon, crs)
+            if sink is None:
+                raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+            sink = None
+
+        results = {self.OUTPUT: dest_id, self.AREA_FRACTION: area_fraction}
+
+        reference = self.parameterAsSource(parameters, self.REFERENCE, context)
+        if reference is not None:
+            results.update(self.recallReport(parameters, context, feedback, reference, dest_id, windows, crs))
+
+        return results
+
+    def recallReport(self, parameters, context, feedback, reference, dest_id, windows, crs):
+        """
+        Compares the structures with those of a full resolution run: the share of the reference
+        structures inside the candidate windows and the share matched by an output structure.
+        """
+        import numpy as np
+        import shapely
+        from .layer_io import read_geometries
+        from .vector_ops import match_structures
+
+        min_iou = self.parameterAsDouble(parameters, self.MIN_IOU, context)
+        request = QgsFeatureRequest().setNoAttributes().setDestinationCrs(crs, context.transformContext())
+        expected = read_geometries(reference, request, feedback)[1]
+        found = read_geometries(QgsProcessingUtils.mapLayerFromString(dest_id, context), request, feedback)[1]
+        if feedback.isCanceled():
+            return {}
+        if not len(expected):
+            feedback.pushInfo('The Reference Structures are empty, no recall computed')
+            return {}
+
+        coverage = 0.0
+        if windows:
+            boxes = shapely.box(*np.array([[w.xMinimum(), w.yMinimum(), w.xMaximum(), w.yMaximum()] for w in windows]).T)
+            inside = shapely.STRtree(boxes).query(shapely.point_on_surface(expected), predicate='within')[0]
+            coverage = len(np.unique(inside)) / float(len(expected))
+        # Without candidate windows nothing was extracted and nothing can be matched
+        recall = 0.0
+        if len(found):
+            recall = np.count_nonzero(match_structures(found, expected, min_iou)[0] >= 0) / float(len(expected))
+
+        feedback.pushInfo('{:.1f}% of the reference structures lie in the candidate windows, {:.1f}% were found again'.format(
+            100.0 * coverage, 100.0 * recall))
+        return {self.COVERAGE: coverage, self.RECALL: recall}
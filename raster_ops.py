@@ -0,0 +1,314 @@
+"""
+/***************************************************************************
+ Tiled connected component helpers of the IDP Sites Mapping toolbox.
+
+ Binary masks are labelled tile by tile with scipy.ndimage; components
+ crossing tile borders are joined with a union-find over the labels found
+ on either side of every border. No qgis imports, the window functions run
+ inside worker processes.
+ ***************************************************************************/
+"""
+
+import numpy as np
+
+from .scratch_store import open_array, window_view
+
+_worker = {}
+
+
+def structure(connectivity):
+    """scipy.ndimage structuring element for 4 or 8 connectivity."""
+    if connectivity == 8:
+        return np.ones((3, 3), dtype=bool)
+    return np.array([[0, 1, 0], [1, 1, 1], [0, 1, 0]], dtype=bool)
+
+
+class UnionFind(object):
+    """Disjoint sets over the integer labels 0..size-1."""
+
+    def __init__(self, size):
+        self.parent = np.arange(size)
+
+    def find(self, label):
+        parent = self.parent
+        while parent[label] != label:
+            # Path halving keeps the trees flat
+            parent[label] = parent[parent[label]]
+            label = parent[label]
+        return label
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+    def roots(self):
+        """Root of every label, as an array."""
+        parent = self.parent
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                return parent
+            parent = grand
+
+
+def border_pairs(before, after, connectivity):
+    """Unique (label, label) pairs of foreground pixels facing each other across a border.
+
+    before and after are the label lines on either side of the border; with
+    8 connectivity diagonal neighbours are paired as well.
+    """
+    shifts = [(before, after)]
+    if connectivity == 8:
+        shifts += [(before[:-1], after[1:]), (before[1:], after[:-1])]
+    pairs = [np.column_stack((a[(a > 0) & (b > 0)], b[(a > 0) & (b > 0)])) for a, b in shifts]
+    return np.unique(np.concatenate(pairs), axis=0)
+
+
+def init_mask_worker(mask_path, labels_spec=None):
+    """Process pool initializer, opens the mask once per worker.
+
+    With the scratch_store spec of a label array covering the mask,
+    label_window also stores its labels there for a second pass.
+    """
+    import rasterio
+
+    _worker['dataset'] = rasterio.open(mask_path)
+    if labels_spec is not None:
+        _worker['labels'] = open_array(labels_spec)
+
+
+def close_worker():
+    """Close the datasets and drop the arrays a worker initializer opened.
+
+    Pool processes release them on exit; a single worker runs in the calling
+    process, where an open label memmap would also keep its scratch file
+    from being deleted on Windows.
+    """
+    for value in _worker.values():
+        if hasattr(value, 'close'):
+            value.close()
+    _worker.clear()
+
+
+def read_mask(window):
+    """Read a (col_off, row_off, width, height) window of the mask as booleans, nodata off."""
+    from rasterio.windows import Window
+
+    band = _worker['dataset'].read(1, window=Window(*window), masked=True)
+    return band.filled(0) > 0
+
+
+def label_window(task):
+    """Label the components of one window, task is (tile, window, connectivity).
+
+    Returns (tile, count, sizes, edges) where sizes holds the pixel count of
+    labels 1..count and edges the top, bottom, left and right label lines.
+    """
+    from scipy import ndimage
+
+    tile, window, connectivity = task
+    labels, count = ndimage.label(read_mask(window), structure(connectivity))
+    if 'labels' in _worker:
+        window_view(_worker['labels'], window)[:] = labels
+    sizes = np.bincount(labels.ravel(), minlength=count + 1)[1:]
+    edges = (labels[0].copy(), labels[-1].copy(), labels[:, 0].copy(), labels[:, -1].copy())
+    return tile, count, sizes, edges
+
+
+def component_window(task):
+    """Label one window like label_window and add the region moments of every label.
+
+    task is (tile, window, connectivity). Returns (tile, count, sizes, edges,
+    stats) where stats is a (count, 9) array of the column, row, column²,
+    row² and column×row sums of the pixel centres followed by the bounding
+    box (first column, first row, last column, last row), in raster pixels.
+    """
+    from scipy import ndimage
+
+    tile, window, connectivity = task
+    col_off, row_off, width, height = window
+    labels, count = ndimage.label(read_mask(window), structure(connectivity))
+    flat = labels.ravel()
+    sizes = np.bincount(flat, minlength=count + 1)[1:]
+    edges = (labels[0].copy(), labels[-1].copy(), labels[:, 0].copy(), labels[:, -1].copy())
+
+    rows, cols = np.indices(labels.shape, dtype='float64')
+    cols = cols.ravel() + col_off + 0.5
+    rows = rows.ravel() + row_off + 0.5
+    stats = np.empty((count, 9))
+    for i, weights in enumerate((cols, rows, cols * cols, rows * rows, cols * rows)):
+        stats[:, i] = np.bincount(flat, weights=weights, minlength=count + 1)[1:]
+    for i, box in enumerate(ndimage.find_objects(labels)):
+        stats[i, 5:] = (box[1].start + col_off, box[0].start + row_off,
+                        box[1].stop - 1 + col_off, box[0].stop - 1 + row_off)
+    return tile, count, sizes, edges, stats
+
+
+def component_properties(roots, root_sizes, stats):
+    """Merge the component_window moments of the labels sharing a component root.
+
+    stats holds one component_window row per global label, row 0 standing
+    for the background. Returns (pixels, centroids, boxes, orientation) per
+    component, in raster pixel coordinates; orientation is the major axis
+    angle in degrees counterclockwise from the rows, as seen on a north up
+    image.
+    """
+    components = np.flatnonzero(roots == np.arange(len(roots)))[1:]
+    index = np.searchsorted(components, roots[1:])
+    pixels = root_sizes[components]
+    sums = np.column_stack([np.bincount(index, weights=stats[1:, i], minlength=len(components))
+                            for i in range(5)]) / pixels[:, None]
+
+    centroids = sums[:, :2]
+    mu20 = sums[:, 2] - centroids[:, 0] ** 2
+    mu02 = sums[:, 3] - centroids[:, 1] ** 2
+    mu11 = sums[:, 4] - centroids[:, 0] * centroids[:, 1]
+    # Rows point down, so the angle is mirrored to read counterclockwise on the map
+    orientation = -np.degrees(0.5 * np.arctan2(2 * mu11, mu20 - mu02))
+
+    boxes = np.empty((len(components), 4))
+    boxes[:, :2] = np.inf
+    boxes[:, 2:] = -np.inf
+    np.minimum.at(boxes[:, :2], index, stats[1:, 5:7])
+    np.maximum.at(boxes[:, 2:], index, stats[1:, 7:9])
+
+    return pixels, centroids, boxes, orientation
+
+
+def sieve_window(task):
+    """Keep the components of one window whose label is set in keep.
+
+    task is (window, keep) with keep indexed by the local labels that
+    label_window stored in the scratch label array, so the mask is neither
+    read nor labelled again. Returns the window and a uint8 mask.
+    """
+    window, keep = task
+    return window, keep[window_view(_worker['labels'], window)].astype('uint8')
+
+
+def component_roots(counts, sizes, edges, grid, connectivity):
+    """Join the per tile labels into global components.
+
+    counts, sizes and edges are the label_window results indexed by tile,
+    grid is (tile rows, tile columns) of the row major tile layout. Returns
+    (offsets, roots, root_sizes): global label = local label + offsets[tile],
+    roots maps global labels to their component and root_sizes holds the
+    pixel count of every component root.
+    """
+    rows, cols = grid
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    union = UnionFind(int(np.sum(counts)) + 1)
+
+    def global_labels(tile, line):
+        return np.where(line > 0, line + offsets[tile], 0)
+
+    # Full width rows and full height columns on either side of the tile borders
+    for row in range(rows - 1):
+        before = np.concatenate([global_labels(row * cols + col, edges[row * cols + col][1]) for col in range(cols)])
+        after = np.concatenate([global_labels((row + 1) * cols + col, edges[(row + 1) * cols + col][0]) for col in range(cols)])
+        for a, b in border_pairs(before, after, connectivity):
+            union.union(a, b)
+    for col in range(cols - 1):
+        before = np.concatenate([global_labels(row * cols + col, edges[row * cols + col][3]) for row in range(rows)])
+        after = np.concatenate([global_labels(row * cols + col + 1, edges[row * cols + col + 1][2]) for row in range(rows)])
+        for a, b in border_pairs(before, after, connectivity):
+            union.union(a, b)
+
+    roots = union.roots()
+    all_sizes = np.concatenate([[0]] + [np.asarray(s) for s in sizes])
+    root_sizes = np.bincount(roots, weights=all_sizes, minlength=len(roots))
+    return offsets, roots, root_sizes
+
+
+def init_change_worker(current_path, previous_path):
+    """Process pool initializer, opens the two acquisitions once per worker."""
+    import rasterio
+
+    _worker['current'] = rasterio.open(current_path)
+    _worker['previous'] = rasterio.open(previous_path)
+
+
+def chromaticity(bands):
+    """Band over band sum ratios of a (3, rows, cols) array and the mask of the pixels with data."""
+    bands = bands.astype('float32')
+    total = bands.sum(axis=0)
+    valid = total > 0
+    return bands / np.where(valid, total, 1), valid
+
+
+def change_window(task):
+    """Change score of one window between the current and previous acquisitions.
+
+    task is (tile, window, decimation). Both images are read on the current
+    window bounds at 1/decimation resolution; the score is half the mean
+    absolute chromaticity difference of the pixels with data in both, from 0
+    (same colours) to 1. Chromaticity ignores overall illumination changes
+    between the acquisitions. Windows the previous image does not cover
+    score 1. Returns (tile, score).
+    """
+    from rasterio.enums import Resampling
+    from rasterio.windows import Window
+
+    tile, window, decimation = task
+    current = _worker['current']
+    previous = _worker['previous']
+    col_off, row_off, width, height = window
+    shape = (3, max(1, -(-height // decimation)), max(1, -(-width // decimation)))
+
+    # Same ground window on the previous grid, both images being north up
+    new_grid, old_grid = current.transform, previous.transform
+    west = new_grid.c + col_off * new_grid.a
+    north = new_grid.f + row_off * new_grid.e
+    previous_window = Window((west - old_grid.c) / old_grid.a, (north - old_grid.f) / old_grid.e,
+                             width * new_grid.a / old_grid.a, height * new_grid.e / old_grid.e)
+
+    new, new_valid = chromaticity(current.read((1, 2, 3), window=Window(*window), out_shape=shape,
+                                               resampling=Resampling.average))
+    old, old_valid = chromaticity(previous.read((1, 2, 3), window=previous_window, out_shape=shape,
+                                                resampling=Resampling.average, boundless=True, fill_value=0))
+    valid = new_valid & old_valid
+    if not valid.any():
+        return tile, 1.0 if new_valid.any() else 0.0
+    return tile, float(np.abs(new - old).sum(axis=0)[valid].mean() / 2)
+
+
+def otsu_threshold(values, bins=256):
+    """Otsu threshold of the finite values, maximising the between class variance."""
+    values = values[np.isfinite(values)]
+    if not len(values) or values.min() == values.max():
+        return values.max() if len(values) else 0.0
+    counts, edges = np.histogram(values, bins)
+    centres = (edges[:-1] + edges[1:]) / 2
+    weight = np.cumsum(counts)
+    mean = np.cumsum(counts * centres)
+    below = weight[:-1]
+    above = weight[-1] - below
+    variance = (mean[:-1] * weight[-1] - mean[-1] * below) ** 2 / np.maximum(below * above, 1)
+    return centres[np.argmax(variance)]
+
+
+def candidate_mask(rgb):
+    """Structure candidates of a (3, rows, cols) red, green, blue array.
+
+    Follows the F1/F3 steps of Tent Extraction on a decimated image: F3, the
+    green excess over the red and blue bands, must be below its Otsu
+    threshold (not vegetation) and F1, the mean distance of the red and green
+    bands to their chromaticity, at or above its own. The bare areas step is left out so that the
+    mask errs on the side of recall. Pixels without data are never candidates.
+    """
+    red, green, blue = rgb.astype('float64')
+    total = red + green + blue
+    valid = total > 0
+    total = np.where(valid, total, 1)
+    f1 = (np.abs(red / total - red) + np.abs(green / total - green)) / 2
+    f3 = np.maximum(green - np.minimum(red, blue), 0)
+
+    def normalize(band):
+        low, high = band[valid].min(), band[valid].max()
+        return (band - low) / (high - low) if high > low else np.zeros_like(band)
+
+    if not valid.any():
+        return valid
+    f1, f3 = normalize(f1), normalize(f3)
+    return valid & (f3 < otsu_threshold(f3[valid])) & (f1 >= otsu_threshold(f1[valid]))
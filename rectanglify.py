@@ -0,0 +1,186 @@
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+from qgis.core import (QgsProcessing,
+                       QgsField,
+                       QgsFields,
+                       QgsWkbTypes,
+                       QgsProcessingException,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterDefinition,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterFeatureSink)
+
+
+class RectanglifyStructures(QgsProcessingAlgorithm):
+    """
+    This script replaces structure polygons by their minimum rotated rectangles and adds their
+    shape metrics, processing the layer in vectorized batches.
+    """
+
+    INPUT = 'INPUT'
+    MIN_AREA = 'MIN_AREA'
+    MAX_AREA = 'MAX_AREA'
+    MAX_ELONGATION = 'MAX_ELONGATION'
+    MIN_RECTANGULARITY = 'MIN_RECTANGULARITY'
+    BATCH_SIZE = 'BATCH_SIZE'
+    WORKERS = 'WORKERS'
+    OUTPUT = 'OUTPUT'
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return RectanglifyStructures()
+
+    def name(self):
+        return 'rectanglifystructures'
+
+    def displayName(self):
+        return self.tr('Rectanglify Structures')
+
+    def group(self):
+        return self.tr('Processing Tools')
+
+    def groupId(self):
+        return 'processing'
+
+    def shortHelpString(self):
+        return self.tr('''Replaces every structure polygon by its minimum rotated rectangle, which is closer to the shape of a tent, and adds the area, elongation (long over short side of the rectangle) and rectangularity (polygon area over rectangle area) of the original polygon, with a _2 suffix when the input already has fields of these names. \n
+        Structures outside the Minimum/Maximum Area, longer than Maximum Elongation or less rectangular than Minimum Rectangularity are left out; a value of 0 disables the filter. \n
+        Features are processed in batches of Batch Size on Workers processes (0 uses one per spare CPU) and written straight to the output.''')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT,
+                self.tr('Structures'),
+                [QgsProcessing.TypeVectorPolygon]
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MIN_AREA,
+                self.tr('Minimum Area'),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=0,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MAX_AREA,
+                self.tr('Maximum Area'),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=0,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MAX_ELONGATION,
+                self.tr('Maximum Elongation'),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=0,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MIN_RECTANGULARITY,
+                self.tr('Minimum Rectangularity'),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=0,
+                minValue=0,
+                maxValue=1
+            )
+        )
+
+        param1 = QgsProcessingParameterNumber(self.BATCH_SIZE,
+                                self.tr('Batch Size'), QgsProcessingParameterNumber.Integer, 50000, minValue=100)
+        param2 = QgsProcessingParameterNumber(self.WORKERS,
+                                self.tr('Worker Processes'), QgsProcessingParameterNumber.Integer, 0, minValue=0)
+
+        param1.setFlags(param1.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        param2.setFlags(param2.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        self.addParameter(param1)
+        self.addParameter(param2)
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT,
+                self.tr('Rectangles'),
+                QgsProcessing.TypeVectorPolygon
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+
+        try:
+            from .layer_io import append_field, write_features
+            from .tiling import map_tiles, worker_count
+            from .vector_ops import rectangle_chunk
+
+        except Exception as e:
+            feedback.reportError(QCoreApplication.translate('Error','%s'%(e)))
+            feedback.reportError(QCoreApplication.translate('Error',' '))
+            feedback.reportError(QCoreApplication.translate('Error','Error loading modules - please install the shapely python module'))
+            return {}
+
+        source = self.parameterAsSource(parameters, self.INPUT, context)
+        if source is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.INPUT))
+        limits = (self.parameterAsDouble(parameters, self.MIN_AREA, context),
+                  self.parameterAsDouble(parameters, self.MAX_AREA, context),
+                  self.parameterAsDouble(parameters, self.MAX_ELONGATION, context),
+                  self.parameterAsDouble(parameters, self.MIN_RECTANGULARITY, context))
+        batch_size = self.parameterAsInt(parameters, self.BATCH_SIZE, context)
+        workers = worker_count(self.parameterAsInt(parameters, self.WORKERS, context))
+
+        fields = QgsFields(source.fields())
+        for name in ('area', 'elongation', 'rectangularity'):
+            append_field(fields, QgsField(name, QVariant.Double))
+
+        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context, fields, QgsWkbTypes.Polygon, source.sourceCrs())
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+
+        # Attributes stay in this process, only the geometries travel to the workers
+        pending = {}
+
+        def batches():
+            rows, wkbs = [], []
+            for feature in source.getFeatures():
+                if feedback.isCanceled():
+                    return
+                rows.append(feature.attributes())
+                wkbs.append(bytes(feature.geometry().asWkb()) if feature.hasGeometry() else None)
+                if len(wkbs) == batch_size:
+                    pending[len(pending)] = rows
+                    yield (len(pending) - 1, wkbs, limits)
+                    rows, wkbs = [], []
+            if wkbs:
+                pending[len(pending)] = rows
+                yield (len(pending) - 1, wkbs, limits)
+
+        total = 100.0 / source.featureCount() if source.featureCount() else 0
+        processed = 0
+        written = 0
+
+        results = map_tiles(rectangle_chunk, batches(), workers)
+        try:
+            for batch_id, index, rectangles, metrics in results:
+                if feedback.isCanceled():
+                    break
+                rows = pending[batch_id]
+                pending[batch_id] = None
+                write_features(sink, fields, [rows[i] + [float(value) for value in values] for i, values in zip(index, metrics)], rectangles)
+                processed += len(rows)
+                written += len(index)
+                feedback.setProgress(int(processed * total))
+        finally:
+            results.close()
+
+        feedback.pushInfo('{} of {} structures kept'.format(written, processed))
+
+        return {self.OUTPUT: dest_id}
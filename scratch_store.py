@@ -0,0 +1,66 @@
+"""
+/***************************************************************************
+ Memory-mapped scratch arrays of the IDP Sites Mapping toolbox.
+
+ Intermediate rasters shared between the passes of a tool are kept as raw
+ numpy.memmap files in a scratch folder instead of GeoTIFFs: nothing is
+ encoded or decoded, windows are zero-copy views, and the OS page cache
+ decides what stays in memory, so scenes larger than RAM still work. The
+ worker processes reopen an array from its spec. No qgis imports.
+ ***************************************************************************/
+"""
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+def open_array(spec, mode='r+'):
+    """Map an array from its (path, dtype, shape) spec, e.g. inside a worker process."""
+    path, dtype, shape = spec
+    return np.memmap(path, dtype=dtype, mode=mode, shape=tuple(shape))
+
+
+def window_view(array, window):
+    """Zero-copy view of a (col_off, row_off, width, height) window of a 2D array."""
+    col_off, row_off, width, height = window
+    return array[row_off:row_off + height, col_off:col_off + width]
+
+
+class ScratchStore(object):
+    """Raw arrays in a private folder created inside directory, deleted on close.
+
+    Use it as a context manager so the folder is removed even when the tool
+    fails or is canceled.
+    """
+
+    def __init__(self, directory=None):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.directory = tempfile.mkdtemp(prefix='idp_scratch_', dir=directory or None)
+        self.specs = {}
+
+    def create(self, name, shape, dtype):
+        """Create a zero filled array, returns it mapped read/write."""
+        spec = (os.path.join(self.directory, name + '.dat'), np.dtype(dtype).str, tuple(int(n) for n in shape))
+        self.specs[name] = spec
+        return open_array(spec, 'w+')
+
+    def spec(self, name):
+        """Picklable (path, dtype, shape) of an array, for open_array."""
+        return self.specs[name]
+
+    def open(self, name, mode='r+'):
+        return open_array(self.specs[name], mode)
+
+    def close(self):
+        self.specs = {}
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,174 @@
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+from qgis.core import (QgsProcessing,
+                       QgsField,
+                       QgsFields,
+                       QgsProcessingException,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterFeatureSink)
+
+
+class FilterStructuresByShape(QgsProcessingAlgorithm):
+    """
+    This script splits the structures into tent candidates and rejects using area, elongation
+    and compactness rules computed for the whole layer at once.
+    """
+
+    INPUT = 'INPUT'
+    MIN_AREA = 'MIN_AREA'
+    MAX_AREA = 'MAX_AREA'
+    MAX_ELONGATION = 'MAX_ELONGATION'
+    MIN_COMPACTNESS = 'MIN_COMPACTNESS'
+    OUTPUT = 'OUTPUT'
+    REJECTED = 'REJECTED'
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return FilterStructuresByShape()
+
+    def name(self):
+        return 'filterstructuresbyshape'
+
+    def displayName(self):
+        return self.tr('Filter Structures by Shape')
+
+    def group(self):
+        return self.tr('Processing Tools')
+
+    def groupId(self):
+        return 'processing'
+
+    def shortHelpString(self):
+        return self.tr('''Removes the structures that do not look like tents, such as long road edges or large roofs. The area (in layer units), the elongation (long over short side of the minimum rotated rectangle) and the compactness (4π·area/perimeter², 1 for a circle) are computed for the whole layer at once. \n
+        Structures smaller than Minimum Area, larger than Maximum Area, longer than Maximum Elongation or less compact than Minimum Compactness are written to the Rejected Structures output with a reason field naming the first rule they failed, or no geometry; a value of 0 disables a rule. Added fields whose name the input already uses, e.g. the area and elongation of Rectanglify Structures, get a _2 suffix. The other structures are written to the Tent Structures output. \n
+        The layer should be in a projected CRS so that the areas are in square metres.''')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT,
+                self.tr('Structures'),
+                [QgsProcessing.TypeVectorPolygon]
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MIN_AREA,
+                self.tr('Minimum Area'),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=4,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MAX_AREA,
+                self.tr('Maximum Area'),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=150,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MAX_ELONGATION,
+                self.tr('Maximum Elongation'),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=4,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MIN_COMPACTNESS,
+                self.tr('Minimum Compactness'),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=0.2,
+                minValue=0,
+                maxValue=1
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT,
+                self.tr('Tent Structures'),
+                QgsProcessing.TypeVectorPolygon
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.REJECTED,
+                self.tr('Rejected Structures'),
+                QgsProcessing.TypeVectorPolygon,
+                optional=True,
+                createByDefault=False
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+
+        try:
+            import numpy as np
+            from .layer_io import append_field, read_geometries, write_features
+            from .vector_ops import NO_GEOMETRY, REJECT_REASONS, shape_metrics, shape_rejections
+
+        except Exception as e:
+            feedback.reportError(QCoreApplication.translate('Error','%s'%(e)))
+            feedback.reportError(QCoreApplication.translate('Error',' '))
+            feedback.reportError(QCoreApplication.translate('Error','Error loading modules - please install the shapely python module'))
+            return {}
+
+        source = self.parameterAsSource(parameters, self.INPUT, context)
+        if source is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.INPUT))
+        rules = (self.parameterAsDouble(parameters, self.MIN_AREA, context),
+                 self.parameterAsDouble(parameters, self.MAX_AREA, context),
+                 self.parameterAsDouble(parameters, self.MAX_ELONGATION, context),
+                 self.parameterAsDouble(parameters, self.MIN_COMPACTNESS, context))
+
+        if source.sourceCrs().isGeographic():
+            feedback.reportError(self.tr('The Structures layer is in a geographic CRS, areas are in square degrees'))
+
+        fields = QgsFields(source.fields())
+        for name in ('area', 'elongation', 'compactness'):
+            append_field(fields, QgsField(name, QVariant.Double))
+        rejected_fields = QgsFields(fields)
+        append_field(rejected_fields, QgsField('reason', QVariant.String))
+
+        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context, fields, source.wkbType(), source.sourceCrs())
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+        (rejected_sink, rejected_id) = self.parameterAsSink(parameters, self.REJECTED, context, rejected_fields, source.wkbType(), source.sourceCrs())
+
+        feedback.pushInfo('Loading structures')
+        rows, geoms = read_geometries(source, feedback=feedback)
+        if feedback.isCanceled():
+            return {}
+
+        area, elongation, rectangularity, compactness = shape_metrics(geoms)[1:]
+        codes = shape_rejections(area, elongation, compactness, rules)
+        # Features without geometry can not be tents
+        codes[np.equal(geoms, None)] = NO_GEOMETRY
+
+        metrics = np.column_stack((area, elongation, compactness))
+        metrics = np.where(np.isfinite(metrics), metrics, None).tolist()
+        passed = np.flatnonzero(codes == 0)
+        failed = np.flatnonzero(codes > 0)
+        for code in range(1, len(REJECT_REASONS)):
+            count = np.count_nonzero(codes == code)
+            if count:
+                feedback.pushInfo('{} structures {}'.format(count, REJECT_REASONS[code]))
+        feedback.pushInfo('{} of {} structures kept'.format(len(passed), len(rows)))
+
+        write_features(sink, fields, [rows[i] + metrics[i] for i in passed], geoms[passed], feedback)
+        results = {self.OUTPUT: dest_id}
+
+        if rejected_sink is not None:
+            write_features(rejected_sink, rejected_fields,
+                           [rows[i] + metrics[i] + [REJECT_REASONS[codes[i]]] for i in failed], geoms[failed], feedback)
+            results[self.REJECTED] = rejected_id
+
+        return results
@@ -0,0 +1,180 @@
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessingUtils,
+                       QgsProcessingException,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterDefinition,
+                       QgsProcessingParameterRasterLayer,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterFile,
+                       QgsProcessingParameterRasterDestination)
+
+
+class SieveStructureMask(QgsProcessingAlgorithm):
+    """
+    This script removes the connected components of a binary structure mask smaller than a
+    minimum pixel area, labelling the mask tile by tile and joining components across tiles.
+    """
+
+    INPUT = 'INPUT'
+    MIN_PIXELS = 'MIN_PIXELS'
+    CONNECTIVITY = 'CONNECTIVITY'
+    TILE_SIZE = 'TILE_SIZE'
+    WORKERS = 'WORKERS'
+    SCRATCH_DIR = 'SCRATCH_DIR'
+    OUTPUT = 'OUTPUT'
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return SieveStructureMask()
+
+    def name(self):
+        return 'sievestructuremask'
+
+    def displayName(self):
+        return self.tr('Sieve Structure Mask')
+
+    def group(self):
+        return self.tr('Processing Tools')
+
+    def groupId(self):
+        return 'processing'
+
+    def shortHelpString(self):
+        return self.tr('''Removes the structures of a binary mask (non zero = structure) covering fewer than Minimum Pixels pixels, so specks are dropped before polygonization. Unlike GDAL Sieve, background holes are left untouched. \n
+        Connectivity sets whether diagonal pixels belong to the same structure; 4 matches the default of Polygonize. \n
+        The mask is labelled in tiles of Tile Size pixels on Workers processes (0 uses one per spare CPU) and the structures crossing tile borders are joined with a union-find, so memory use is bounded by the tile size whatever the scene size. \n
+        The tile labels of the first pass are kept in a memory-mapped scratch array instead of being computed again, so the second pass only looks up which structures to keep. The array takes 4 bytes per pixel in the Scratch Folder (the processing temporary folder when empty) and is deleted when the tool ends; point it to a fast local disk with enough free space for large scenes.''')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUT,
+                self.tr('Structure Mask')
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MIN_PIXELS,
+                self.tr('Minimum Pixels'),
+                QgsProcessingParameterNumber.Integer,
+                defaultValue=4,
+                minValue=1
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.CONNECTIVITY,
+                self.tr('Connectivity'),
+                options=['4', '8'],
+                defaultValue=0
+            )
+        )
+
+        param1 = QgsProcessingParameterNumber(self.TILE_SIZE,
+                                self.tr('Tile Size (pixels)'), QgsProcessingParameterNumber.Integer, 1024, minValue=64)
+        param2 = QgsProcessingParameterNumber(self.WORKERS,
+                                self.tr('Worker Processes'), QgsProcessingParameterNumber.Integer, 0, minValue=0)
+
+        param3 = QgsProcessingParameterFile(self.SCRATCH_DIR, self.tr('Scratch Folder'),
+                                behavior=QgsProcessingParameterFile.Folder, optional=True)
+
+        param1.setFlags(param1.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        param2.setFlags(param2.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        param3.setFlags(param3.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        self.addParameter(param1)
+        self.addParameter(param2)
+        self.addParameter(param3)
+
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                self.OUTPUT, self.tr("Sieved Structure Mask"), None, False)
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+
+        try:
+            import numpy as np
+            import rasterio
+            from rasterio.windows import Window
+            from .tiling import iter_windows, map_tiles, worker_count
+            from .scratch_store import ScratchStore
+            from .raster_ops import init_mask_worker, close_worker, label_window, sieve_window, component_roots
+
+        except Exception as e:
+            feedback.reportError(QCoreApplication.translate('Error','%s'%(e)))
+            feedback.reportError(QCoreApplication.translate('Error',' '))
+            feedback.reportError(QCoreApplication.translate('Error','Error loading modules - please install the rasterio and scipy python modules'))
+            return {}
+
+        mask = self.parameterAsRasterLayer(parameters, self.INPUT, context)
+        if mask is None:
+            raise QgsProcessingException(self.invalidRasterError(parameters, self.INPUT))
+        min_pixels = self.parameterAsInt(parameters, self.MIN_PIXELS, context)
+        connectivity = [4, 8][self.parameterAsEnum(parameters, self.CONNECTIVITY, context)]
+        tile_size = self.parameterAsInt(parameters, self.TILE_SIZE, context)
+        workers = worker_count(self.parameterAsInt(parameters, self.WORKERS, context))
+        scratch_dir = self.parameterAsFile(parameters, self.SCRATCH_DIR, context) or QgsProcessingUtils.tempFolder()
+        output_path = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
+
+        mask_path = mask.source()
+        with rasterio.open(mask_path) as src:
+            profile = src.profile.copy()
+            width, height = src.width, src.height
+            windows = list(iter_windows(width, height, tile_size))
+            grid = (-(-src.height // tile_size), -(-src.width // tile_size))
+
+        profile.update(driver='GTiff', count=1, dtype='uint8', nodata=None,
+                       compress='deflate', tiled=True, blockxsize=256, blockysize=256)
+
+        with ScratchStore(scratch_dir) as store:
+            # The labels only live on disk, the workers write and read their windows of it
+            store.create('labels', (height, width), 'int32')
+            labels_spec = store.spec('labels')
+
+            # First pass: label every tile into the scratch array and keep the label lines along the tile borders
+            feedback.pushInfo('Labelling {} tiles on {} worker(s)'.format(len(windows), workers))
+            total = 50.0 / len(windows)
+            counts = [0] * len(windows)
+            sizes = [None] * len(windows)
+            edges = [None] * len(windows)
+
+            results = map_tiles(label_window, ((tile, window, connectivity) for tile, window in enumerate(windows)),
+                                workers, init_mask_worker, (mask_path, labels_spec), close_worker)
+            try:
+                for current, (tile, count, tile_sizes, tile_edges) in enumerate(results):
+                    if feedback.isCanceled():
+                        return {}
+                    counts[tile], sizes[tile], edges[tile] = count, tile_sizes, tile_edges
+                    feedback.setProgress(int((current + 1) * total))
+            finally:
+                results.close()
+
+            offsets, roots, root_sizes = component_roots(counts, sizes, edges, grid, connectivity)
+            keep = root_sizes[roots] >= min_pixels
+            components = roots == np.arange(len(roots))
+            components[0] = False
+            feedback.pushInfo('{} of {} structures have at least {} pixels'.format(
+                np.count_nonzero(keep & components), np.count_nonzero(components), min_pixels))
+
+            def sieve_tasks():
+                for tile, window in enumerate(windows):
+                    # Local label 0 is the background
+                    yield window, np.concatenate(([False], keep[offsets[tile] + 1:offsets[tile] + counts[tile] + 1]))
+
+            # Second pass: look up the stored labels of every tile and write the structures that are large enough
+            with rasterio.open(output_path, 'w', **profile) as dst:
+                results = map_tiles(sieve_window, sieve_tasks(), workers, init_mask_worker, (mask_path, labels_spec), close_worker)
+                try:
+                    for current, (window, sieved) in enumerate(results):
+                        if feedback.isCanceled():
+                            break
+                        dst.write(sieved, 1, window=Window(*window))
+                        feedback.setProgress(50 + int((current + 1) * total))
+                finally:
+                    results.close()
+
+        return {self.OUTPUT: output_path}
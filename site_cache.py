@@ -0,0 +1,77 @@
+"""
+/***************************************************************************
+ Cache of dissolved Known IDP Sites buffers.
+
+ The site registry rarely changes between scenes, so its buffered, dissolved
+ and exploded geometries are kept in memory and on disk, keyed by whatever
+ identifies a version of the registry (source, feature count, edit
+ timestamp, buffer distance, CRS). Every entry carries an STRtree so a scene
+ only needs a bounding box lookup. No qgis imports.
+ ***************************************************************************/
+"""
+
+import os
+import pickle
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import shapely
+
+# Entries kept alive in this process, most recently used last
+MEMORY_ENTRIES = 8
+_memory = OrderedDict()
+
+
+class CachedSites(object):
+    """Buffered site polygons together with their spatial index."""
+
+    def __init__(self, geoms):
+        self.geoms = np.asarray(geoms, dtype=object)
+        self.tree = shapely.STRtree(self.geoms)
+
+    def query(self, bounds=None):
+        """Return (site_ids, geoms) of the sites whose bbox intersects bounds
+        (xmin, ymin, xmax, ymax), all sites when bounds is None."""
+        if bounds is None:
+            site_ids = np.arange(len(self.geoms))
+        else:
+            site_ids = np.sort(self.tree.query(shapely.box(*bounds)))
+        return site_ids, self.geoms[site_ids]
+
+
+def cache_key(*parts):
+    """Hash the parts identifying a version of the site registry."""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def load_or_build(key, directory, build):
+    """Return the CachedSites for key, calling build() for the geometries on a miss.
+
+    A key of None bypasses the cache, a directory of None keeps the entry in
+    memory only.
+    """
+    if key is None:
+        return CachedSites(build())
+
+    if key in _memory:
+        _memory.move_to_end(key)
+        return _memory[key]
+
+    path = os.path.join(directory, key + '.pickle') if directory else None
+    if path and os.path.exists(path):
+        with open(path, 'rb') as cached:
+            geoms = shapely.from_wkb(pickle.load(cached))
+    else:
+        geoms = build()
+        if path:
+            os.makedirs(directory, exist_ok=True)
+            # Write then rename so a concurrent run never reads a partial file
+            with open(path + '.tmp', 'wb') as cached:
+                pickle.dump(list(shapely.to_wkb(geoms)), cached)
+            os.replace(path + '.tmp', path)
+
+    _memory[key] = CachedSites(geoms)
+    while len(_memory) > MEMORY_ENTRIES:
+        _memory.popitem(last=False)
+    return _memory[key]
@@ -0,0 +1,187 @@
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+from qgis.core import (QgsProcessing,
+                       QgsField,
+                       QgsFields,
+                       QgsWkbTypes,
+                       QgsFeatureRequest,
+                       QgsProcessingFeatureSourceDefinition,
+                       QgsProcessingException,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterDefinition,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterFeatureSink)
+
+
+class OverlayStructuresWithSites(QgsProcessingAlgorithm):
+    """
+    This script clips structures to buffered known IDP sites and removes building footprints
+    using STRtree spatial indexes, only computing exact overlays for candidate pairs.
+    """
+
+    INPUT = 'INPUT'
+    SITES = 'SITES'
+    BUFFER = 'BUFFER'
+    BUILDINGS = 'BUILDINGS'
+    WORKERS = 'WORKERS'
+    CHUNK_SIZE = 'CHUNK_SIZE'
+    OUTPUT = 'OUTPUT'
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return OverlayStructuresWithSites()
+
+    def name(self):
+        return 'overlaystructures'
+
+    def displayName(self):
+        return self.tr('Overlay Structures with IDP Sites and Buildings')
+
+    def group(self):
+        return self.tr('Processing Tools')
+
+    def groupId(self):
+        return 'processing'
+
+    def shortHelpString(self):
+        return self.tr('''Keeps the parts of the structures that fall inside the buffered Known IDP Sites and removes the parts covered by the Buildings Layer. This is equivalent to native:buffer (dissolved), native:intersection and native:difference but much faster on large layers. \n
+        Sites, structures and buildings are indexed with STRtrees and checked with prepared geometries; structures fully inside a site or touching no building keep their geometry and exact intersections/differences are only computed for the remaining candidate pairs. The work is split by site over Workers processes (0 uses one per spare CPU). \n
+        The output holds the structure attributes and a site_id field identifying the buffered site part, named site_id_2 when the structures already have a site_id field.''')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT,
+                self.tr('Structures'),
+                [QgsProcessing.TypeVectorPolygon]
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.SITES,
+                self.tr('Known IDP Sites'),
+                [QgsProcessing.TypeVectorPolygon],
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.BUFFER,
+                self.tr('Site Buffer Distance'),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=5,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.BUILDINGS,
+                self.tr('Buildings Layer'),
+                [QgsProcessing.TypeVectorPolygon],
+                optional=True
+            )
+        )
+
+        param1 = QgsProcessingParameterNumber(self.WORKERS,
+                                self.tr('Worker Processes'), QgsProcessingParameterNumber.Integer, 0, minValue=0)
+        param2 = QgsProcessingParameterNumber(self.CHUNK_SIZE,
+                                self.tr('Sites per Task'), QgsProcessingParameterNumber.Integer, 64, minValue=1)
+
+        param1.setFlags(param1.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        param2.setFlags(param2.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+
+        self.addParameter(param1)
+        self.addParameter(param2)
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT,
+                self.tr('Structures'),
+                QgsProcessing.TypeVectorPolygon
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+
+        try:
+            import shapely
+            from .layer_io import append_field, read_geometries, site_buffers, write_features
+            from .tiling import map_tiles, worker_count
+            from .vector_ops import buffer_sites, overlay_chunk, overlay_tasks
+
+        except Exception as e:
+            feedback.reportError(QCoreApplication.translate('Error','%s'%(e)))
+            feedback.reportError(QCoreApplication.translate('Error',' '))
+            feedback.reportError(QCoreApplication.translate('Error','Error loading modules - please install the shapely python module'))
+            return {}
+
+        source = self.parameterAsSource(parameters, self.INPUT, context)
+        if source is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.INPUT))
+        sites_source = self.parameterAsSource(parameters, self.SITES, context)
+        buildings_source = self.parameterAsSource(parameters, self.BUILDINGS, context)
+        distance = self.parameterAsDouble(parameters, self.BUFFER, context)
+        workers = worker_count(self.parameterAsInt(parameters, self.WORKERS, context))
+        chunk_size = self.parameterAsInt(parameters, self.CHUNK_SIZE, context)
+
+        crs = source.sourceCrs()
+        fields = QgsFields(source.fields())
+        append_field(fields, QgsField('site_id', QVariant.Int))
+
+        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context, fields, QgsWkbTypes.MultiPolygon, crs)
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+
+        def overlay_request():
+            # Overlay layers are only needed as geometries in the structures CRS
+            request = QgsFeatureRequest().setNoAttributes()
+            request.setDestinationCrs(crs, context.transformContext())
+            return request
+
+        feedback.pushInfo('Loading structures')
+        rows, structures = read_geometries(source, feedback=feedback)
+
+        sites = None
+        site_ids = None
+        if sites_source is not None:
+            sites_layer = self.parameterAsVectorLayer(parameters, self.SITES, context)
+            definition = parameters[self.SITES]
+            if sites_layer is not None and not (isinstance(definition, QgsProcessingFeatureSourceDefinition) and definition.selectedFeaturesOnly):
+                # Reuse the dissolved buffers across scenes, only the sites near the structures are needed
+                feedback.pushInfo('Looking up buffered Known IDP Sites')
+                site_ids, sites = site_buffers(sites_layer, distance, crs, context, feedback).query(shapely.total_bounds(structures))
+            else:
+                feedback.pushInfo('Buffering and dissolving Known IDP Sites')
+                sites = buffer_sites(read_geometries(sites_source, overlay_request(), feedback)[1], distance)
+
+        buildings = None
+        if buildings_source is not None:
+            feedback.pushInfo('Loading buildings')
+            buildings = read_geometries(buildings_source, overlay_request(), feedback)[1]
+
+        if feedback.isCanceled():
+            return {}
+
+        tasks = overlay_tasks(structures, sites, buildings, chunk_size, site_ids)
+        task_count = -(-len(sites) // chunk_size) if sites is not None else -(-len(structures) // (chunk_size * 1000))
+        total = 100.0 / task_count if task_count else 0
+        feedback.pushInfo('Overlaying {} structures on {} worker(s)'.format(len(structures), workers))
+
+        results = map_tiles(overlay_chunk, tasks, workers)
+        written = 0
+        try:
+            for current, (structure_ids, site_ids, geoms) in enumerate(results):
+                if feedback.isCanceled():
+                    break
+                out_rows = [rows[i] + [int(site) if site >= 0 else None] for i, site in zip(structure_ids, site_ids)]
+                write_features(sink, fields, out_rows, geoms, multi=True)
+                written += len(out_rows)
+                feedback.setProgress(int((current + 1) * total))
+        finally:
+            results.close()
+
+        feedback.pushInfo('{} structure parts written'.format(written))
+
+        return {self.OUTPUT: dest_id}
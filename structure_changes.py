@@ -0,0 +1,225 @@
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+from qgis.core import (QgsProcessing,
+                       QgsField,
+                       QgsFields,
+                       QgsWkbTypes,
+                       QgsFeatureRequest,
+                       QgsProcessingException,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterDefinition,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterField,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterFeatureSink,
+                       QgsProcessingOutputNumber)
+
+
+class StructureChangeDetection(QgsProcessingAlgorithm):
+    """
+    This script matches the structures of two extractions one to one by intersection over union
+    and classifies them as new, removed or persisting, with counts per known IDP site.
+    """
+
+    BEFORE = 'BEFORE'
+    AFTER = 'AFTER'
+    MIN_IOU = 'MIN_IOU'
+    SITES = 'SITES'
+    SITE_ID = 'SITE_ID'
+    CHUNK_SIZE = 'CHUNK_SIZE'
+    OUTPUT = 'OUTPUT'
+    SITE_SUMMARY = 'SITE_SUMMARY'
+    NEW_COUNT = 'NEW_COUNT'
+    REMOVED_COUNT = 'REMOVED_COUNT'
+    PERSISTING_COUNT = 'PERSISTING_COUNT'
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return StructureChangeDetection()
+
+    def name(self):
+        return 'structurechangedetection'
+
+    def displayName(self):
+        return self.tr('Structure Change Detection')
+
+    def group(self):
+        return self.tr('Statistics')
+
+    def groupId(self):
+        return 'Statistics'
+
+    def shortHelpString(self):
+        return self.tr('''Compares the structures of two Tent Extraction runs and tells which structures appeared, disappeared or persisted. \n
+        The Earlier Structures are indexed with an STRtree and the Later Structures are matched against them in chunks, computing the intersection over union (IoU) of all overlapping pairs at once. Two structures match when each is the best overlap of the other and their IoU is at least Minimum IoU; matched later structures are persisting, unmatched later structures are new and unmatched earlier structures are removed. \n
+        The output holds the later structures and the removed earlier ones with a change field (new, removed or persisting), the IoU of persisting structures and the site of the Known IDP Sites containing them. The optional Site Summary counts the three classes per site, in fields renamed with a _2 suffix when the site layer already uses their name. Both layers are compared in the CRS of the Earlier Structures.''')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.BEFORE,
+                self.tr('Earlier Structures'),
+                [QgsProcessing.TypeVectorPolygon]
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.AFTER,
+                self.tr('Later Structures'),
+                [QgsProcessing.TypeVectorPolygon]
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MIN_IOU,
+                self.tr('Minimum IoU'),
+                QgsProcessingParameterNumber.Double,
+                defaultValue=0.3,
+                minValue=0,
+                maxValue=1
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.SITES,
+                self.tr('Known IDP Sites'),
+                [QgsProcessing.TypeVectorPolygon],
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.SITE_ID,
+                self.tr('Site Identifier Field'),
+                parentLayerParameterName=self.SITES,
+                optional=True
+            )
+        )
+
+        param = QgsProcessingParameterNumber(self.CHUNK_SIZE,
+                                self.tr('Structures per Chunk'), QgsProcessingParameterNumber.Integer, 100000, minValue=1000)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT,
+                self.tr('Structure Changes'),
+                QgsProcessing.TypeVectorPolygon
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.SITE_SUMMARY,
+                self.tr('Site Summary'),
+                QgsProcessing.TypeVectorPolygon,
+                optional=True
+            )
+        )
+        self.addOutput(QgsProcessingOutputNumber(self.NEW_COUNT, self.tr('New Structures')))
+        self.addOutput(QgsProcessingOutputNumber(self.REMOVED_COUNT, self.tr('Removed Structures')))
+        self.addOutput(QgsProcessingOutputNumber(self.PERSISTING_COUNT, self.tr('Persisting Structures')))
+
+    def processAlgorithm(self, parameters, context, feedback):
+
+        try:
+            import numpy as np
+            from .layer_io import append_field, read_geometries, write_features
+            from .population import join_sites, site_totals
+            from .vector_ops import NEW, PERSISTING, REMOVED, match_structures
+
+        except Exception as e:
+            feedback.reportError(QCoreApplication.translate('Error','%s'%(e)))
+            feedback.reportError(QCoreApplication.translate('Error',' '))
+            feedback.reportError(QCoreApplication.translate('Error','Error loading modules - please install the shapely python module'))
+            return {}
+
+        before_source = self.parameterAsSource(parameters, self.BEFORE, context)
+        if before_source is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.BEFORE))
+        after_source = self.parameterAsSource(parameters, self.AFTER, context)
+        if after_source is None:
+            raise QgsProcessingException(self.invalidSourceError(parameters, self.AFTER))
+        sites_source = self.parameterAsSource(parameters, self.SITES, context)
+        site_field = self.parameterAsString(parameters, self.SITE_ID, context)
+        min_iou = self.parameterAsDouble(parameters, self.MIN_IOU, context)
+        chunk_size = self.parameterAsInt(parameters, self.CHUNK_SIZE, context)
+
+        crs = before_source.sourceCrs()
+
+        def request():
+            return QgsFeatureRequest().setNoAttributes().setDestinationCrs(crs, context.transformContext())
+
+        feedback.pushInfo('Loading structures')
+        before = read_geometries(before_source, request(), feedback)[1]
+        after = read_geometries(after_source, request(), feedback)[1]
+        if feedback.isCanceled():
+            return {}
+
+        feedback.pushInfo('Matching {} later structures to {} earlier structures'.format(len(after), len(before)))
+        after_match, after_iou, before_match = match_structures(before, after, min_iou, chunk_size)
+        removed = np.flatnonzero(before_match < 0)
+        persisting = after_match >= 0
+
+        # Later structures first, then the removed earlier ones
+        geoms = np.concatenate((after, before[removed]))
+        changes = np.where(persisting, PERSISTING, NEW).tolist() + [REMOVED] * len(removed)
+        iou = np.concatenate((after_iou, np.zeros(len(removed))))
+        counts = {PERSISTING: int(np.count_nonzero(persisting)),
+                  NEW: int(np.count_nonzero(~persisting)),
+                  REMOVED: len(removed)}
+        feedback.pushInfo('{} new, {} removed and {} persisting structures'.format(counts[NEW], counts[REMOVED], counts[PERSISTING]))
+
+        sites = None
+        site_index = np.full(len(geoms), -1)
+        if sites_source is not None:
+            feedback.pushInfo('Joining structures to the Known IDP Sites')
+            site_request = QgsFeatureRequest().setDestinationCrs(crs, context.transformContext())
+            site_rows, sites = read_geometries(sites_source, site_request, feedback)
+            site_index = join_sites(geoms, sites)
+
+        if sites is not None and site_field:
+            site_attribute = sites_source.fields().lookupField(site_field)
+            site_key = QgsField(sites_source.fields().at(site_attribute))
+            site_key.setName('site')
+            site_values = [row[site_attribute] for row in site_rows]
+        else:
+            site_key = QgsField('site', QVariant.Int)
+            site_values = list(range(1, len(sites) + 1)) if sites is not None else []
+
+        fields = QgsFields()
+        fields.append(QgsField('change', QVariant.String))
+        fields.append(QgsField('iou', QVariant.Double))
+        fields.append(site_key)
+
+        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context, fields, QgsWkbTypes.MultiPolygon, crs)
+        if sink is None:
+            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+
+        write_features(sink, fields,
+                       [[change, float(value) if change == PERSISTING else None, site_values[s] if s >= 0 else None]
+                        for change, value, s in zip(changes, iou, site_index)],
+                       geoms, feedback, multi=True)
+
+        results = {self.OUTPUT: dest_id,
+                   self.NEW_COUNT: counts[NEW],
+                   self.REMOVED_COUNT: counts[REMOVED],
+                   self.PERSISTING_COUNT: counts[PERSISTING]}
+
+        if sites is not None:
+            classes = np.array(changes)
+            totals = site_totals(site_index, len(sites), *[classes == change for change in (NEW, REMOVED, PERSISTING)])
+
+            summary_fields = QgsFields(sites_source.fields())
+            for name in (NEW, REMOVED, PERSISTING):
+                append_field(summary_fields, QgsField(name, QVariant.Int))
+
+            (summary_sink, summary_id) = self.parameterAsSink(parameters, self.SITE_SUMMARY, context, summary_fields, QgsWkbTypes.multiType(sites_source.wkbType()), crs)
+            if summary_sink is not None:
+                write_features(summary_sink, summary_fields,
+                               [row + [int(n), int(r), int(p)] for row, n, r, p in zip(site_rows, *totals)],
+                               sites, multi=True)
+                results[self.SITE_SUMMARY] = summary_id
+
+        return results
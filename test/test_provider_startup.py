@@ -0,0 +1,61 @@
+# coding=utf-8
+"""Provider start-up time test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+import os
+import sys
+import json
+import unittest
+import subprocess
+
+# Seconds allowed to import the provider and load its algorithms
+STARTUP_BUDGET = float(os.environ.get('IDP_STARTUP_BUDGET', '2.0'))
+
+# Modules the algorithms must only import when they run
+HEAVY_MODULES = ['cv2', 'skimage', 'sklearn', 'rasterio', 'scipy', 'shapely']
+
+# Runs in a fresh interpreter so modules imported by other tests do not count
+MEASURE = """
+import os, sys, json, time, importlib
+from qgis.core import QgsApplication
+application = QgsApplication([], False)
+application.initQgis()
+sys.path.append(os.path.join(QgsApplication.pkgDataPath(), 'python', 'plugins'))
+start = time.perf_counter()
+module = importlib.import_module(sys.argv[1] + '.idp_sites_mapping_provider')
+provider = module.IDPSiteMappingProvider()
+provider.loadAlgorithms()
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed, 'algorithms': len(provider.algorithms()),
+                  'loaded': [name for name in sys.argv[2:] if name in sys.modules]}))
+"""
+
+
+class ProviderStartupTest(unittest.TestCase):
+    """Test the provider loads quickly and without the heavy modules."""
+
+    def test_provider_startup(self):
+        """Provider loads within the start-up budget."""
+        plugin_path = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+        env = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+        output = subprocess.check_output(
+            [sys.executable, '-c', MEASURE, os.path.basename(plugin_path)] + HEAVY_MODULES,
+            cwd=os.path.dirname(plugin_path), env=env)
+        measure = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+        self.assertGreater(measure['algorithms'], 0)
+        self.assertEqual(measure['loaded'], [], 'modules imported with the provider: %s' % measure['loaded'])
+        self.assertLess(measure['elapsed'], STARTUP_BUDGET,
+                        'provider loaded in %.2f s, budget %.2f s' % (measure['elapsed'], STARTUP_BUDGET))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ProviderStartupTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,86 @@
+# coding=utf-8
+"""Structure matching tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+import unittest
+
+import numpy as np
+import shapely
+
+from ..vector_ops import match_structures
+
+
+def random_structures(random, count, size=200):
+    """Rotated rectangles of 2 to 8 units scattered over a size x size area."""
+    centres = random.random((count, 2)) * size
+    half = random.uniform(1, 4, (count, 2))
+    angle = random.uniform(0, np.pi, count)
+    corners = np.array([(-1, -1), (1, -1), (1, 1), (-1, 1)])
+    cos, sin = np.cos(angle)[:, None], np.sin(angle)[:, None]
+    x = corners[:, 0] * half[:, :1]
+    y = corners[:, 1] * half[:, 1:]
+    return shapely.polygons(np.stack((centres[:, :1] + x * cos - y * sin, centres[:, 1:] + x * sin + y * cos), axis=-1))
+
+
+def brute_force_matches(before, after, min_iou):
+    """Mutual best IoU matches from the full IoU matrix."""
+    intersection = shapely.area(shapely.intersection(after[:, None], before[None, :]))
+    union = shapely.area(after)[:, None] + shapely.area(before)[None, :] - intersection
+    iou = intersection / union
+    best_before = iou.argmax(axis=1)
+    best_after = iou.argmax(axis=0)
+    after_match = np.full(len(after), -1)
+    for i, j in enumerate(best_before):
+        if iou[i, j] > 0 and iou[i, j] >= min_iou and best_after[j] == i:
+            after_match[i] = j
+    return after_match, iou
+
+
+class StructureMatchingTest(unittest.TestCase):
+    """Test match_structures against a brute force IoU matrix."""
+
+    def test_match_structures(self):
+        """Chunked STRtree matching finds the brute force mutual best matches."""
+        random = np.random.default_rng(7)
+        for count in (1, 40, 300):
+            before = random_structures(random, count)
+            # Moved, resized and new structures, some of the earlier ones removed
+            kept = before[random.random(count) < 0.7]
+            moved = np.array([shapely.transform(geom, lambda xy: xy * random.uniform(0.97, 1.03) + random.normal(0, 1, 2))
+                              for geom in kept])
+            after = np.concatenate((moved, random_structures(random, count // 3 + 1)))
+            random.shuffle(after)
+
+            expected, iou = brute_force_matches(before, after, 0.3)
+            for chunk_size in (1, 7, 1000):
+                after_match, after_iou, before_match = match_structures(before, after, 0.3, chunk_size)
+
+                message = '%d structures, chunks of %d' % (count, chunk_size)
+                np.testing.assert_array_equal(after_match, expected, message)
+                matched = np.flatnonzero(expected >= 0)
+                np.testing.assert_allclose(after_iou[matched], iou[matched, expected[matched]], err_msg=message)
+                np.testing.assert_array_equal(after_iou[expected < 0], 0, message)
+                np.testing.assert_array_equal(before_match[expected[matched]], matched, message)
+                self.assertEqual(np.count_nonzero(before_match >= 0), len(matched), message)
+
+    def test_empty_layers(self):
+        """Structures of an empty layer are all unmatched."""
+        structures = random_structures(np.random.default_rng(3), 25)
+        empty = structures[:0]
+        for before, after in ((empty, structures), (structures, empty), (empty, empty)):
+            after_match, after_iou, before_match = match_structures(before, after, 0.3)
+            np.testing.assert_array_equal(after_match, np.full(len(after), -1))
+            np.testing.assert_array_equal(after_iou, np.zeros(len(after)))
+            np.testing.assert_array_equal(before_match, np.full(len(before), -1))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(StructureMatchingTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,114 @@
+# coding=utf-8
+"""Tiled connected component tests.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import rasterio
+from rasterio.transform import Affine
+from scipy import ndimage
+
+from ..raster_ops import (close_worker, component_properties, component_roots, component_window,
+                          init_mask_worker, label_window, sieve_window, structure)
+from ..scratch_store import ScratchStore, window_view
+from ..tiling import iter_windows, map_tiles
+
+# Tile sizes splitting the test masks unevenly, down to components crossing several tiles
+TILE_SIZES = [7, 16, 33, 200]
+MIN_PIXELS = 5
+
+
+def tile_grid(shape, tile_size):
+    height, width = shape
+    windows = list(iter_windows(width, height, tile_size))
+    return windows, (-(-height // tile_size), -(-width // tile_size))
+
+
+class TiledLabelsTest(unittest.TestCase):
+    """Test the tiled labelling matches a single ndimage.label of the mask."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.masks = []
+        random = np.random.default_rng(42)
+        for density, smoothing in ((0.5, 1), (0.55, 3), (0.52, 5)):
+            noise = ndimage.uniform_filter(random.random((97, 131)), smoothing)
+            mask = (noise > np.quantile(noise, 1 - density)).astype('uint8')
+            path = os.path.join(self.directory, 'mask%d.tif' % len(self.masks))
+            with rasterio.open(path, 'w', driver='GTiff', width=mask.shape[1], height=mask.shape[0],
+                               count=1, dtype='uint8', transform=Affine(1, 0, 0, 0, -1, mask.shape[0])) as dst:
+                dst.write(mask, 1)
+            self.masks.append((path, mask))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_sieve(self):
+        """Tiled two pass sieve keeps the same pixels as a sieve of the whole mask."""
+        for path, mask in self.masks:
+            for connectivity in (4, 8):
+                labels, count = ndimage.label(mask, structure(connectivity))
+                sizes = np.bincount(labels.ravel())
+                expected = ((sizes[labels] >= MIN_PIXELS) & (labels > 0)).astype('uint8')
+
+                for tile_size in TILE_SIZES:
+                    windows, grid = tile_grid(mask.shape, tile_size)
+                    with ScratchStore(self.directory) as store:
+                        store.create('labels', mask.shape, 'int32')
+                        initargs = (path, store.spec('labels'))
+                        results = list(map_tiles(label_window, ((tile, window, connectivity) for tile, window in enumerate(windows)),
+                                                 1, init_mask_worker, initargs, close_worker))
+                        counts = [result[1] for result in results]
+                        offsets, roots, root_sizes = component_roots(counts, [result[2] for result in results],
+                                                                     [result[3] for result in results], grid, connectivity)
+                        keep = root_sizes[roots] >= MIN_PIXELS
+                        tasks = ((window, np.concatenate(([False], keep[offsets[tile] + 1:offsets[tile] + counts[tile] + 1])))
+                                 for tile, window in enumerate(windows))
+                        sieved = np.zeros_like(mask)
+                        for window, tile_mask in map_tiles(sieve_window, tasks, 1, init_mask_worker, initargs, close_worker):
+                            window_view(sieved, window)[:] = tile_mask
+
+                    np.testing.assert_array_equal(sieved, expected, 'connectivity %d, tile size %d' % (connectivity, tile_size))
+
+    def test_components(self):
+        """Tiled components have the pixels, boxes and centroids of a whole mask labelling."""
+        for path, mask in self.masks:
+            for connectivity in (4, 8):
+                labels, count = ndimage.label(mask, structure(connectivity))
+                index = np.arange(1, count + 1)
+                pixels = ndimage.sum_labels(np.ones_like(labels), labels, index)
+                centroids = np.array(ndimage.center_of_mass(np.ones_like(labels), labels, index))[:, ::-1] + 0.5
+                boxes = np.array([(box[1].start, box[0].start, box[1].stop - 1, box[0].stop - 1)
+                                  for box in ndimage.find_objects(labels)])
+                expected = np.column_stack((pixels, boxes, centroids))
+
+                for tile_size in TILE_SIZES:
+                    windows, grid = tile_grid(mask.shape, tile_size)
+                    results = list(map_tiles(component_window, ((tile, window, connectivity) for tile, window in enumerate(windows)),
+                                             1, init_mask_worker, (path,), close_worker))
+                    offsets, roots, root_sizes = component_roots([result[1] for result in results], [result[2] for result in results],
+                                                                 [result[3] for result in results], grid, connectivity)
+                    stats = np.concatenate([np.zeros((1, 9))] + [result[4] for result in results])
+                    tiled_pixels, tiled_centroids, tiled_boxes, orientation = component_properties(roots, root_sizes, stats)
+                    found = np.column_stack((tiled_pixels, tiled_boxes, tiled_centroids))
+
+                    message = 'connectivity %d, tile size %d' % (connectivity, tile_size)
+                    self.assertEqual(len(found), count, message)
+                    np.testing.assert_allclose(found[np.lexsort(found.T[::-1])], expected[np.lexsort(expected.T[::-1])],
+                                               err_msg=message)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(TiledLabelsTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,129 @@
+"""
+/***************************************************************************
+ Tiling helpers shared by the raster tools of the IDP Sites Mapping toolbox.
+
+ This module must not import qgis: its functions are pickled into worker
+ processes which only have the plugin directory on their path.
+ ***************************************************************************/
+"""
+
+import os
+import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+
+def iter_windows(width, height, tile_size):
+    """Yield (col_off, row_off, width, height) windows covering a raster."""
+    for row_off in range(0, height, tile_size):
+        for col_off in range(0, width, tile_size):
+            yield (col_off, row_off,
+                   min(tile_size, width - col_off),
+                   min(tile_size, height - row_off))
+
+
+def worker_count(requested):
+    """Resolve a worker count parameter, 0 meaning one per spare CPU."""
+    if requested > 0:
+        return requested
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+def _python_executable():
+    # Inside QGIS sys.executable points at the QGIS binary on some platforms,
+    # spawned workers need the interpreter shipped with it instead
+    name = os.path.basename(sys.executable).lower()
+    if name.startswith('python'):
+        return sys.executable
+    if os.name == 'nt':
+        candidates = [os.path.join(sys.exec_prefix, 'pythonw.exe'),
+                      os.path.join(sys.exec_prefix, 'python.exe')]
+    else:
+        candidates = [os.path.join(sys.exec_prefix, 'bin', 'python3'),
+                      os.path.join(sys.exec_prefix, 'bin', 'python')]
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            return candidate
+    return sys.executable
+
+
+def map_tiles(func, tasks, workers=1, initializer=None, initargs=(), finalizer=None):
+    """Apply func to every task and yield the results as they complete.
+
+    With a single worker the tasks run in the calling process, where
+    finalizer then releases what initializer opened. Otherwise a
+    spawned process pool is used and at most two tasks per worker are in
+    flight, so the memory held by pending results stays bounded. Closing the
+    generator early (e.g. on cancellation) cancels the remaining tasks.
+    """
+    if workers <= 1:
+        try:
+            if initializer is not None:
+                initializer(*initargs)
+            for task in tasks:
+                yield func(task)
+        finally:
+            if finalizer is not None:
+                finalizer()
+        return
+
+    context = multiprocessing.get_context('spawn')
+    context.set_executable(_python_executable())
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                   initializer=initializer, initargs=initargs)
+    tasks = iter(tasks)
+    pending = set()
+    try:
+        while True:
+            while len(pending) < 2 * workers:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                pending.add(executor.submit(func, task))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def merge_windows(boxes, gap=0):
+    """Merge (xmin, ymin, xmax, ymax) boxes that overlap or lie within gap of each other."""
+    merged = [list(box) for box in boxes]
+    changed = True
+    while changed:
+        changed = False
+        result = []
+        while merged:
+            box = merged.pop()
+            i = 0
+            while i < len(merged):
+                other = merged[i]
+                if (other[0] - gap <= box[2] and box[0] - gap <= other[2] and
+                        other[1] - gap <= box[3] and box[1] - gap <= other[3]):
+                    box = [min(box[0], other[0]), min(box[1], other[1]),
+                           max(box[2], other[2]), max(box[3], other[3])]
+                    merged.pop(i)
+                    changed = True
+                else:
+                    i += 1
+            result.append(box)
+        merged = result
+    return [tuple(box) for box in merged]
+
+
+def tile_index(x, y, origin, pixel_size, tile_size, grid):
+    """Row major index of the tile containing every (x, y) map point, -1 off the raster.
+
+    origin is the (west, north) corner and pixel_size the (x, y) pixel size of
+    a north up raster (y negative), grid its (tile rows, tile columns). NaN
+    coordinates, e.g. of missing geometries, are off the raster.
+    """
+    import numpy as np
+
+    col = np.floor((np.asarray(x, dtype=float) - origin[0]) / pixel_size[0] / tile_size)
+    row = np.floor((np.asarray(y, dtype=float) - origin[1]) / pixel_size[1] / tile_size)
+    inside = (row >= 0) & (row < grid[0]) & (col >= 0) & (col < grid[1])
+    return np.where(inside, np.where(inside, row * grid[1] + col, 0).astype('int64'), -1)
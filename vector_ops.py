@@ -0,0 +1,301 @@
+"""
+/***************************************************************************
+ Vectorized geometry operations of the IDP Sites Mapping toolbox.
+
+ Geometries are handled as shapely 2 arrays so that predicates and overlays
+ run in bulk instead of per feature. No qgis imports, the chunk functions
+ run inside worker processes.
+ ***************************************************************************/
+"""
+
+import numpy as np
+import shapely
+
+POLYGONAL = (shapely.GeometryType.POLYGON, shapely.GeometryType.MULTIPOLYGON)
+
+
+def polygonal(geoms):
+    """Reduce overlay results to their polygonal parts, empty where there are none."""
+    geoms = np.asarray(geoms, dtype=object)
+    types = shapely.get_type_id(geoms)
+    mixed = np.flatnonzero(~np.isin(types, POLYGONAL) & ~shapely.is_empty(geoms))
+    for i in mixed:
+        parts = shapely.get_parts(geoms[i])
+        parts = parts[np.isin(shapely.get_type_id(parts), POLYGONAL)]
+        geoms[i] = shapely.union_all(parts) if len(parts) else shapely.Polygon()
+    return geoms
+
+
+def buffer_sites(sites, distance, segments=5):
+    """Buffer, dissolve and explode site polygons, like native:buffer with DISSOLVE
+    followed by native:multiparttosingleparts."""
+    buffered = shapely.buffer(sites[~shapely.is_missing(sites)], distance, quad_segs=segments)
+    return shapely.get_parts(shapely.union_all(buffered))
+
+
+def union_per_group(groups, geoms):
+    """Union geoms grouped by the (unsorted) group index, returns (unique groups, unions)."""
+    order = np.argsort(groups, kind='stable')
+    groups, geoms = groups[order], geoms[order]
+    unique, starts = np.unique(groups, return_index=True)
+    unions = [shapely.union_all(block) if len(block) > 1 else block[0]
+              for block in np.split(geoms, starts[1:])]
+    return unique, np.array(unions, dtype=object)
+
+
+def overlay_chunk(task):
+    """Intersect structures with sites and subtract buildings for one chunk.
+
+    task is (site_ids, sites, structure_ids, structures, buildings) where sites
+    or buildings may be None. Structures fully inside a site or touching no
+    building keep their geometry, exact overlays are only computed for the
+    candidate pairs that need them. Returns (structure_ids, site_ids, geoms)
+    with one row per non empty structure/site piece.
+    """
+    site_ids, sites, structure_ids, structures, buildings = task
+
+    if sites is not None:
+        shapely.prepare(sites)
+        tree = shapely.STRtree(structures)
+        site_idx, struct_idx = tree.query(sites, predicate='intersects')
+        pieces = structures[struct_idx].copy()
+        clip = ~shapely.contains_properly(sites[site_idx], pieces)
+        pieces[clip] = shapely.intersection(pieces[clip], sites[site_idx[clip]])
+        out_structures = structure_ids[struct_idx]
+        out_sites = site_ids[site_idx]
+    else:
+        pieces = structures.copy()
+        out_structures = structure_ids
+        out_sites = np.full(len(structures), -1)
+
+    if buildings is not None and len(buildings) and len(pieces):
+        tree = shapely.STRtree(buildings)
+        piece_idx, building_idx = tree.query(pieces, predicate='intersects')
+        if piece_idx.size:
+            hit, footprints = union_per_group(piece_idx, buildings[building_idx])
+            pieces[hit] = shapely.difference(pieces[hit], footprints)
+
+    pieces = polygonal(pieces)
+    keep = ~shapely.is_empty(pieces) & (shapely.area(pieces) > 0)
+    return out_structures[keep], out_sites[keep], pieces[keep]
+
+
+def overlay_tasks(structures, sites=None, buildings=None, chunk_size=64, site_ids=None):
+    """Split an overlay into overlay_chunk tasks.
+
+    With sites the work is split by site, each task only carrying the
+    structures that intersect its sites and the buildings that intersect
+    those structures. Without sites it is split by runs of structures.
+    site_ids defaults to the position of each site.
+    """
+    structure_tree = shapely.STRtree(structures)
+    building_tree = shapely.STRtree(buildings) if buildings is not None and len(buildings) else None
+
+    def candidate_buildings(candidates):
+        if building_tree is None:
+            return None
+        idx = np.unique(building_tree.query(candidates, predicate='intersects')[1])
+        return buildings[idx]
+
+    if sites is not None:
+        if site_ids is None:
+            site_ids = np.arange(len(sites))
+        for start in range(0, len(sites), chunk_size):
+            chunk = sites[start:start + chunk_size]
+            struct_idx = np.unique(structure_tree.query(chunk, predicate='intersects')[1])
+            if not struct_idx.size:
+                continue
+            candidates = structures[struct_idx]
+            yield (site_ids[start:start + chunk_size], chunk, struct_idx, candidates,
+                   candidate_buildings(candidates))
+    else:
+        step = chunk_size * 1000
+        for start in range(0, len(structures), step):
+            struct_idx = np.arange(start, min(start + step, len(structures)))
+            candidates = structures[struct_idx]
+            yield (None, None, struct_idx, candidates, candidate_buildings(candidates))
+
+
+def clean_polygons(geoms, min_hole_area=0):
+    """Explode, repair and remove small holes in one vectorized pass.
+
+    Equivalent to native:multiparttosingleparts, native:fixgeometries and
+    native:deleteholes. Returns (index, polygons) where index maps every
+    single part polygon back to its input geometry; empty and zero area
+    pieces are dropped.
+    """
+    geoms = shapely.make_valid(np.asarray(geoms, dtype=object))
+    parts, index = shapely.get_parts(geoms, return_index=True)
+    # make_valid may nest multi polygons inside collections
+    nested = shapely.get_type_id(parts) >= shapely.GeometryType.MULTIPOINT
+    while nested.any():
+        sub_parts, sub_index = shapely.get_parts(parts[nested], return_index=True)
+        parts = np.concatenate((parts[~nested], sub_parts))
+        index = np.concatenate((index[~nested], index[nested][sub_index]))
+        nested = shapely.get_type_id(parts) >= shapely.GeometryType.MULTIPOINT
+    polygons = shapely.get_type_id(parts) == shapely.GeometryType.POLYGON
+    parts, index = parts[polygons], index[polygons]
+
+    if min_hole_area > 0:
+        holed = np.flatnonzero(shapely.get_num_interior_rings(parts) > 0)
+        if holed.size:
+            rings, ring_owner = shapely.get_rings(parts[holed], return_index=True)
+            # The first ring of every polygon is its exterior
+            exterior = np.r_[True, ring_owner[1:] != ring_owner[:-1]]
+            keep = exterior | (shapely.area(shapely.polygons(rings)) >= min_hole_area)
+            parts[holed] = shapely.polygons(rings[keep], indices=ring_owner[keep])
+
+    keep = ~shapely.is_empty(parts) & (shapely.area(parts) > 0)
+    return index[keep], parts[keep]
+
+
+def clean_chunk(task):
+    """Worker entry point for clean_polygons, task is (batch_id, wkbs, min_hole_area)."""
+    batch_id, wkbs, min_hole_area = task
+    index, parts = clean_polygons(shapely.from_wkb(wkbs), min_hole_area)
+    return batch_id, index, parts
+
+
+def shape_metrics(geoms):
+    """Minimum rotated rectangles and shape metrics of polygons, in one vectorized pass.
+
+    Returns (rectangles, area, elongation, rectangularity, compactness):
+    elongation is the long over the short side of the rectangle,
+    rectangularity the polygon area over the rectangle area and compactness
+    the isoperimetric quotient 4πA/P² (1 for a circle).
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    area = shapely.area(geoms)
+    perimeter = shapely.length(geoms)
+    rectangles = shapely.oriented_envelope(geoms)
+
+    # Degenerate inputs give a line or point envelope, their sides stay 0
+    sides = np.zeros((len(geoms), 2))
+    boxes = (shapely.get_type_id(rectangles) == shapely.GeometryType.POLYGON) & ~shapely.is_empty(rectangles)
+    if boxes.any():
+        corners = shapely.get_coordinates(shapely.get_exterior_ring(rectangles[boxes])).reshape(-1, 5, 2)
+        sides[boxes] = np.sort(np.column_stack((np.hypot(*(corners[:, 1] - corners[:, 0]).T),
+                                                np.hypot(*(corners[:, 2] - corners[:, 1]).T))), axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        elongation = np.where(sides[:, 0] > 0, sides[:, 1] / sides[:, 0], np.inf)
+        rectangularity = np.where(sides[:, 0] > 0, area / (sides[:, 0] * sides[:, 1]), 0)
+        compactness = np.where(perimeter > 0, 4 * np.pi * area / perimeter ** 2, 0)
+
+    return rectangles, area, elongation, rectangularity, compactness
+
+
+def rectangle_chunk(task):
+    """Worker entry point of the rectanglify tool.
+
+    task is (batch_id, wkbs, limits) with limits the (minimum area, maximum
+    area, maximum elongation, minimum rectangularity) filters, 0 disabling a
+    filter. Returns (batch_id, index, rectangles, metrics) for the polygons
+    passing the filters, metrics holding their area, elongation and
+    rectangularity columns.
+    """
+    batch_id, wkbs, limits = task
+    min_area, max_area, max_elongation, min_rectangularity = limits
+    rectangles, area, elongation, rectangularity = shape_metrics(shapely.from_wkb(wkbs))[:4]
+
+    keep = ~shapely.is_missing(rectangles) & (area > 0)
+    if min_area:
+        keep &= area >= min_area
+    if max_area:
+        keep &= area <= max_area
+    if max_elongation:
+        keep &= elongation <= max_elongation
+    if min_rectangularity:
+        keep &= rectangularity >= min_rectangularity
+
+    index = np.flatnonzero(keep)
+    return batch_id, index, rectangles[index], np.column_stack((area, elongation, rectangularity))[index]
+
+
+# Reason codes of shape_rejections, 0 meaning the structure passes every rule
+REJECT_REASONS = ['', 'too small', 'too large', 'too elongated', 'not compact', 'no geometry']
+# Code of the features without geometry, set by the caller
+NO_GEOMETRY = 5
+
+
+def shape_rejections(area, elongation, compactness, rules):
+    """Code of the first tent rule failed by every structure, 0 when all pass.
+
+    rules is (minimum area, maximum area, maximum elongation, minimum
+    compactness), 0 disabling a rule; codes index REJECT_REASONS.
+    """
+    min_area, max_area, max_elongation, min_compactness = rules
+    codes = np.zeros(len(area), dtype='uint8')
+    # Apply in reverse so the first failed rule is the one reported
+    checks = [(min_area, area < min_area), (max_area, area > max_area),
+              (max_elongation, elongation > max_elongation), (min_compactness, compactness < min_compactness)]
+    for code in range(len(checks), 0, -1):
+        limit, failed = checks[code - 1]
+        if limit:
+            codes[failed] = code
+    return codes
+
+
+# Change classes of match_structures results
+PERSISTING = 'persisting'
+NEW = 'new'
+REMOVED = 'removed'
+
+
+def pair_iou(a, b):
+    """Intersection over union of the geometry pairs a[i], b[i]."""
+    try:
+        intersection = shapely.area(shapely.intersection(a, b))
+    except shapely.errors.GEOSException:
+        intersection = shapely.area(shapely.intersection(shapely.make_valid(a), shapely.make_valid(b)))
+    union = shapely.area(a) + shapely.area(b) - intersection
+    return np.where(union > 0, intersection / np.where(union > 0, union, 1), 0)
+
+
+def match_structures(before, after, min_iou=0.3, chunk_size=100000):
+    """Match the structures of two extractions one to one by mutual best IoU.
+
+    The before layer is indexed once with an STRtree and the after layer is
+    queried in chunks of chunk_size, so memory stays bounded; the IoU of all
+    the intersecting pairs of a chunk is computed at once. Two structures
+    match when each is the best overlap of the other and their IoU is at
+    least min_iou. Returns (after_match, after_iou, before_match): the index
+    of the matched structure in the other layer, -1 when unmatched, and the
+    IoU of the after matches.
+    """
+    if len(before) == 0:
+        return np.full(len(after), -1), np.zeros(len(after)), np.full(0, -1)
+
+    tree = shapely.STRtree(before)
+    best_after = np.full(len(after), -1)
+    best_after_iou = np.zeros(len(after))
+    best_before = np.full(len(before), -1)
+    best_before_iou = np.zeros(len(before))
+
+    for start in range(0, len(after), chunk_size):
+        block = after[start:start + chunk_size]
+        after_idx, before_idx = tree.query(block, predicate='intersects')
+        if not len(after_idx):
+            continue
+        iou = pair_iou(block[after_idx], before[before_idx])
+        after_idx = after_idx + start
+
+        # Best before structure of every after structure, all its pairs are in this chunk
+        order = np.lexsort((-iou, after_idx))
+        first = order[np.unique(after_idx[order], return_index=True)[1]]
+        best_after[after_idx[first]] = before_idx[first]
+        best_after_iou[after_idx[first]] = iou[first]
+
+        # Best after structure of every before structure so far
+        order = np.lexsort((-iou, before_idx))
+        first = order[np.unique(before_idx[order], return_index=True)[1]]
+        better = first[iou[first] > best_before_iou[before_idx[first]]]
+        best_before[before_idx[better]] = after_idx[better]
+        best_before_iou[before_idx[better]] = iou[better]
+
+    matched = ((best_after >= 0) & (best_after_iou >= min_iou) &
+               (best_before[np.maximum(best_after, 0)] == np.arange(len(after))))
+    after_match = np.where(matched, best_after, -1)
+    before_match = np.full(len(before), -1)
+    before_match[after_match[matched]] = np.flatnonzero(matched)
+    return after_match, np.where(matched, best_after_iou, 0), before_match